@@ -0,0 +1,399 @@
+'''Synthetic acquisition data, and conversion benchmark
+
+Generates a run of .dat files, with .hdr, similar to a real acquisition.
+Then times conversion with convert2j() of each chassis in turn,
+with the time spent reading, decoding, and writing,
+and of the whole run with atf_engine.convert.
+
+$ python -m atf_engine.bench /tmp/bench --chassis 4 --size 2G -o result.json
+$ python -m atf_engine.bench /tmp/bench --keep --baseline result.json
+
+Results are written as JSON.  With --baseline, exits non-zero if any stage
+is slower than in a previous result.
+'''
+
+import asyncio
+import json
+import logging
+import math
+import os
+import platform
+import random
+import resource
+import shlex
+import shutil
+import struct
+import sys
+import time
+from array import array
+from contextlib import redirect_stdout
+from pathlib import Path
+
+from ._convert import convert2j, isa
+from .convert import parse_size
+
+_log = logging.getLogger(__name__)
+
+# PSCHead, then QuartzNA, optionally QuartzNB.  See convert2j.cpp
+_headNA = struct.Struct('>2sHIII' 'IIQII')
+_headNB = struct.Struct('>2sHIII' 'IIQII' 'IIII')
+MTU = 1500-40 # less IP+UDP headers
+
+def encode24(values) -> bytes:
+    'Pack integers as 24-bit big endian, two\'s complement'
+    be = array('i', values)
+    if sys.byteorder=='little':
+        be.byteswap()
+    raw = memoryview(be).cast('B')
+    out = bytearray(3*len(be))
+    out[0::3] = raw[1::4]
+    out[1::3] = raw[2::4]
+    out[2::3] = raw[3::4]
+    return bytes(out)
+
+def time_points(chmask:int) -> int:
+    'Number of time points per packet'
+    return (MTU - _headNB.size)//(3*bin(chmask).count('1'))
+
+class Generator:
+    '''Packets of one chassis.
+
+    Each channel is a sine wave, with a different phase, plus noise.
+    Bodies are encoded once, and re-used in rotation.
+
+    gap_every - Drop gap_length packets after every gap_every packets.  0 for none.
+    nb_fraction - Fraction of packets with limits ("NB") rather than without ("NA").
+    '''
+    nbody = 64
+
+    def __init__(self, chmask:int=0xffffffff, rate:float=250e3, start:int=None,
+                 gap_every:int=0, gap_length:int=1, nb_fraction:float=1.0, seed:int=0):
+        self.chmask = chmask
+        self.nchan = bin(chmask).count('1')
+        self.ntime = time_points(chmask)
+        self.period = int(self.ntime/rate*1e9) # ns per packet
+        self.start = int(time.time())*10**9 if start is None else start
+        self.gap_every, self.gap_length = gap_every, gap_length
+        self.nb_fraction = nb_fraction
+        self._rand = random.Random(seed)
+        self.seqno = 0
+        self.npkt = 0 # written
+
+        # one cycle over all bodies
+        cycle = self.nbody*self.ntime
+        self._bodies = []
+        for b in range(self.nbody):
+            values = []
+            for t in range(b*self.ntime, (b+1)*self.ntime):
+                for c in range(self.nchan):
+                    V = 2**22*math.sin(2*math.pi*(t/cycle + c/self.nchan))
+                    values.append(int(V) + self._rand.randint(-64, 64))
+            self._bodies.append(encode24(values))
+
+    def values(self, n:int, chan:int) -> [int]:
+        '''Expected samples of channel index chan (0 is the first in chmask) of packet number n.
+
+        Used to check conversion.
+        '''
+        body = self._bodies[n % self.nbody]
+        ret = []
+        for t in range(self.ntime):
+            i = 3*(t*self.nchan + chan)
+            ret.append(int.from_bytes(body[i:i+3], 'big', signed=True))
+        return ret
+
+    def packets(self, nbytes:int) -> bytes:
+        'Next packets, approximately nbytes'
+        parts = []
+        total = 0
+        while total < nbytes:
+            if self.gap_every and self.seqno and self.seqno % (self.gap_every + self.gap_length) == self.gap_every:
+                self.seqno += self.gap_length
+
+            body = self._bodies[self.seqno % self.nbody]
+            sec, ns = divmod(self.start + self.seqno*self.period, 10**9)
+            if self._rand.random() < self.nb_fraction:
+                msglen = _headNB.size - 16 + len(body)
+                head = _headNB.pack(b'PS', 0x4e42, msglen, sec, ns,
+                                    0, self.chmask, self.seqno, sec, ns,
+                                    0x11111111, 0x22222222, 0x44444444, 0x88888888)
+            else:
+                msglen = _headNA.size - 16 + len(body)
+                head = _headNA.pack(b'PS', 0x4e41, msglen, sec, ns,
+                                    0, self.chmask, self.seqno, sec, ns)
+            parts.append(head)
+            parts.append(body)
+            total += len(head) + len(body)
+            self.seqno += 1
+            self.npkt += 1
+        return b''.join(parts)
+
+def generate(outdir:Path, chassis:int=1, size:int=1024**3, dat_size:int=256*1024**2,
+             chmask:int=0xffffffff, **kws) -> (Path, int):
+    '''Write a run of .dat files, and .hdr, into outdir.
+
+    size - bytes per chassis
+    dat_size - bytes per .dat file
+    kws - passed to Generator
+
+    Returns the .hdr file and the number of packets written.
+    '''
+    outdir.mkdir(parents=True, exist_ok=True)
+    start = int(time.time())*10**9
+    info = {
+        'AcquisitionId': 'atf_engine.bench',
+        'AcquisitionStartDate': time.strftime('%Y%m%d %H%M%S%z', time.localtime(start//10**9)),
+        'Signals': [],
+        'Chassis': [],
+    }
+    chunk = 4*1024**2
+    npkt = 0
+    for chas in range(1, chassis+1):
+        G = Generator(chmask, start=start, seed=chas, **kws)
+        dats = []
+        remaining = size
+        while remaining > 0:
+            dat = f'bench-CH{chas:02d}-{len(dats)}.dat'
+            with (outdir / dat).open('wb') as F:
+                written = 0
+                while written < dat_size and remaining > 0:
+                    buf = G.packets(min(chunk, remaining, dat_size - written))
+                    F.write(buf)
+                    written += len(buf)
+                    remaining -= len(buf)
+            dats.append(dat)
+        npkt += G.npkt
+
+        info['Chassis'].append({'Chassis':chas, 'Dat':dats})
+        for ch in range(1, 33):
+            if chmask & (1<<(ch-1)):
+                info['Signals'].append({
+                    'Address': {'Chassis':chas, 'Channel':ch},
+                    'SigNum': (chas-1)*32 + ch,
+                    'Name': f'CH{chas:02d}:{ch:02d}',
+                })
+
+    hdr = outdir / 'bench.hdr'
+    with hdr.open('w') as F:
+        json.dump(info, F, indent='  ')
+    return hdr, npkt
+
+def reset_peak_rss():
+    try:
+        Path('/proc/self/clear_refs').write_text('5') # Linux >= 4.0
+    except OSError:
+        pass
+
+def peak_rss() -> int:
+    'Peak resident memory in bytes of this process, since reset_peak_rss()'
+    try:
+        with open('/proc/self/status') as F:
+            for line in F:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])*1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+class Stage:
+    'Time one stage.  Counts of bytes and packets may be updated before the end'
+    def __init__(self, name:str, nbytes:int=0, npkt:int=0):
+        self.name, self.nbytes, self.npkt = name, nbytes, npkt
+        self.result = {}
+
+    def __enter__(self):
+        reset_peak_rss()
+        self._C0 = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        self._T0 = time.monotonic()
+        self._P0 = time.process_time()
+        return self
+
+    def __exit__(self, A, B, C):
+        wall = time.monotonic() - self._T0
+        R = self.result
+        R.update({'name':self.name, 'bytes':self.nbytes, 'packets':self.npkt})
+        R['wall'] = wall
+        R['cpu'] = time.process_time() - self._P0
+        R['MBps'] = R['bytes']/wall/1e6
+        R['packets_per_s'] = R['packets']/wall
+        R['peak_rss'] = peak_rss()
+        C1 = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        if C1 > self._C0:
+            R['peak_rss_children'] = C1*1024
+        _log.info('%s : %.1f sec, %.0f MB/s, %.0f packets/s, peak RSS %d MB',
+                  R['name'], wall, R['MBps'], R['packets_per_s'], R['peak_rss']//1024**2)
+
+def dat_files(hdr:Path) -> {int:[Path]}:
+    with hdr.open() as F:
+        info = json.load(F)
+    return {C['Chassis']: [hdr.parent / d for d in C['Dat']] for C in info['Chassis']}
+
+def run(args) -> dict:
+    data = args.dir / 'data'
+    hdr = data / 'bench.hdr'
+    stages = []
+    npkt = None
+
+    if not (args.keep and hdr.exists()):
+        shutil.rmtree(data, ignore_errors=True)
+        nbytes = args.chassis*args.size
+        with Stage('generate', nbytes) as S:
+            hdr, S.npkt = generate(data, chassis=args.chassis, size=args.size, dat_size=args.dat_size,
+                                 chmask=args.chmask, rate=args.rate, gap_every=args.gap_every,
+                                 gap_length=args.gap_length, nb_fraction=args.nb_fraction)
+        npkt = S.npkt
+        stages.append(S.result)
+
+    dats = dat_files(hdr)
+    nbytes = sum(d.stat().st_size for D in dats.values() for d in D)
+    if npkt is None: # count packets
+        npkt = 0
+        for D in dats.values():
+            for d in D:
+                with d.open('rb') as F:
+                    while (head := F.read(16)):
+                        F.seek(struct.unpack_from('>I', head, 4)[0], 1)
+                        npkt += 1
+
+    out = args.dir / 'out'
+    for rep in range(args.repeat):
+        if 'convert2j' in args.stages:
+            # outside of the timed stage
+            shutil.rmtree(out, ignore_errors=True)
+            for chas in dats:
+                (out / f'CH{chas:02d}').mkdir(parents=True)
+            # summed over all chassis
+            times = {'read_time':0.0, 'decode_time':0.0, 'write_time':0.0}
+            with Stage('convert2j', nbytes, npkt) as S:
+                errors = 0
+                for chas, D in dats.items():
+                    errs, stats = convert2j([str(d) for d in D], out / f'CH{chas:02d}', threads=args.threads,
+                                            overview=args.overview, compress=args.compress, stats=True)
+                    errors += len(errs)
+                    for key in times:
+                        times[key] += stats[key]
+            S.result['errors'] = errors
+            S.result.update(times)
+            stages.append(S.result)
+            shutil.rmtree(out, ignore_errors=True)
+
+        if 'convert' in args.stages:
+            from .convert import getargs, main
+            shutil.rmtree(out, ignore_errors=True)
+            cargs = getargs().parse_args([str(hdr), str(out / 'bench.hdr')] + args.convert_args)
+            # errors are printed.  Keep stdout for our result
+            with Stage('convert', nbytes, npkt) as S, redirect_stdout(sys.stderr):
+                S.result['status'] = asyncio.run(main(cargs))
+            stages.append(S.result)
+
+    shutil.rmtree(out, ignore_errors=True)
+
+    return {
+        'version': 1,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'host': {
+            'node': platform.node(),
+            'machine': platform.machine(),
+            'cpus': len(os.sched_getaffinity(0)),
+            'python': platform.python_version(),
+            'isa': isa(),
+        },
+        'config': {
+            'chassis': args.chassis,
+            'size': args.size,
+            'dat_size': args.dat_size,
+            'chmask': args.chmask,
+            'rate': args.rate,
+            'gap_every': args.gap_every,
+            'gap_length': args.gap_length,
+            'nb_fraction': args.nb_fraction,
+            'threads': args.threads,
+            'overview': args.overview,
+            'compress': args.compress,
+            'convert_args': args.convert_args,
+        },
+        'stages': stages,
+    }
+
+def compare(result:dict, baseline:dict, tolerance:float) -> [str]:
+    'List stages slower than in baseline by more than tolerance (fraction)'
+    best = {}
+    for S in baseline['stages']:
+        best[S['name']] = max(best.get(S['name'], 0), S['MBps'])
+    slow = []
+    for S in result['stages']:
+        ref = best.get(S['name'])
+        if ref and S['MBps'] < ref*(1-tolerance):
+            slow.append(f"{S['name']} {S['MBps']:.0f} MB/s < {ref:.0f} MB/s")
+    return slow
+
+def getargs():
+    from argparse import ArgumentParser
+    P = ArgumentParser(description='Generate synthetic .dat files and time their conversion')
+    P.add_argument('-v', '--verbose', dest='level', default=logging.INFO,
+                   action='store_const', const=logging.DEBUG,
+                   help='Enable extra application logging')
+    P.add_argument('dir', type=Path,
+                   help='Working directory for generated data and output')
+    P.add_argument('-o', '--output', type=Path,
+                   help='Write JSON result to file.  Default to stdout')
+    P.add_argument('--keep', action='store_true',
+                   help='Re-use data generated by a previous run, if present')
+    P.add_argument('--chassis', type=int, default=1,
+                   help='Number of chassis.  Default 1')
+    P.add_argument('--size', type=parse_size, default=1024**3,
+                   help='Bytes of .dat per chassis.  eg. "4G".  Default 1G')
+    P.add_argument('--dat-size', type=parse_size, default=256*1024**2,
+                   help='Bytes per .dat file.  Default 256M')
+    P.add_argument('--chmask', type=lambda s: int(s, 0), default=0xffffffff,
+                   help='Channel mask.  Default all 32 channels')
+    P.add_argument('--rate', type=float, default=250e3,
+                   help='Sample rate in Hz.  Default 250e3')
+    P.add_argument('--gap-every', type=int, default=0,
+                   help='Drop packets after every this many.  Default 0, no gaps')
+    P.add_argument('--gap-length', type=int, default=1,
+                   help='Number of packets dropped for each gap.  Default 1')
+    P.add_argument('--nb-fraction', type=float, default=1.0,
+                   help='Fraction of packets with limits (NB), instead of without (NA).  Default 1.0')
+    P.add_argument('--stages', default='convert2j,convert',
+                   help='Comma separated list of stages to time.  "convert2j" and/or "convert"')
+    P.add_argument('--repeat', type=int, default=1,
+                   help='Number of times to repeat each stage')
+    P.add_argument('--threads', type=int, default=1,
+                   help='convert2j() threads for the "convert2j" stage.  Default 1')
+    P.add_argument('--overview', action='store_true',
+                   help='convert2j() with overview for the "convert2j" stage')
+    P.add_argument('--compress', action='store_true',
+                   help='convert2j() with compression for the "convert2j" stage')
+    P.add_argument('--baseline', type=Path,
+                   help='JSON result of a previous run.  Exit 1 if any stage is slower')
+    P.add_argument('--tolerance', type=float, default=0.1,
+                   help='Fraction by which a stage may be slower than baseline.  Default 0.1')
+    P.add_argument('--convert-args', type=shlex.split, default=[],
+                   help='Extra arguments for the "convert" stage.  eg. --convert-args="--compress -j 4"')
+    return P
+
+def main(args) -> int:
+    args.stages = args.stages.split(',')
+
+    result = run(args)
+
+    if args.output:
+        with args.output.open('w') as F:
+            json.dump(result, F, indent='  ')
+    else:
+        json.dump(result, sys.stdout, indent='  ')
+        print()
+
+    if args.baseline:
+        with args.baseline.open() as F:
+            slow = compare(result, json.load(F), args.tolerance)
+        for msg in slow:
+            _log.error('Regression: %s', msg)
+        return 1 if slow else 0
+    return 0
+
+if __name__=='__main__':
+    args = getargs().parse_args()
+    logging.basicConfig(level=args.level)
+    sys.exit(main(args))
@@ -0,0 +1,332 @@
+'''Catalog of recorded runs
+
+An SQLite database with one row per .hdr, and one per in-use signal of each,
+so that runs may be found without reading every .hdr under /data.
+The engine adds each run when its conversion completes.
+
+$ python -m atf_engine.catalog index /data
+$ python -m atf_engine.catalog query --signal SomeName --chassis 7 --since 2024-07-01
+
+>>> with Catalog('/data/.catalog.sqlite') as C:
+...     C.add(read_run(Path('/data/.../run.hdr')))
+...     for run in C.query(name='SomeName', since=...):
+...         print(run['hdr'])
+'''
+
+import json
+import logging
+import os
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from .convert import parse_time
+
+_log = logging.getLogger(__name__)
+
+__all__ = (
+    'Catalog',
+    'read_run',
+)
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    hdr TEXT UNIQUE NOT NULL, -- absolute path
+    hdr_mtime_ns INTEGER NOT NULL,
+    hdr_size INTEGER NOT NULL,
+    acquisition_id TEXT,
+    start_ns INTEGER, -- AcquisitionStartDate as POSIX nanoseconds
+    end_ns INTEGER,
+    sample_rate REAL,
+    cccr TEXT,
+    status TEXT NOT NULL, -- Unconverted, Success, or Errors
+    errors INTEGER NOT NULL,
+    gaps INTEGER NOT NULL,
+    dat_bytes INTEGER NOT NULL,
+    j_bytes INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_start ON runs(start_ns);
+CREATE TABLE IF NOT EXISTS signals (
+    run INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    signum INTEGER,
+    chassis INTEGER,
+    channel INTEGER,
+    name TEXT,
+    desc TEXT,
+    egu TEXT,
+    slope REAL,
+    intercept REAL,
+    jfile TEXT, -- absolute path
+    j_bytes INTEGER
+);
+CREATE INDEX IF NOT EXISTS signals_run ON signals(run);
+CREATE INDEX IF NOT EXISTS signals_name ON signals(name);
+CREATE INDEX IF NOT EXISTS signals_chassis ON signals(chassis);
+'''
+
+def _size(path:Path) -> int:
+    try:
+        return path.stat().st_size
+    except OSError:
+        return 0
+
+def _date_ns(val:str) -> int:
+    if not val:
+        return None
+    try:
+        return int(round(datetime.strptime(val, '%Y%m%d %H%M%S%z').timestamp()*1e9))
+    except ValueError:
+        return None
+
+def read_run(hdr:Path) -> dict:
+    '''Summarize one .hdr as a catalog entry.
+
+    Run by worker processes when indexing.
+    '''
+    hdr = Path(hdr).absolute()
+    S = hdr.stat()
+    with hdr.open() as F:
+        info = json.load(F)
+
+    Chassis = info.get('Chassis', [])
+    if Chassis and all('Errors' in C for C in Chassis):
+        errors = sum(len(C['Errors']) for C in Chassis)
+        status = 'Errors' if errors else 'Success'
+    else:
+        errors, status = 0, 'Unconverted'
+
+    signals = []
+    for sig in info.get('Signals', []):
+        jfile = sig.get('OutDataFile')
+        jfile = str(hdr.parent / jfile) if jfile else None
+        signals.append({
+            'signum': sig.get('SigNum'),
+            'chassis': sig['Address']['Chassis'],
+            'channel': sig['Address']['Channel'],
+            'name': sig.get('Name'),
+            'desc': sig.get('Desc'),
+            'egu': sig.get('Egu'),
+            'slope': sig.get('Slope'),
+            'intercept': sig.get('Intercept'),
+            'jfile': jfile,
+            'j_bytes': _size(Path(jfile)) if jfile else 0,
+        })
+
+    return {
+        'hdr': str(hdr),
+        'hdr_mtime_ns': S.st_mtime_ns,
+        'hdr_size': S.st_size,
+        'acquisition_id': info.get('AcquisitionId'),
+        'start_ns': _date_ns(info.get('AcquisitionStartDate')),
+        'end_ns': _date_ns(info.get('AcquisitionEndDate')),
+        'sample_rate': info.get('SampleRate'),
+        'cccr': info.get('CCCR'),
+        'status': status,
+        'errors': errors,
+        'gaps': sum(len(C.get('Gaps', [])) for C in Chassis),
+        'dat_bytes': sum(_size(hdr.parent / d) for C in Chassis for d in C.get('Dat', [])),
+        'j_bytes': sum(S['j_bytes'] for S in signals),
+        'signals': signals,
+    }
+
+def find_hdrs(roots:[Path]) -> [Path]:
+    'All .hdr files under roots'
+    for root in roots:
+        root = Path(root)
+        if root.is_file():
+            yield root
+            continue
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if not d.endswith('.scratch')]
+            for f in filenames:
+                if f.endswith('.hdr'):
+                    yield Path(dirpath) / f
+
+class Catalog:
+    '''Connection to a catalog database, created if necessary.
+
+    Not shared between threads.
+    '''
+    def __init__(self, fname:Path):
+        self._db = sqlite3.connect(fname, timeout=30.0)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute('PRAGMA journal_mode=WAL') # readers not blocked by the engine
+        self._db.execute('PRAGMA foreign_keys=ON')
+        self._db.executescript(_schema)
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, A, B, C):
+        self.close()
+
+    def add(self, run:dict):
+        'Insert, or replace, one entry from read_run()'
+        run = dict(run)
+        signals = run.pop('signals')
+        with self._db:
+            self._db.execute('DELETE FROM runs WHERE hdr=?', (run['hdr'],))
+            cur = self._db.execute(f'INSERT INTO runs ({",".join(run)}) VALUES ({",".join("?"*len(run))})',
+                                   tuple(run.values()))
+            runid = cur.lastrowid
+            self._db.executemany('INSERT INTO signals (run, signum, chassis, channel, name, desc, egu,'
+                                 ' slope, intercept, jfile, j_bytes)'
+                                 ' VALUES (?,?,?,?,?,?,?,?,?,?,?)',
+                                 [(runid, S['signum'], S['chassis'], S['channel'], S['name'], S['desc'],
+                                   S['egu'], S['slope'], S['intercept'], S['jfile'], S['j_bytes'])
+                                  for S in signals])
+
+    def remove(self, hdr:Path):
+        with self._db:
+            self._db.execute('DELETE FROM runs WHERE hdr=?', (str(Path(hdr).absolute()),))
+
+    def current(self) -> {str:(int,int)}:
+        'Map hdr -> (mtime_ns, size) as last indexed'
+        return {R[0]:(R[1], R[2]) for R in self._db.execute('SELECT hdr, hdr_mtime_ns, hdr_size FROM runs')}
+
+    def index(self, roots:[Path], jobs:int=None, prune=False) -> int:
+        '''Add or update entries for all .hdr under roots which have changed since last indexed.
+
+        With prune, also remove entries for .hdr under roots which no longer exist.
+        Returns number of entries added or updated.
+        '''
+        known = self.current()
+        todo, seen = [], set()
+        for hdr in find_hdrs(roots):
+            hdr = hdr.absolute()
+            seen.add(str(hdr))
+            try:
+                S = hdr.stat()
+            except OSError:
+                continue
+            if known.get(str(hdr))!=(S.st_mtime_ns, S.st_size):
+                todo.append(hdr)
+        _log.debug('Index %d of %d .hdr', len(todo), len(seen))
+
+        n = 0
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            for hdr, fut in [(hdr, pool.submit(read_run, hdr)) for hdr in todo]:
+                try:
+                    self.add(fut.result())
+                    n += 1
+                except Exception as e:
+                    _log.warning('Unable to index %s : %r', hdr, e)
+
+        if prune:
+            prefixes = tuple(str(Path(r).absolute()) for r in roots)
+            for hdr in known.keys() - seen:
+                if hdr.startswith(prefixes):
+                    _log.debug('Remove %s', hdr)
+                    self.remove(hdr)
+        return n
+
+    def query(self, name:str=None, chassis:int=None, since:int=None, until:int=None,
+              status:str=None, acquisition_id:str=None) -> [sqlite3.Row]:
+        '''Runs matching all given criteria, in order of start time.
+
+        name may include SQL LIKE wildcards (eg. "Accel%").
+        since and until are POSIX nanoseconds.
+        '''
+        where, params = [], []
+        if name is not None or chassis is not None:
+            sub, subp = [], []
+            if name is not None:
+                sub.append('signals.name LIKE ?')
+                subp.append(name)
+            if chassis is not None:
+                sub.append('signals.chassis=?')
+                subp.append(chassis)
+            where.append(f'runs.id IN (SELECT run FROM signals WHERE {" AND ".join(sub)})')
+            params += subp
+        if since is not None:
+            where.append('runs.start_ns>=?')
+            params.append(since)
+        if until is not None:
+            where.append('runs.start_ns<?')
+            params.append(until)
+        if status is not None:
+            where.append('runs.status=?')
+            params.append(status)
+        if acquisition_id is not None:
+            where.append('runs.acquisition_id LIKE ?')
+            params.append(acquisition_id)
+
+        sql = 'SELECT * FROM runs'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY start_ns'
+        return self._db.execute(sql, params).fetchall()
+
+    def signals(self, run:int) -> [sqlite3.Row]:
+        return self._db.execute('SELECT * FROM signals WHERE run=? ORDER BY signum', (run,)).fetchall()
+
+def getargs():
+    from argparse import ArgumentParser
+    P = ArgumentParser(description='Index and search recorded runs')
+    P.add_argument('-v', '--verbose', dest='level', default=logging.INFO,
+                   action='store_const', const=logging.DEBUG,
+                   help='Enable extra application logging')
+    P.add_argument('--db', type=Path, default=Path('/data/.catalog.sqlite'),
+                   help='Catalog database file')
+    SP = P.add_subparsers(dest='cmd', required=True)
+
+    S = SP.add_parser('index', help='Add or update runs under directories')
+    S.add_argument('roots', nargs='+', type=Path,
+                   help='Directories and/or .hdr files')
+    S.add_argument('-j', '--jobs', type=int,
+                   help='Number of worker processes.  Default one per core')
+    S.add_argument('--prune', action='store_true',
+                   help='Remove entries of .hdr which no longer exist')
+
+    S = SP.add_parser('query', help='Find runs')
+    S.add_argument('--signal', dest='name',
+                   help='Signal name.  May include %% and _ wildcards')
+    S.add_argument('--chassis', type=int,
+                   help='Chassis number')
+    S.add_argument('--since',
+                   help='Runs started at or after this time.  eg. "2024-07-01", or seconds relative to now')
+    S.add_argument('--until',
+                   help='Runs started before this time')
+    S.add_argument('--status', choices=('Unconverted', 'Success', 'Errors'))
+    S.add_argument('--id', dest='acquisition_id',
+                   help='AcquisitionId.  May include wildcards')
+    S.add_argument('--json', action='store_true',
+                   help='Print JSON, including signals of each run')
+    return P
+
+def main(args) -> int:
+    with Catalog(args.db) as C:
+        if args.cmd=='index':
+            n = C.index(args.roots, jobs=args.jobs, prune=args.prune)
+            _log.info('Indexed %d runs', n)
+            return 0
+
+        now = datetime.now().astimezone().strftime('%Y%m%d %H%M%S%z')
+        since = parse_time(args.since, now) if args.since else None
+        until = parse_time(args.until, now) if args.until else None
+        runs = C.query(name=args.name, chassis=args.chassis, since=since, until=until,
+                       status=args.status, acquisition_id=args.acquisition_id)
+        if args.json:
+            out = []
+            for R in runs:
+                run = dict(R)
+                run['signals'] = [dict(S) for S in C.signals(R['id'])]
+                out.append(run)
+            json.dump(out, sys.stdout, indent='  ')
+            print()
+        else:
+            for R in runs:
+                start = datetime.fromtimestamp(R['start_ns']/1e9).isoformat(' ', 'seconds') if R['start_ns'] else '?'
+                print(f'{start}  {R["status"]:<11} {R["errors"]:4d}  {R["hdr"]}')
+        return 0 if runs else 1
+
+if __name__=='__main__':
+    args = getargs().parse_args()
+    logging.basicConfig(level=args.level)
+    sys.exit(main(args))
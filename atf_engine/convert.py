@@ -3,11 +3,13 @@ import json
 import logging
 import time
 import os
+from datetime import datetime
+import shutil
 import sys
+import threading
 from pathlib import Path
-from tempfile import TemporaryDirectory
 from functools import partial
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 try:
     from asyncio import TaskGroup
@@ -15,10 +17,130 @@ except ImportError:
     # backport for < 3.13
     from .taskgroups import TaskGroup
 
-from ._convert import convert2j
+from ._convert import convert2j, Converter
+from .overview import find_overviews
 
 _log = logging.getLogger(__name__)
 
+# Increment when a change to conversion changes the output files.
+# Recorded in each output .hdr so that atf_engine.reconvert can find stale runs.
+VERSION = 1
+
+def parse_size(val:str) -> int:
+    'Parse a byte count with optional suffix.  eg. "512M" or "8G"'
+    val = val.strip().upper().removesuffix('B').removesuffix('I')
+    scale = 1
+    for i, suffix in enumerate('KMGT', 1):
+        if val.endswith(suffix):
+            val, scale = val[:-1], 1024**i
+            break
+    return int(float(val)*scale)
+
+def default_memory_budget() -> int:
+    'Buffer memory for all conversions in this process.  Half of physical memory.'
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // 2
+    except (ValueError, OSError):
+        return 4*1024**3
+
+def lower_priority(nice:int):
+    '''Lower the CPU scheduling priority of the calling thread, as with "nice -n".
+
+    On Linux nice is per-thread, and is inherited by threads this one creates.
+    Unless set explicitly, I/O priority also follows the nice level.
+    '''
+    try:
+        tid = threading.get_native_id()
+        cur = os.getpriority(os.PRIO_PROCESS, tid)
+        os.setpriority(os.PRIO_PROCESS, tid, min(19, cur + nice))
+    except OSError as e:
+        _log.warning('Unable to set nice %d : %r', nice, e)
+
+def is_rotational(path:Path) -> bool:
+    'Best guess as to whether path is stored on spinning disk(s)'
+    try:
+        dev = os.stat(path).st_dev
+        sysdir = Path(f'/sys/dev/block/{os.major(dev)}:{os.minor(dev)}').resolve()
+        for D in (sysdir, sysdir.parent): # partition, or whole disk
+            rot = D / 'queue' / 'rotational'
+            if rot.exists():
+                return rot.read_text().strip()=='1'
+    except OSError:
+        pass
+    return False # unknown, network, or virtual
+
+def default_jobs(path:Path) -> int:
+    '''Number of chassis to convert concurrently.
+
+    One per core, except on spinning disks where many concurrent
+    streams cause seeking.
+    '''
+    ncpu = len(os.sched_getaffinity(0))
+    if is_rotational(path):
+        return min(2, ncpu)
+    return ncpu
+
+def parse_time(val:str, ref:str) -> int:
+    '''Parse a time as POSIX nanoseconds.
+
+    A number of seconds is an offset from ref, an AcquisitionStartDate.
+    Otherwise an absolute time, either ISO 8601 (eg. "2024-05-01T13:45:00")
+    or in the format of AcquisitionStartDate (eg. "20240501 134500-0700").
+    Absolute times without a timezone are local time.
+    '''
+    try:
+        offset = float(val)
+    except ValueError:
+        pass
+    else:
+        T = datetime.strptime(ref, '%Y%m%d %H%M%S%z').timestamp() + offset
+        return int(round(T*1e9))
+
+    for parse in (datetime.fromisoformat,
+                  lambda s: datetime.strptime(s, '%Y%m%d %H%M%S%z'),
+                  lambda s: datetime.strptime(s, '%Y%m%d %H%M%S')):
+        try:
+            T = parse(val)
+        except ValueError:
+            continue
+        return int(round(T.timestamp()*1e9))
+    raise ValueError(f'Unable to parse time: {val!r}')
+
+def select_channels(info:dict, channels:[str]):
+    '''Keep only the selected signals, and their chassis.
+
+    channels are signal numbers or names, possibly comma separated.
+    '''
+    sel = {c.strip() for C in channels for c in C.split(',')}
+    info['Signals'] = [S for S in info['Signals']
+                       if str(S['SigNum']) in sel or S['Name'] in sel]
+    if not info['Signals']:
+        raise RuntimeError(f'No signals match {sorted(sel)}')
+
+    keep = {S['Address']['Chassis'] for S in info['Signals']}
+    info['Chassis'] = [C for C in info['Chassis'] if C['Chassis'] in keep]
+
+def egu_selection(float64:[str]) -> [str]:
+    'Signal numbers or names of --egu-double, possibly comma separated, as a sorted list'
+    return sorted({c.strip() for C in float64 for c in C.split(',')})
+
+def egu_scale(info:dict, chas:int, float32:bool, float64:[str]) -> {int:(float,float,bool)}:
+    '''Slope and Intercept of the signals of one chassis to also be written in engineering units.
+
+    All signals as float32 if float32, and those selected by float64
+    (signal numbers or names, possibly comma separated) as float64.
+    Returns {channel: (slope, intercept, float64)}, with zero indexed channel, for convert2j(..., egu=).
+    '''
+    sel = set(egu_selection(float64))
+    ret = {}
+    for S in info['Signals']:
+        if S['Address']['Chassis']!=chas:
+            continue
+        wide = str(S['SigNum']) in sel or S['Name'] in sel
+        if float32 or wide:
+            ret[S['Address']['Channel']-1] = (float(S.get('Slope', 1.0)), float(S.get('Intercept', 0.0)), wide)
+    return ret
+
 def getargs():
     from argparse import ArgumentParser
 
@@ -36,113 +158,460 @@ def getargs():
                    help='Output JSON header file.  Data files placed relative.')
     P.add_argument('--force', action='store_true',
                    help='Bypass limits on auto insertion of placeholder samples')
+    P.add_argument('--restart', action='store_true',
+                   help='Discard progress of any previous, interrupted, conversion')
+    P.add_argument('--no-mmap', dest='mmap', action='store_false',
+                   help='Always read .dat files with read() instead of mmap()')
+    P.add_argument('--memory-budget', type=parse_size, default=default_memory_budget(),
+                   help='Total buffer memory for all chassis.  eg. "8G".  Default half of physical memory')
+    P.add_argument('--start',
+                   help='Only convert from this time.  Seconds since AcquisitionStartDate, or an absolute date and time')
+    P.add_argument('--end',
+                   help='Only convert until this time.  Seconds since AcquisitionStartDate, or an absolute date and time')
+    P.add_argument('-j', '--jobs', type=int,
+                   help='Number of chassis to convert concurrently.  Default depends on CPU count and storage type')
+    P.add_argument('--processes', action='store_true',
+                   help='Convert each chassis in a worker process instead of a worker thread')
+    P.add_argument('--channels', action='append', default=[],
+                   help='Only convert these signals.  Signal numbers or names, comma separated.  May be repeated')
+    P.add_argument('--no-overview', dest='overview', action='store_false',
+                   help='Do not write min/max overview (.ovr) files')
+    P.add_argument('--compress', action='store_true',
+                   help='Write compressed .jz files instead of .j.  Read with atf_engine.jz')
+    P.add_argument('--egu', action='store_true',
+                   help='Also write each signal scaled by Slope and Intercept, as float32 (.f32)')
+    P.add_argument('--egu-double', action='append', default=[], metavar='CHANNELS',
+                   help='Also write these signals scaled, as float64 (.f64).  Signal numbers or names, comma separated.  May be repeated')
     return P
 
-async def main(args):
-    loop = asyncio.get_running_loop()
+def scratch_dir(output:Path) -> Path:
+    '''Location of intermediate files while converting for the given output .hdr.
 
-    _log.debug('Read %s', args.input)
-    with args.input.open('r') as F:
-        info = json.load(F)
+    Placed on the output file system so that moving files is cheap.
+    Kept after a failed conversion so that a later attempt may resume.
+    '''
+    return output.parent / f'{output.name}.scratch'
+
+def hdr_stats(stats:dict, wall:float=None) -> dict:
+    'Counters from convert2j(..., stats=True) for the Chassis entry of a .hdr.  eg. "read_time" -> "ReadTime"'
+    ret = {key.title().replace('_', ''): val for key, val in stats.items()}
+    if wall is not None:
+        ret['WallTime'] = wall
+    return ret
+
+def find_j(n:int, chas_scratch:Path) -> {(int,int):Path}:
+    'Map (chas, chan) -> .j (or compressed .jz) file for one chassis converted into chas_scratch'
+    jfiles = {}
+    for c in range(32):
+        for ext in ('.j', '.jz'):
+            chanj = chas_scratch / f'CH{c:02d}{ext}' # channel zero indexed
+            if chanj.exists(): # missing j files below
+                jfiles[(n, c+1)] = chanj # chas and chan now one indexed
+    return jfiles
+
+class IncrementalConvert:
+    '''Convert .dat files of each chassis as soon as each is closed.
+
+    Each chassis has a Converter which is fed files in order by a single
+    worker thread.  So at the end of acquisition only the final .dat
+    of each chassis remains to be processed.
+
+    >>> IC = IncrementalConvert(scratch, [1, 2])
+    >>> IC.feed(1, '/data/.../some-CH01-0.dat') # as each file is closed
+    >>> jfiles = await IC.finish({1:[...], 2:[...]}) # complete list of .dat
+    >>> IC.errors[1] # list of non-fatal errors
+    >>> IC.stats[1] # counters for the .hdr
+
+    memory_budget is divided between chassis.
+    Worker threads run with the given nice level so as not to compete
+    with recording.
+    '''
+    def __init__(self, scratch:Path, chassis:[int], force=False, memory_budget:int=None,
+                 overview=True, compress=False, nice:int=0):
+        if memory_budget is None:
+            memory_budget = default_memory_budget()
+        share = memory_budget // max(1, len(chassis))
+        self._pool = ThreadPoolExecutor(max_workers=max(1, len(chassis)),
+                                        initializer=lower_priority if nice else None,
+                                        initargs=(nice,))
+        self._scratch = {}
+        self._conv = {}
+        self._fed = {}
+        self._tail = {} # chassis -> Task of most recent add()
+        self.errors = {}
+        self.stats = {} # chassis -> hdr_stats()
+        self.overview, self.compress = overview, compress
+        for n in chassis:
+            self._scratch[n] = chas_scratch = scratch / f'CH{n:02d}'
+            chas_scratch.mkdir(parents=True)
+            self._conv[n] = Converter(chas_scratch, force=force, memory_budget=share,
+                                      overview=overview, compress=compress)
+            self._fed[n] = []
+
+    def close(self):
+        for T in self._tail.values():
+            T.cancel()
+        self._pool.shutdown(wait=False)
+
+    def feed(self, chas:int, dat:Path):
+        'Queue conversion of the next .dat for this chassis'
+        if chas not in self._conv:
+            return
+        _log.debug('Incremental chassis %d : %s', chas, dat)
+        self._fed[chas].append(str(dat))
+        self._tail[chas] = asyncio.create_task(self._add(self._tail.get(chas), chas, str(dat)))
+
+    async def _add(self, prev, chas:int, dat:str):
+        loop = asyncio.get_running_loop()
+        if prev is not None:
+            await prev # raises if any previous file failed
+        await loop.run_in_executor(self._pool, self._conv[chas].add, dat)
+
+    async def finish(self, dats:{int:[Path]}) -> {(int,int):Path}:
+        '''Complete conversion given the full list of .dat files for each chassis.
+
+        Returns None if the files already converted are not a prefix
+        of the full list, or if incremental conversion failed.
+        eg. because some .dat were deleted while recording.
+        In which case a full conversion is required.
+        '''
+        loop = asyncio.get_running_loop()
+        T0 = time.monotonic()
+        ok = True
+        for n, R in zip(self._tail, await asyncio.gather(*self._tail.values(), return_exceptions=True)):
+            if isinstance(R, Exception):
+                _log.error('Incremental conversion of chassis %d failed: %r', n, R)
+                ok = False
+
+        for n, conv in self._conv.items():
+            fed, full = self._fed[n], [str(d) for d in dats.get(n, [])]
+            if fed!=full[:len(fed)]:
+                _log.warning('Incremental conversion of chassis %d skipped some .dat', n)
+                ok = False
+
+        if not ok:
+            # close output files before any full conversion resumes from our checkpoints
+            self._conv.clear()
+            return None
+
+        jfiles = {}
+        for n, conv in self._conv.items():
+            for dat in [str(d) for d in dats.get(n, [])][len(self._fed[n]):]:
+                _log.debug('Incremental chassis %d final : %s', n, dat)
+                await loop.run_in_executor(self._pool, conv.add, dat)
+            self.errors[n] = await loop.run_in_executor(self._pool, conv.finish)
+            self.stats[n] = hdr_stats(conv.stats())
+            jfiles.update(find_j(n, self._scratch[n]))
+
+        _log.debug('Finished incremental conversion in %f sec', time.monotonic() - T0)
+        return jfiles
+
+def collect(info:dict, input:Path, output:Path, jfiles:{(int,int):Path}):
+    '''Move .j files into place relative to output, and update info to match.
+    '''
+    for sig in info['Signals']:
+        chas, chan = sig['Address']['Chassis'], sig['Address']['Channel']
+        if (chas, chan) not in jfiles:
+            raise RuntimeError(f'Missing j for {chas}, {chan}')
+
+    # adjust .dat file paths
+    for chas in info['Chassis']:
+        dats = []
+        for dat in chas['Dat']:
+            dats.append(
+                # Path.relative_to() does not like having to traverse up and back down
+                #(input.parent.absolute() / dat).relative_to(output.parent.absolute())
+                os.path.normpath(os.path.join(
+                    os.path.relpath(input.parent, output.parent),
+                    dat,
+                ))
+            )
+        chas['Dat'] = dats
+
+    # CRC32C of input and output files, computed while converting each chassis
+    checksums = {}
+    for (chas, chan), inj in jfiles.items():
+        if chas not in checksums:
+            cfile = inj.with_name('checksums.json')
+            checksums[chas] = json.loads(cfile.read_text()) if cfile.exists() else {}
+
+    # from now start to modify outdir
+    # move j files out of scratch and update json info
+
+    outdir:Path = output.parent
+    outdir.mkdir(parents=True, exist_ok=True)
+
+    for sig in info['Signals']:
+        chas, chan = sig['Address']['Chassis'], sig['Address']['Channel']
+        inj = jfiles[(chas, chan)]
+        crc = checksums[chas].get(inj.name)
+
+        outj = outdir / f"{output.stem}-CH{chas:02d}" / f"ch{chan}{inj.suffix}"
+        outj.parent.mkdir(exist_ok=True)
+
+        inj.rename(outj) # since both are on the same filesystem, this should be fast meta-data update
+
+        sig['OutDataFile'] = str(outj.relative_to(outdir))
+        if crc is not None:
+            sig['Crc32c'] = crc
+
+        # scaled to engineering units, if written
+        for ext, dtype in (('.f32', 'float32'), ('.f64', 'float64')):
+            inegu = inj.with_suffix(ext)
+            if inegu.exists():
+                outegu = outj.with_suffix(ext)
+                inegu.rename(outegu)
+                sig['EguDataFile'] = str(outegu.relative_to(outdir))
+                sig['EguType'] = dtype
+                if inegu.name in checksums[chas]:
+                    sig['EguCrc32c'] = checksums[chas][inegu.name]
+
+        # min/max overview levels, if written
+        levels = []
+        for F, inovr in find_overviews(inj).items():
+            outovr = outj.with_suffix(f'.{F}.ovr')
+            inovr.rename(outovr)
+            levels.append({'Factor': F, 'File': str(outovr.relative_to(outdir))})
+        if levels:
+            sig['Overview'] = levels
+
+    # packet index of each chassis, converted alongside its .j files
+    indexes = {chas: inj.parent / 'packets.idx' for (chas, chan), inj in jfiles.items()}
+    for chas in info['Chassis']:
+        inidx = indexes.get(chas['Chassis'])
+        if inidx is None or not inidx.exists():
+            continue
+
+        outidx = outdir / f"{output.stem}-CH{chas['Chassis']:02d}" / "packets.idx"
+        outidx.parent.mkdir(exist_ok=True)
+        inidx.rename(outidx)
+
+        chas['Index'] = str(outidx.relative_to(outdir))
+
+    # placeholder samples inserted for missing packets
+    for chas in info['Chassis']:
+        inidx = indexes.get(chas['Chassis'])
+        if inidx is not None and inidx.with_name('gaps.json').exists():
+            chas['Gaps'] = json.loads(inidx.with_name('gaps.json').read_text())
+
+    # not computed when converting a time window
+    for chas in info['Chassis']:
+        crcs = checksums.get(chas['Chassis'], {}).get('Dat')
+        if crcs and len(crcs)==len(chas['Dat']):
+            chas['DatCrc32c'] = crcs
+
+def reset_conversion(info:dict):
+    'Remove results of any previous conversion from .hdr info.  eg. when converting again'
+    info.pop('Converted', None)
+    info.pop('Window', None)
+    for sig in info['Signals']:
+        for key in ('OutDataFile', 'Overview', 'Crc32c', 'EguDataFile', 'EguType', 'EguCrc32c'):
+            sig.pop(key, None)
+    for chas in info['Chassis']:
+        for key in ('Errors', 'Stats', 'Index', 'Gaps', 'DatCrc32c'):
+            chas.pop(key, None)
+
+def output_files(info:dict) -> {str}:
+    'Files written by conversion, as listed in .hdr info.  Relative to the .hdr'
+    ret = set()
+    for sig in info.get('Signals', []):
+        for key in ('OutDataFile', 'EguDataFile'):
+            if key in sig:
+                ret.add(sig[key])
+        ret.update(L['File'] for L in sig.get('Overview', []))
+    for chas in info.get('Chassis', []):
+        if 'Index' in chas:
+            ret.add(chas['Index'])
+    return ret
+
+def dat_stat(info:dict, base:Path) -> {str:[int,int]}:
+    'Map .dat path, relative to base, to [size, mtime_ns].  Missing files are [-1, -1]'
+    ret = {}
+    for chas in info['Chassis']:
+        for d in chas['Dat']:
+            try:
+                S = (base / d).stat()
+                ret[d] = [S.st_size, S.st_mtime_ns]
+            except OSError:
+                ret[d] = [-1, -1]
+    return ret
+
+def record_conversion(info:dict, output:Path, overview:bool, compress:bool,
+                      egu:bool=False, egu_double:[str]=()):
+    '''Note converter version, options, and the state of the input .dat files.
+
+    Called after collect().
+    '''
+    info['Converted'] = {
+        'Version': VERSION,
+        'Overview': overview,
+        'Compress': compress,
+        'Egu': egu,
+        'EguDouble': egu_selection(egu_double),
+        'Dat': dat_stat(info, output.parent),
+    }
+
+def up_to_date(info:dict, hdr:Path, overview:bool, compress:bool,
+               egu:bool=False, egu_double:[str]=()) -> bool:
+    '''Whether .hdr info records a conversion, with the current version and these options,
+    of .dat files which have not since changed, and all output files are present.
+    '''
+    C = info.get('Converted')
+    if C is None or [C.get('Version'), C.get('Overview'), C.get('Compress'), C.get('Egu', False), C.get('EguDouble', [])
+                     ]!=[VERSION, overview, compress, egu, egu_selection(egu_double)]:
+        return False
+    if any(S not in C['Dat'] or C['Dat'][S]!=V for S,V in dat_stat(info, hdr.parent).items()):
+        return False
+    return all('OutDataFile' in sig and (hdr.parent / sig['OutDataFile']).exists()
+               for sig in info['Signals'])
+
+def prepare(args, info:dict):
+    '''Apply time window and channel selection of args to .hdr info.
+
+    Returns (start, end) as POSIX nanoseconds.
+    '''
+    reset_conversion(info)
+
+    # time window, as POSIX nanoseconds
+    start = parse_time(args.start, info['AcquisitionStartDate']) if args.start else 0
+    end = parse_time(args.end, info['AcquisitionStartDate']) if args.end else 2**64-1
+    if args.start or args.end:
+        _log.info('Converting window [%d, %d) ns', start, end)
+        info['Window'] = {'Start':start, 'End':end}
 
-    # build index of (chas, chan) -> offset in Signals list
-    idxCH = {}
-    for i,sig in enumerate(info['Signals']):
-        idxCH[(sig['Address']['Chassis'], sig['Address']['Channel'])] = i
+    if args.channels:
+        select_channels(info, args.channels)
+    return start, end
 
-    outdir = args.output.parent
+async def convert_run(args, info:dict, input:Path, output:Path, window:(int,int),
+                      pool, limit:asyncio.Semaphore, share:int, threads:int) -> int:
+    '''Convert all chassis of one run in pool, then write output .hdr
+
+    At most limit chassis, of this and any other runs sharing pool, are in progress.
+    Each with the share of memory budget and number of threads given.
+    Returns exit code.  0 success, 1 some errors.
+    '''
+    loop = asyncio.get_running_loop()
+    start, end = window
+
+    outdir = output.parent
     _log.debug('Output to %s', outdir)
     outdir.mkdir(parents=True, exist_ok=True)
 
-    # place temp dir on the output file system so that moving files is cheap
-    with TemporaryDirectory(dir=outdir) as scratch:
-        scratch = Path(scratch)
-
-        jfiles:{(int,int):Path} = {}
-
-        with ThreadPoolExecutor(max_workers=len(info['Chassis'])) as pool:
-            async with TaskGroup() as sched:
-                jobs = []
-                for chas in info['Chassis']:
-                    async def process_chas(chas):
-                        _log.debug('Process chassis %r', chas)
-                        n = chas['Chassis']
-                        dat:list = chas['Dat']
-                        dat = [str(args.input.parent / d) for d in dat]
-
-                        chas_scratch = scratch / f'CH{n:02d}'
-                        chas_scratch.mkdir()
-
-                        T0 = time.monotonic()
-                        chas['Errors'] = errs = await loop.run_in_executor(
-                            pool,
-                            partial(convert2j, indats=dat, outdir=chas_scratch, force=args.force),
-                        )
-                        Td = time.monotonic() - T0
-                        for err in errs:
-                            print(f'Error: Chas {n} : {err}')
-
-                        for c in range(32):
-                            chanj = chas_scratch / f'CH{c:02d}.j' # channel zero indexed
-                            if chanj.exists(): # missing j files below
-                                jfiles[(n, c+1)] = chanj # chas and chan now one indexed
-
-                        _log.debug('Complete chassis %r in %f sec', chas, Td)
-                        return len(errs)
-
-                    jobs.append(sched.create_task(process_chas(chas)))
-        # all jobs complete, all .j files created under scratch
-            total_errors = sum([j.result() for j in jobs])
-
-        _log.debug('Collecting')
-
-        for sig in info['Signals']:
-            chas, chan = sig['Address']['Chassis'], sig['Address']['Channel']
-            if (chas, chan) not in jfiles:
-                raise RuntimeError(f'Missing j for {chas}, {chan}')
-
-        # adjust .dat file paths
-        for chas in info['Chassis']:
-            dats = []
-            for dat in chas['Dat']:
-                dats.append(
-                    # Path.relative_to() does not like having to traverse up and back down
-                    #(args.input.parent.absolute() / dat).relative_to(args.output.parent.absolute())
-                    os.path.join(
-                        os.path.relpath(args.input.parent, args.output.parent),
-                        dat,
+    scratch = scratch_dir(output)
+    if args.restart and scratch.exists():
+        _log.info('Discarding previous progress %s', scratch)
+        shutil.rmtree(scratch)
+
+    jfiles:{(int,int):Path} = {}
+
+    def dat_bytes(chas:dict) -> int:
+        total = 0
+        for d in chas['Dat']:
+            try:
+                total += (input.parent / d).stat().st_size
+            except OSError:
+                pass
+        return total
+
+    # largest first, so that the longest job does not begin last
+    order = sorted(info['Chassis'], key=dat_bytes, reverse=True)
+
+    async with TaskGroup() as sched:
+        jobs = []
+        # each task waits its turn in order.  (asyncio.Semaphore is FIFO)
+        for chas in order:
+            async def process_chas(chas):
+                async with limit:
+                    _log.debug('Process chassis %r', chas)
+                    n = chas['Chassis']
+                    dat:list = chas['Dat']
+                    dat = [str(input.parent / d) for d in dat]
+
+                    chas_scratch = scratch / f'CH{n:02d}'
+                    chas_scratch.mkdir(parents=True, exist_ok=True)
+
+                    T0 = time.monotonic()
+                    errs, stats = await loop.run_in_executor(
+                        pool,
+                        partial(convert2j, indats=dat, outdir=chas_scratch, force=args.force,
+                                resume=True, mmap=args.mmap, memory_budget=share,
+                                threads=threads, start=start, end=end,
+                                overview=args.overview, compress=args.compress, stats=True,
+                                egu=egu_scale(info, n, args.egu, args.egu_double)),
                     )
-                )
-            chas['Dat'] = dats
+                    Td = time.monotonic() - T0
+                chas['Errors'] = errs
+                chas['Stats'] = hdr_stats(stats, Td)
+                for err in errs:
+                    print(f'Error: Chas {n} : {err}')
 
-        # from now start to modify outdir
-        # move j files out of scratch and update json info
+                jfiles.update(find_j(n, chas_scratch))
 
-        outdir:Path = args.output.parent
-        outdir.mkdir(parents=True, exist_ok=True)
+                _log.debug('Complete chassis %r in %f sec', chas, Td)
+                return len(errs)
 
-        for sig in info['Signals']:
-            chas, chan = sig['Address']['Chassis'], sig['Address']['Channel']
-            inj = jfiles[(chas, chan)]
+            jobs.append(sched.create_task(process_chas(chas)))
+    # all jobs complete, all .j files created under scratch
+    total_errors = sum([j.result() for j in jobs])
 
-            outj = outdir / f"{args.output.stem}-CH{chas:02d}" / f"ch{chan}.j"
-            outj.parent.mkdir(exist_ok=True)
+    if not jfiles:
+        _log.error('No data to convert')
+        return 1
 
-            inj.rename(outj) # since both are on the same filesystem, this should be fast meta-data update
+    _log.debug('Collecting')
 
-            sig['OutDataFile'] = str(outj.relative_to(outdir))
+    collect(info, input, output, jfiles)
+    record_conversion(info, output, overview=args.overview, compress=args.compress,
+                      egu=args.egu, egu_double=args.egu_double)
+
+    # files of any previous conversion to output which were not replaced.  eg. .j after --compress
+    try:
+        with output.open() as F:
+            stale = output_files(json.load(F)) - output_files(info)
+    except (OSError, ValueError):
+        stale = set()
 
-        _log.debug('Done with scratch')
-    # done with scratch
     _log.debug('Writing JSON')
 
-    with args.output.open('w') as F:
+    # replace atomically, as output may also be the input
+    tmp = output.with_name(f'{output.name}.new')
+    with tmp.open('w') as F:
         json.dump(info, F, indent='  ')
+    os.replace(tmp, output)
+
+    for fname in stale:
+        _log.debug('Remove previous %s', fname)
+        (outdir / fname).unlink(missing_ok=True)
+
+    # only discard scratch, and any checkpoints, on success
+    shutil.rmtree(scratch)
 
     _log.debug('Done')
 
     return 1 if total_errors else 0
 
+async def main(args):
+    _log.debug('Read %s', args.input)
+    with args.input.open('r') as F:
+        info = json.load(F)
+
+    window = prepare(args, info)
+
+    njobs = args.jobs or default_jobs(args.input.parent)
+    nconcurrent = max(1, min(njobs, len(info['Chassis'])))
+    share = args.memory_budget // nconcurrent
+    # spare cores decode the .dat files of each chassis in parallel
+    threads = max(1, len(os.sched_getaffinity(0)) // nconcurrent)
+    _log.debug('%d concurrent jobs.  Memory budget %d bytes, %d threads per chassis',
+               nconcurrent, share, threads)
+
+    Executor = ProcessPoolExecutor if args.processes else ThreadPoolExecutor
+
+    with Executor(max_workers=nconcurrent) as pool:
+        return await convert_run(args, info, args.input, args.output, window,
+                                 pool, asyncio.Semaphore(nconcurrent), share, threads)
+
 if __name__=='__main__':
     args = getargs().parse_args()
     logging.basicConfig(level=args.level)
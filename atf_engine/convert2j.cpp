@@ -9,8 +9,17 @@
 
 #include <Python.h>
 
+#include <algorithm>
 #include <array>
+#include <atomic>
+#include <chrono>
+#include <condition_variable>
+#include <deque>
+#include <exception>
+#include <mutex>
+#include <thread>
 #include <string>
+#include <fstream>
 #include <iomanip>
 #include <iostream>
 #include <sstream>
@@ -25,6 +34,13 @@
 
 #include <fcntl.h>
 #include <errno.h>
+#include <sys/stat.h>
+#include <sys/mman.h>
+#include <sys/vfs.h>
+
+#if defined(__x86_64__) || defined(__i386__)
+#  include <immintrin.h>
+#endif
 
 #define likely(EXPR)   __builtin_expect(EXPR, 1)
 #define unlikely(EXPR) __builtin_expect(EXPR, 0)
@@ -40,48 +56,394 @@ struct SB {
     SB& operator<<(const T& i) { strm<<i; return *this; }
 };
 
+/* Bytes of buffers currently allocated by all conversions in this process,
+ * and the most since the last buffer_usage(reset=True).
+ */
+std::atomic<uint64_t> buffer_bytes{0u}, buffer_peak{0u};
+
+// like std::allocator, but new elements are left uninitialized.  Allocations are counted in buffer_bytes
+template<typename T>
+struct uninit_allocator : std::allocator<T> {
+    template<typename U>
+    struct rebind { using other = uninit_allocator<U>; };
+
+    uninit_allocator() = default;
+    template<typename U>
+    uninit_allocator(const uninit_allocator<U>&) noexcept {}
+
+    T* allocate(size_t n) {
+        auto ret = std::allocator<T>::allocate(n);
+        uint64_t cur = buffer_bytes += n*sizeof(T);
+        auto peak = buffer_peak.load(std::memory_order_relaxed);
+        while(cur > peak && !buffer_peak.compare_exchange_weak(peak, cur)) {}
+        return ret;
+    }
+    void deallocate(T* p, size_t n) {
+        buffer_bytes -= n*sizeof(T);
+        std::allocator<T>::deallocate(p, n);
+    }
+
+    template<typename U>
+    void construct(U* p) noexcept(std::is_nothrow_default_constructible<U>::value) {
+        ::new((void*)p) U;
+    }
+    template<typename U, typename... Args>
+    void construct(U* p, Args&&... args) {
+        ::new((void*)p) U(std::forward<Args>(args)...);
+    }
+};
+
+typedef std::vector<char, uninit_allocator<char>> buffer_t;
+
+constexpr size_t default_bufsize = 64*1024*1024;
+/* Smallest buffer when sizing from a memory budget.
+ * Must hold the per-channel output of the largest (64 KiB) packet.
+ */
+constexpr size_t min_bufsize = 128*1024;
+
+// clamp to [min_bufsize, default_bufsize], and round down to a page multiple
+size_t clamp_bufsize(uint64_t size)
+{
+    size = std::max<uint64_t>(min_bufsize, std::min<uint64_t>(size, default_bufsize));
+    return size & ~uint64_t(4095u);
+}
+
+void pwrite_all(int fd, const char *data, size_t len, uint64_t off)
+{
+    for(size_t i=0; i<len; ) {
+        auto ret = ::pwrite(fd, data+i, len-i, off+i);
+        if(unlikely(ret<=0)) {
+            int err = errno;
+            throw std::runtime_error(SB()<<"Failed to write "<<err<<" "<<strerror(err));
+        }
+        i += ret;
+    }
+}
+
+// monotonic time in nanoseconds
+inline
+uint64_t now_ns()
+{
+    return std::chrono::duration_cast<std::chrono::nanoseconds>(
+                std::chrono::steady_clock::now().time_since_epoch()).count();
+}
+
+void pread_all(int fd, char *data, size_t len, uint64_t off)
+{
+    for(size_t i=0; i<len; ) {
+        auto ret = ::pread(fd, data+i, len-i, off+i);
+        if(unlikely(ret<=0)) {
+            int err = ret<0 ? errno : EIO;
+            throw std::runtime_error(SB()<<"Failed to read "<<err<<" "<<strerror(err));
+        }
+        i += ret;
+    }
+}
+
+/* CRC32C (Castagnoli) of input and output files, computed as each buffer is read or written.
+ * Same conventions as zlib crc32().  crc32c(0, nullptr, 0)==0,
+ * and crc32c(crc32c(0, A), B) is the CRC of A followed by B.
+ */
+constexpr uint32_t crc32c_poly = 0x82f63b78u; // reflected
+
+struct crc32c_tables {
+    // slicing-by-8
+    uint32_t T[8][256];
+    // x^(2^n) mod P, for crc32c_combine()
+    uint32_t x2n[64];
+
+    static uint32_t multmodp(uint32_t a, uint32_t b) {
+        uint32_t m = 1u<<31u, p = 0u;
+        while(true) {
+            if(a & m) {
+                p ^= b;
+                if(!(a & (m - 1u)))
+                    break;
+            }
+            m >>= 1u;
+            b = b&1u ? (b>>1u) ^ crc32c_poly : b>>1u;
+        }
+        return p;
+    }
+
+    crc32c_tables() {
+        for(uint32_t n=0; n<256; n++) {
+            uint32_t c = n;
+            for(unsigned k=0; k<8; k++)
+                c = c&1u ? (c>>1u) ^ crc32c_poly : c>>1u;
+            T[0][n] = c;
+        }
+        for(uint32_t n=0; n<256; n++) {
+            for(unsigned k=1; k<8; k++)
+                T[k][n] = (T[k-1][n]>>8u) ^ T[0][T[k-1][n] & 0xffu];
+        }
+        uint32_t p = 1u<<30u; // x^1
+        for(auto& x : x2n) {
+            x = p;
+            p = multmodp(p, p);
+        }
+    }
+} const crc32c_tab;
+
+uint32_t crc32c_scalar(uint32_t crc, const uint8_t *in, size_t len)
+{
+    auto& T = crc32c_tab.T;
+    for(; len>=8u; len-=8u, in+=8u) {
+        uint32_t lo, hi;
+        memcpy(&lo, in, 4u);
+        memcpy(&hi, in+4u, 4u);
+        lo = htole32(lo) ^ crc;
+        hi = htole32(hi);
+        crc = T[7][lo & 0xffu] ^ T[6][(lo>>8u) & 0xffu] ^ T[5][(lo>>16u) & 0xffu] ^ T[4][lo>>24u]
+            ^ T[3][hi & 0xffu] ^ T[2][(hi>>8u) & 0xffu] ^ T[1][(hi>>16u) & 0xffu] ^ T[0][hi>>24u];
+    }
+    for(; len; len--, in++)
+        crc = (crc>>8u) ^ T[0][(crc ^ *in) & 0xffu];
+    return crc;
+}
+
+#if defined(__x86_64__)
+__attribute__((target("sse4.2")))
+uint32_t crc32c_sse42(uint32_t crc, const uint8_t *in, size_t len)
+{
+    uint64_t c = crc;
+    for(; len>=8u; len-=8u, in+=8u) {
+        uint64_t v;
+        memcpy(&v, in, 8u);
+        c = _mm_crc32_u64(c, v);
+    }
+    crc = uint32_t(c);
+    for(; len; len--, in++)
+        crc = _mm_crc32_u8(crc, *in);
+    return crc;
+}
+#endif
+
+const auto crc32c_impl =
+#if defined(__x86_64__)
+        __builtin_cpu_supports("sse4.2") ? crc32c_sse42 :
+#endif
+        crc32c_scalar;
+
+inline
+uint32_t crc32c(uint32_t crc, const void *in, size_t len)
+{
+    return ~crc32c_impl(~crc, (const uint8_t*)in, len);
+}
+
+// CRC of A followed by B, given the CRCs of each, and the length of B
+uint32_t crc32c_combine(uint32_t crcA, uint32_t crcB, uint64_t lenB)
+{
+    // multiply crcA by x^(8*lenB) mod P
+    uint32_t p = 1u<<31u; // x^0
+    for(unsigned k=3u; lenB; lenB>>=1u, k++) {
+        if(lenB & 1u)
+            p = crc32c_tables::multmodp(crc32c_tab.x2n[k & 63u], p);
+    }
+    return crc32c_tables::multmodp(p, crcA) ^ crcB;
+}
+
+/* Write-behind stage.
+ * A worker thread performs pwrite() of full buffers, while the caller
+ * continues to fill a spare buffer.  Writes are completed in submission order.
+ * The number of buffers queued, or being written, is bounded.
+ */
+struct writer {
+    struct job {
+        int fd;
+        uint64_t off;
+        buffer_t buf;
+        size_t len;
+    };
+
+    std::mutex lock;
+    std::condition_variable wakeWorker, wakeSubmit;
+    std::deque<job> jobs;
+    std::vector<buffer_t> spares;
+    size_t inprogress = 0;
+    const size_t maxpending;
+    bool stopping = false;
+    // first error from worker
+    std::string error;
+
+    std::thread worker;
+
+    explicit writer(size_t maxpending)
+        :maxpending(maxpending)
+        ,worker(&writer::run, this)
+    {}
+    ~writer() {
+        {
+            std::lock_guard<std::mutex> G(lock);
+            stopping = true;
+        }
+        wakeWorker.notify_one();
+        worker.join();
+    }
+
+    // queue buf[0, len) to be written to fd at offset.  buf is replaced by a spare buffer.
+    void submit(int fd, uint64_t off, buffer_t& buf, size_t len) {
+        buffer_t spare;
+        {
+            std::unique_lock<std::mutex> G(lock);
+            wakeSubmit.wait(G, [this]() { return jobs.size()+inprogress < maxpending || !error.empty(); });
+            if(!error.empty())
+                throw std::runtime_error(error);
+
+            if(!spares.empty()) {
+                spare = std::move(spares.back());
+                spares.pop_back();
+            }
+            auto bsize = buf.size();
+            jobs.push_back(job{fd, off, std::move(buf), len});
+            buf = std::move(spare);
+            if(buf.size()!=bsize) {
+                G.unlock();
+                buf.resize(bsize);
+            }
+        }
+        wakeWorker.notify_one();
+    }
+
+    // wait for all queued writes to complete
+    void drain() {
+        std::unique_lock<std::mutex> G(lock);
+        wakeSubmit.wait(G, [this]() { return (jobs.empty() && !inprogress) || !error.empty(); });
+        if(!error.empty())
+            throw std::runtime_error(error);
+    }
+
+    void run() {
+        std::unique_lock<std::mutex> G(lock);
+        while(true) {
+            wakeWorker.wait(G, [this]() { return !jobs.empty() || stopping; });
+            if(jobs.empty())
+                break; // stopping
+
+            auto J(std::move(jobs.front()));
+            jobs.pop_front();
+            inprogress++;
+            G.unlock();
+
+            std::string err;
+            try {
+                pwrite_all(J.fd, J.buf.data(), J.len, J.off);
+            }catch(std::exception& e){
+                err = e.what();
+            }
+
+            G.lock();
+            inprogress--;
+            if(!err.empty() && error.empty())
+                error = err;
+            spares.push_back(std::move(J.buf));
+            wakeSubmit.notify_all();
+        }
+    }
+};
+
+struct pyramid;
+struct jzcodec;
+
 /* until GCC < 13 buffering of std::fstream has terrible performance due small fixed buffer size.
  * https://gcc.gnu.org/bugzilla/show_bug.cgi?id=63746
  * unknown if GCC >= 13 fully addresses this.
  * Until the, we do our own buffering
  */
 struct rawfile {
-    std::vector<char> buf;
+    buffer_t buf;
     /* When writing: valid range is [0, pos)  limit unused
      * 0  pos   buf.size()
      * |XXX|-----|
+     * buf[0] is written to file offset woff.
      * When reading: valid range is [pos, limit)
      * 0  pos  limit  buf.size()
      * |---|XXXX|------|
+     * buf[0] was read from file offset woff.
+     * When reading from a mapping: buf unused.  valid range is [pos, limit)
+     * 0  pos  limit==mapsize
+     * |---|XXXXXXXX|
      */
     size_t pos=0, limit=0;
+    uint64_t woff=0;
     int fd = -1;
     bool writing = false;
+    // when reading, the whole file may be mapped
+    const char *map = nullptr;
+    bool mapped = false;
+    size_t next_readahead = 0;
+    static constexpr size_t readahead_window = 16u*1024u*1024u;
+    // when reading, time spent waiting in read()
+    uint64_t read_ns = 0;
+    // when writing, optional write-behind
+    writer *wb = nullptr;
+    // when writing samples, optional overview computed from each buffer as it is flushed
+    pyramid *ovr = nullptr;
+    /* when writing samples, optionally compressed as each buffer is flushed.
+     * buf then holds samples, and woff is the file offset of the encoded output.
+     */
+    jzcodec *jz = nullptr;
+    /* Optional running CRC32C.
+     * When reading, of bytes [0, crc_pos) of the file.  Complete with checksum_rest().
+     * When writing, of all bytes written by flush(), beginning from the initial woff.
+     * So excludes any header written, and later re-written, with pwrite_at().
+     */
+    bool checksum = false;
+    uint32_t crc = 0u;
+    uint64_t crc_pos = 0u;
 
     rawfile() = default;
     rawfile(const std::string& fname, bool write)
         :rawfile(fname.c_str(), write)
     {}
-    rawfile(const char *fname, bool write)
-        :buf(64*1024*1024)
-        ,fd(open(fname, (write ? O_CREAT|O_EXCL|O_RDWR : O_RDONLY) | O_LARGEFILE, 0444))
+    /* When reading, allocates a buffer of bufsize unless mapped.
+     * When writing, the caller allocates with buffer() before the first write().
+     */
+    rawfile(const char *fname, bool write, bool usemap=false, size_t bufsize=default_bufsize)
+        :fd(open(fname, (write ? O_CREAT|O_EXCL|O_RDWR : O_RDONLY) | O_LARGEFILE, 0444))
         ,writing(write)
     {
         if(fd==-1) {
             int err = errno;
             throw std::runtime_error(SB()<<"Failed to open '"<<fname<<"' : "<<err<<" "<<strerror(err));
         }
+        if(!write && (!usemap || !try_map()))
+            buf.resize(bufsize);
+    }
+    // re-open existing output file, and truncate to 'size'.  Allocate with buffer()
+    rawfile(const std::string& fname, size_t size)
+        :woff(size)
+        ,writing(true)
+    {
+        // output files are created read-only
+        if(chmod(fname.c_str(), 0644)==0)
+            fd = open(fname.c_str(), O_RDWR | O_LARGEFILE);
+        if(fd==-1) {
+            int err = errno;
+            throw std::runtime_error(SB()<<"Failed to re-open '"<<fname<<"' : "<<err<<" "<<strerror(err));
+        }
+        (void)fchmod(fd, 0444);
+        if(ftruncate(fd, size)) {
+            int err = errno;
+            ::close(fd);
+            fd = -1;
+            throw std::runtime_error(SB()<<"Failed to truncate '"<<fname<<"' : "<<err<<" "<<strerror(err));
+        }
     }
+    // write to an already open file, beginning at offset 'off'.  Takes ownership of fd.  Allocate with buffer()
+    rawfile(int fd, uint64_t off)
+        :woff(off)
+        ,fd(fd)
+        ,writing(true)
+    {}
     rawfile(const rawfile&) = delete;
     rawfile& operator=(const rawfile&) = delete;
 
     rawfile(rawfile&& o) noexcept {
-        rawfile().swap(o);
-        o.swap(*this);
+        swap(o);
     }
     rawfile& operator=(rawfile&& o) noexcept {
-        rawfile().swap(o);
-        o.swap(*this);
+        rawfile(std::move(o)).swap(*this);
         return *this;
     }
 
@@ -89,8 +451,61 @@ struct rawfile {
         std::swap(buf, o.buf);
         std::swap(pos, o.pos);
         std::swap(limit, o.limit);
+        std::swap(woff, o.woff);
         std::swap(fd, o.fd);
         std::swap(writing, o.writing);
+        std::swap(map, o.map);
+        std::swap(mapped, o.mapped);
+        std::swap(next_readahead, o.next_readahead);
+        std::swap(read_ns, o.read_ns);
+        std::swap(wb, o.wb);
+        std::swap(ovr, o.ovr);
+        std::swap(jz, o.jz);
+        std::swap(checksum, o.checksum);
+        std::swap(crc, o.crc);
+        std::swap(crc_pos, o.crc_pos);
+    }
+
+    /* Map entire input file.  Avoids copying into buf.
+     * Not attempted on network or FUSE filesystems, where a mapping is
+     * more likely to fail with SIGBUS, and readahead is less effective.
+     * Returns false if mapping is unsuitable, to fall back to read().
+     */
+    bool try_map() {
+        struct statfs fsinfo;
+        if(fstatfs(fd, &fsinfo)==0) {
+            switch(fsinfo.f_type) {
+            case 0x6969:     // NFS_SUPER_MAGIC
+            case 0xff534d42: // CIFS_MAGIC_NUMBER
+            case 0xfe534d42: // SMB2_MAGIC_NUMBER
+            case 0x65735546: // FUSE_SUPER_MAGIC
+                return false;
+            default:
+                break;
+            }
+        }
+
+        struct stat info;
+        if(fstat(fd, &info) || !S_ISREG(info.st_mode))
+            return false;
+
+        if(info.st_size) {
+            auto ptr = mmap(nullptr, info.st_size, PROT_READ, MAP_SHARED, fd, 0);
+            if(ptr==MAP_FAILED)
+                return false;
+            (void)madvise(ptr, info.st_size, MADV_SEQUENTIAL);
+            map = (const char*)ptr;
+        }
+        mapped = true;
+        pos = 0;
+        limit = info.st_size;
+        return true;
+    }
+
+    // first valid byte when reading.  next free byte when writing.
+    inline
+    const char* data() const {
+        return (mapped ? map : buf.data()) + pos;
     }
 
     ~rawfile() {
@@ -110,7 +525,11 @@ struct rawfile {
         if(fd<0)
             return;
         if(writing)
-            flush();
+            sync();
+        if(map)
+            (void)munmap((void*)map, limit);
+        map = nullptr;
+        mapped = false;
         pos = limit = 0;
 
         while(true) {
@@ -137,6 +556,13 @@ struct rawfile {
         if(likely(limit-pos >= need))
             return true;
 
+        if(mapped) {
+            if(pos==limit)
+                return false;
+            throw std::runtime_error("Unexpected EoF");
+        }
+
+        woff += pos;
         if(pos!=limit) {
             memmove(buf.data(),
                     buf.data()+pos,
@@ -148,6 +574,7 @@ struct rawfile {
             pos = limit = 0;
         }
 
+        auto T0 = now_ns();
         while(limit-pos < need) {
             auto ret = ::read(fd, buf.data()+limit, buf.size()-limit);
             if(ret<0) {
@@ -159,15 +586,77 @@ struct rawfile {
 
                 throw std::runtime_error("Unexpected EoF");
             }
+            if(checksum)
+                crc = crc32c(crc, buf.data()+limit, ret);
             limit += ret;
         }
+        read_ns += now_ns() - T0;
+        // begin reading the next buffer full
+        (void)posix_fadvise(fd, 0, 0, POSIX_FADV_SEQUENTIAL);
+        (void)posix_fadvise(fd, woff+limit, buf.size(), POSIX_FADV_WILLNEED);
         return true;
     }
 
+    /* Keep kernel readahead one window ahead of the decoder when reading from a mapping.
+     * The kernel begins reading asynchronously.
+     * (when buffered, ensure() issues the equivalent hint after each refill)
+     * Then wait for the pages of the window about to be decoded, which is
+     * counted in read_ns as ensure() counts read().
+     * Also where a mapping is checksummed, shortly after the decoder has passed.
+     */
+    inline
+    void readahead() {
+        if(mapped && unlikely(pos >= next_readahead)) {
+            if(checksum) {
+                crc = crc32c(crc, map+crc_pos, pos-crc_pos);
+                crc_pos = pos;
+            }
+            size_t start = pos & ~size_t(4095u); // page aligned
+            (void)madvise((void*)(map+start), std::min(2u*readahead_window, limit-start), MADV_WILLNEED);
+            auto T0 = now_ns();
+            populate(start, std::min(readahead_window, limit-start));
+            read_ns += now_ns() - T0;
+            next_readahead = pos + readahead_window;
+        }
+    }
+
+    // fault in mapped pages [start, start+len)
+    void populate(size_t start, size_t len) {
+#ifdef MADV_POPULATE_READ
+        if(madvise((void*)(map+start), len, MADV_POPULATE_READ)==0)
+            return;
+#endif
+        // Linux < 5.14.  Touch each page
+        for(size_t off=0; off<len; off+=4096u)
+            (void)*(volatile const char*)(map+start+off);
+    }
+
+    /* When reading, checksum any bytes not yet read through to EoF.
+     * No further reads afterwards.
+     */
+    void checksum_rest() {
+        if(mapped) {
+            crc = crc32c(crc, map+crc_pos, limit-crc_pos);
+            crc_pos = limit;
+            return;
+        }
+        while(true) {
+            auto ret = ::read(fd, buf.data(), buf.size());
+            if(ret<0) {
+                int err = errno;
+                throw std::runtime_error(SB()<<"Failed to read "<<err<<" "<<strerror(err));
+            } else if(ret==0) {
+                break;
+            }
+            crc = crc32c(crc, buf.data(), ret);
+        }
+        pos = limit = 0;
+    }
+
     bool read(void *out, size_t request) {
         if(unlikely(!ensure(request)))
             return false;
-        memcpy(out, buf.data()+pos, request);
+        memcpy(out, data(), request);
         pos += request;
         return true;
     }
@@ -194,20 +683,50 @@ struct rawfile {
         return ret;
     }
 
+    // allocate write buffer.  Only before the first write().
+    void buffer(size_t bufsize) {
+        if(unlikely(!writing || pos))
+            throw std::logic_error(SB()<<__func__<<" pre-condition violation");
+        buf.resize(bufsize);
+    }
+
+    // Write out buffer.  With write-behind, may not be complete on return.
     void flush() {
         if(unlikely(!writing))
             throw std::logic_error(SB()<<__func__<<" pre-condition violation");
-        for(size_t i=0; i<pos; ) {
-            auto ret = ::write(fd, buf.data()+i, pos-i);
-            if(unlikely(ret<=0)) {
-                int err = errno;
-                throw std::runtime_error(SB()<<"Failed to read "<<err<<" "<<strerror(err));
-            }
-            i += ret;
+        if(!pos)
+            return;
+        if(ovr)
+            feed_overview();
+        if(jz) {
+            feed_encoder();
+            pos = 0;
+            return;
+        }
+        if(checksum)
+            crc = crc32c(crc, buf.data(), pos);
+        if(wb) {
+            wb->submit(fd, woff, buf, pos);
+        } else {
+            pwrite_all(fd, buf.data(), pos, woff);
         }
+        woff += pos;
         pos = 0;
     }
 
+    void feed_overview();
+    void feed_encoder();
+    void flush_encoded();
+
+    // flush, and wait for any write-behind to complete
+    void sync() {
+        flush();
+        if(jz)
+            flush_encoded();
+        if(wb)
+            wb->drain();
+    }
+
     inline
     void write(const void *in, size_t request) {
         if(unlikely(buf.size()-pos < request))
@@ -223,27 +742,49 @@ struct rawfile {
         this->write(&in, sizeof(in));
     }
 
-    size_t seek(size_t off, int whence = SEEK_SET) {
-        if(writing)
+    // Space to write 'request' bytes directly into buffer.  Follow with commit()
+    inline
+    char* reserve(size_t request) {
+        if(unlikely(buf.size()-pos < request)) {
             flush();
-        pos = limit = 0;
-        auto ret = ::lseek(fd, 0, whence);
-        if(unlikely(ret < 0)) {
+            if(unlikely(buf.size() < request))
+                throw std::logic_error(SB()<<__func__<<" request exceeds buffer size");
+        }
+        return buf.data()+pos;
+    }
+
+    inline
+    void commit(size_t request) {
+        pos += request;
+    }
+
+    // overwrite already written bytes.  eg. header
+    void pwrite_at(uint64_t off, const void *in, size_t request) {
+        sync();
+        pwrite_all(fd, (const char*)in, request, off);
+    }
+
+    /* Reserve disk space for expected final size, without changing file size.
+     * Reduces fragmentation.  Not all filesystems support this.
+     */
+    void preallocate(uint64_t size) {
+        if(size > woff)
+            (void)fallocate(fd, FALLOC_FL_KEEP_SIZE, woff, size-woff);
+    }
+
+    // release any preallocated space beyond the current position
+    void trim() {
+        sync();
+        if(ftruncate(fd, woff)) {
             auto err = errno;
-            throw std::runtime_error(SB()<<"Unable to lseek : "<<err<<" "<<strerror(err));
+            throw std::runtime_error(SB()<<"Unable to truncate : "<<err<<" "<<strerror(err));
         }
-        return ret;
     }
 
     // file position of 'pos'
     inline
     size_t tell() const {
-        auto off = ::lseek(fd, 0, SEEK_CUR);
-        if(unlikely(off < 0)) {
-            auto err = errno;
-            throw std::runtime_error(SB()<<"Unable to lseek : "<<err<<" "<<strerror(err));
-        }
-        return off+pos;
+        return mapped ? pos : woff+pos;
     }
 };
 
@@ -271,79 +812,1024 @@ struct QuartzNB {
     uint32_t lolo;
 };
 
-struct priv {
-    uint64_t last_seqno;
-    uint64_t last_ns;
-    uint32_t last_chmask;
-    size_t last_nsamp;
-    std::array<uint32_t, 32> last_channel;
-    bool first = true;
-    bool force = false;
+/* Packet index.  See atf_engine/pktindex.py
+ * Header, followed by one record for each data packet, in order.
+ * Host (little) endian
+ */
+struct PktIndexHead {
+    char magic[8] = {'A', 'T', 'F', 'P', 'I', 'D', 'X', '\0'};
+    uint32_t version = 1;
+    uint32_t recsize = 40;
+};
 
-    std::string outdir;
+struct PktIndexRec {
+    uint64_t seqno;
+    uint64_t ns; // POSIX time in nanoseconds
+    uint64_t sample; // index in .j of the first sample of this packet
+    uint64_t offset; // of packet header in .dat file
+    uint32_t dat; // .dat file number
+    uint32_t ntime; // samples per channel in this packet
+};
+static_assert(sizeof(PktIndexRec)==40, "");
 
-    std::array<rawfile, 32> out_channel;
-    rawfile out_status;
+/* Min/max overview pyramid of one channel.  See atf_engine/overview.py
+ * Level i is a file of (min, max) pairs, one for each block of ovr_factor(i) samples.
+ * Each level is accumulated from the entries of the level below.
+ */
+constexpr unsigned ovr_levels = 3u;
+constexpr unsigned ovr_ratio = 16u;
 
-    // list of corrected/non-fatel errors
-    std::vector<std::string> errors;
+// 16, 256, 4096
+constexpr uint64_t ovr_factor(unsigned i) {
+    return uint64_t(ovr_ratio) << (4u*i);
+}
 
-    void prepare_output();
-    void finalize_output();
+struct OvrHead {
+    char magic[8] = {'A', 'T', 'F', 'O', 'V', 'R', '\0', '\0'};
+    uint32_t version = 1;
+    uint32_t factor;
 };
 
-void convert1(priv& pvt, const std::string& indat)
-{
-    rawfile istrm(indat.c_str(), false);
+struct pyramid {
+    struct level {
+        rawfile out;
+        int32_t lo = INT32_MAX, hi = INT32_MIN;
+        // samples, or entries of the level below, in the current block
+        unsigned count = 0;
+        // current block began before this conversion.  Not written here.
+        bool skip = false;
+
+        void merge(int32_t l, int32_t h) {
+            lo = std::min(lo, l);
+            hi = std::max(hi, h);
+        }
+        void reset() {
+            lo = INT32_MAX;
+            hi = INT32_MIN;
+            count = 0;
+            skip = false;
+        }
+    };
+    std::array<level, ovr_levels> levels;
+    // while re-priming, completed blocks have already been written
+    bool quiet = false;
+
+    // next samples
+    void feed(const int32_t *v, size_t n) {
+        auto& L = levels[0];
+        while(n) {
+            if(L.count==0u && n>=ovr_ratio) {
+                // a batch of whole blocks.  Fixed length allows the compiler to vectorize
+                std::array<int32_t, 2u*256u> ents;
+                size_t nblk = std::min<size_t>(n/ovr_ratio, ents.size()/2u);
+                for(size_t b=0; b<nblk; b++) {
+                    auto blk = v + b*ovr_ratio;
+                    int32_t lo = blk[0], hi = blk[0];
+                    for(size_t j=1; j<ovr_ratio; j++) {
+                        lo = std::min(lo, blk[j]);
+                        hi = std::max(hi, blk[j]);
+                    }
+                    ents[2u*b] = lo;
+                    ents[2u*b+1u] = hi;
+                }
+                if(!quiet)
+                    L.out.write(ents.data(), nblk*2u*sizeof(int32_t));
+                for(size_t b=0; b<nblk; b++)
+                    up(1u, ents[2u*b], ents[2u*b+1u]);
+                v += nblk*ovr_ratio;
+                n -= nblk*ovr_ratio;
+                continue;
+            }
 
-    PSCHead head;
-    while(istrm.read_into(head)) {
-        uint16_t msgid = be16toh(head.msgid);
-        uint32_t msglen = be32toh(head.msglen);
-        bool hasB = false;
+            size_t take = std::min<size_t>(n, ovr_ratio - L.count);
+            int32_t lo = v[0], hi = v[0];
+            for(size_t j=1; j<take; j++) {
+                lo = std::min(lo, v[j]);
+                hi = std::max(hi, v[j]);
+            }
+            L.merge(lo, hi);
+            L.count += take;
+            v += take;
+            n -= take;
+            if(L.count==ovr_ratio)
+                complete(0u);
+        }
+    }
 
-        // headers already validated during recording process.
-        // An error here implies some later disk error.
-        // Treat as fatal
-        if(be16toh(head.ps)!=0x5053 || msglen<sizeof(QuartzNA)) { // "PS"
-            throw std::runtime_error(SB()<<"Corrupt header in '"<<indat<<"' near "<<istrm.tell());
+    // add one complete entry of the level below to level i
+    void up(unsigned i, int32_t lo, int32_t hi) {
+        if(i >= ovr_levels)
+            return;
+        auto& U = levels[i];
+        U.merge(lo, hi);
+        if(++U.count==ovr_ratio)
+            complete(i);
+    }
+
+    void complete(unsigned i) {
+        auto& L = levels[i];
+        if(!L.skip && !quiet) {
+            int32_t ent[2] = {L.lo, L.hi};
+            L.out.write(ent, sizeof(ent));
         }
-        if(!istrm.ensure(msglen)) {
-            throw std::runtime_error(SB()<<"Truncated msg in '"<<indat<<"' near "<<istrm.tell());
+        auto lo = L.lo, hi = L.hi;
+        L.reset();
+        up(i+1u, lo, hi);
+    }
+
+    // write any incomplete final blocks
+    void finish() {
+        for(unsigned i=0; i<ovr_levels; i++) {
+            auto& L = levels[i];
+            if(!L.count)
+                continue;
+            if(!L.skip) {
+                int32_t ent[2] = {L.lo, L.hi};
+                L.out.write(ent, sizeof(ent));
+            }
+            if(i+1u < ovr_levels) {
+                levels[i+1u].merge(L.lo, L.hi);
+                levels[i+1u].count++;
+            }
+            L.reset();
         }
+    }
 
-        switch(msgid) {
-        case 0x4e41: // "NA"
-            break;
-        case 0x4e42: // "NB"
-            hasB = true;
-            if(msglen<sizeof(QuartzNA)+sizeof(QuartzNB))
-                throw std::runtime_error(SB()<<"Corrupt headerB in '"<<indat<<"' near "<<istrm.tell());
-            break;
-        default:
-            istrm.drain(msglen);
-            continue;
+    /* Begin part way through at sample s, without the preceding samples.
+     * Blocks containing s are not written.
+     */
+    void start_at(uint64_t s) {
+        for(unsigned i=0; i<ovr_levels; i++) {
+            auto& L = levels[i];
+            auto F = ovr_factor(i);
+            L.reset();
+            L.count = (s % F) / (i ? ovr_factor(i-1u) : 1u);
+            L.skip = (s % F)!=0u;
         }
+    }
 
-        auto hdrA(istrm.read_as<QuartzNA>());
-        msglen -= sizeof(QuartzNA);
-        auto chmask = be32toh(hdrA.chmask);
-        auto seqno = be64toh(hdrA.seqno);
-        auto nsec = uint64_t(be32toh(hdrA.sec))*1000000000 + be32toh(hdrA.ns);
+    // min/max of n samples
+    static std::pair<int32_t, int32_t> span(const int32_t *v, size_t n) {
+        int32_t lo = INT32_MAX, hi = INT32_MIN;
+        for(size_t j=0; j<n; j++) {
+            lo = std::min(lo, v[j]);
+            hi = std::max(hi, v[j]);
+        }
+        return {lo, hi};
+    }
+};
 
-        if(pvt.first) {
-            pvt.first = false;
-            pvt.last_chmask = chmask;
-            pvt.prepare_output();
+void rawfile::feed_overview()
+{
+    ovr->feed((const int32_t*)buf.data(), pos/sizeof(int32_t));
+}
 
-        } else {
-            if(pvt.last_chmask != chmask)
-                throw std::runtime_error("channel mask changes mid-stream not supported");
+/* Compressed sample output (.jz).  See atf_engine/jz.py
+ *
+ * Samples are encoded in blocks of jz_block (the last may be shorter),
+ * followed by a table of the file offset of each block.
+ * So any sample may be found by decoding only one block.
+ *
+ *   JzHead
+ *   block 0 ... block N-1
+ *   uint64_t offset[N]
+ *
+ * Each block is a JzBlock, the first sample as int32, then differences between
+ * successive samples in groups of up to jz_group.  Each group is a width byte 'w',
+ * followed by ceil(n*w/8) bytes of zigzag encoded differences, w bits each, packed LSB first.
+ * Host (little) endian
+ */
+constexpr size_t jz_block = 4096u;
+constexpr size_t jz_group = 128u;
+
+struct JzHead {
+    char magic[8] = {'A', 'T', 'F', 'J', 'Z', '\0', '\0', '\0'};
+    uint32_t version = 1;
+    uint32_t block = jz_block;
+    uint64_t nsamp = 0u; // total samples
+    uint64_t table = 0u; // file offset of block table.  0 until complete
+};
 
-            auto nchan = __builtin_popcount(chmask);
+struct JzBlock {
+    uint32_t size; // in bytes, including this header
+    uint32_t nsamp;
+};
 
-            if(pvt.last_seqno+1 != seqno) {
-                // eg. expect 15, have 17.  15 and 16 missing.
+// largest possible encoded block
+constexpr size_t jz_maxblock = sizeof(JzBlock) + sizeof(int32_t)
+        + (jz_block/jz_group)*(1u + jz_group*sizeof(uint32_t));
+
+// encode a block of 0 < n <= jz_block samples.  Returns bytes written to out
+size_t jz_encode(const int32_t *v, size_t n, char *out)
+{
+    auto p = out + sizeof(JzBlock);
+    memcpy(p, v, sizeof(int32_t));
+    p += sizeof(int32_t);
+
+    for(size_t g=1; g<n; g+=jz_group) {
+        size_t m = std::min(jz_group, n-g);
+        std::array<uint32_t, jz_group> z;
+        uint32_t all = 0u;
+        for(size_t j=0; j<m; j++) {
+            uint32_t d = uint32_t(v[g+j]) - uint32_t(v[g+j-1u]);
+            z[j] = (d<<1u) ^ uint32_t(int32_t(d)>>31);
+            all |= z[j];
+        }
+        unsigned w = all ? 32u - __builtin_clz(all) : 0u;
+        *p++ = char(w);
+
+        uint64_t acc = 0u;
+        unsigned nbits = 0u;
+        for(size_t j=0; w && j<m; j++) {
+            acc |= uint64_t(z[j])<<nbits;
+            nbits += w;
+            if(nbits>=32u) {
+                uint32_t word = uint32_t(acc);
+                memcpy(p, &word, sizeof(word));
+                p += sizeof(word);
+                acc >>= 32u;
+                nbits -= 32u;
+            }
+        }
+        for(; nbits; nbits -= std::min(nbits, 8u)) {
+            *p++ = char(acc);
+            acc >>= 8u;
+        }
+    }
+
+    JzBlock B{uint32_t(p-out), uint32_t(n)};
+    memcpy(out, &B, sizeof(B));
+    return B.size;
+}
+
+// decode one block of 'len' bytes.  Returns false if malformed
+bool jz_decode(const char *in, size_t len, std::vector<int32_t>& out)
+{
+    JzBlock B;
+    if(len < sizeof(B) + sizeof(int32_t))
+        return false;
+    memcpy(&B, in, sizeof(B));
+    if(B.size!=len || !B.nsamp || B.nsamp>jz_block)
+        return false;
+
+    auto p = (const uint8_t*)in + sizeof(B), end = (const uint8_t*)in + len;
+    out.resize(B.nsamp);
+    uint32_t prev;
+    memcpy(&prev, p, sizeof(prev));
+    p += sizeof(prev);
+    out[0] = int32_t(prev);
+
+    for(size_t g=1; g<B.nsamp; g+=jz_group) {
+        size_t m = std::min<size_t>(jz_group, B.nsamp-g);
+        if(p==end)
+            return false;
+        unsigned w = *p++;
+        if(w>32u || size_t(end-p) < (m*w+7u)/8u)
+            return false;
+        const uint64_t mask = (uint64_t(1u)<<w) - 1u;
+
+        uint64_t acc = 0u;
+        unsigned nbits = 0u;
+        for(size_t j=0; j<m; j++) {
+            for(; nbits<w; nbits+=8u)
+                acc |= uint64_t(*p++)<<nbits;
+            uint32_t z = uint32_t(acc & mask);
+            acc >>= w;
+            nbits -= w;
+            prev += (z>>1u) ^ (0u - (z&1u));
+            out[g+j] = int32_t(prev);
+        }
+    }
+    return p==end;
+}
+
+struct jzcodec {
+    // samples of the incomplete final block
+    std::vector<int32_t> pending;
+    // samples in complete blocks
+    uint64_t nsamp = 0u;
+    // file offset of each complete block
+    std::vector<uint64_t> table;
+    /* encoded blocks not yet written.
+     * Same size as other output buffers, so write-behind spares may be exchanged.
+     */
+    buffer_t zbuf;
+    size_t zpos = 0u;
+
+    uint64_t samples() const {
+        return nsamp + pending.size();
+    }
+
+    // next samples
+    void feed(rawfile& out, const int32_t *v, size_t n) {
+        while(n) {
+            if(pending.empty() && n>=jz_block) {
+                encode(out, v, jz_block);
+                v += jz_block;
+                n -= jz_block;
+                continue;
+            }
+            size_t take = std::min(n, jz_block - pending.size());
+            pending.insert(pending.end(), v, v+take);
+            v += take;
+            n -= take;
+            if(pending.size()==jz_block) {
+                encode(out, pending.data(), jz_block);
+                pending.clear();
+            }
+        }
+    }
+
+    void encode(rawfile& out, const int32_t *v, size_t n) {
+        if(zbuf.size()-zpos < jz_maxblock)
+            write(out);
+        table.push_back(out.woff + zpos);
+        zpos += jz_encode(v, n, zbuf.data()+zpos);
+        nsamp += n;
+    }
+
+    // write out encoded blocks.  With write-behind, may not be complete on return.
+    void write(rawfile& out) {
+        if(!zpos)
+            return;
+        if(out.checksum)
+            out.crc = crc32c(out.crc, zbuf.data(), zpos);
+        if(out.wb) {
+            out.wb->submit(out.fd, out.woff, zbuf, zpos);
+        } else {
+            pwrite_all(out.fd, zbuf.data(), zpos, out.woff);
+        }
+        out.woff += zpos;
+        zpos = 0u;
+    }
+
+    /* Write the incomplete final block after the complete blocks, without including it.
+     * Returns the resulting file size.
+     */
+    uint64_t checkpoint(rawfile& out) {
+        out.sync();
+        if(pending.empty())
+            return out.woff;
+        std::vector<char> tmp(jz_maxblock);
+        auto len = jz_encode(pending.data(), pending.size(), tmp.data());
+        pwrite_all(out.fd, tmp.data(), len, out.woff);
+        return out.woff + len;
+    }
+
+    // continue from a file truncated to the size returned by checkpoint()
+    void load(rawfile& out) {
+        const auto end = out.woff;
+        JzHead head, expect;
+        pread_all(out.fd, (char*)&head, sizeof(head), 0u);
+        if(memcmp(head.magic, expect.magic, sizeof(head.magic)) || head.version!=expect.version
+                || head.block!=expect.block)
+            throw std::runtime_error("Not a .jz file");
+
+        uint64_t off = sizeof(head);
+        std::vector<char> tmp;
+        while(off < end) {
+            JzBlock B;
+            if(end-off < sizeof(B))
+                throw std::runtime_error("Truncated .jz block");
+            pread_all(out.fd, (char*)&B, sizeof(B), off);
+            if(B.size < sizeof(B) || B.size > end-off || !B.nsamp || B.nsamp > jz_block)
+                throw std::runtime_error("Corrupt .jz block");
+
+            if(B.nsamp < jz_block) {
+                // incomplete final block.  Re-encoded as more samples arrive
+                tmp.resize(B.size);
+                pread_all(out.fd, tmp.data(), B.size, off);
+                if(off+B.size!=end || !jz_decode(tmp.data(), tmp.size(), pending))
+                    throw std::runtime_error("Corrupt .jz block");
+                break;
+            }
+            table.push_back(off);
+            nsamp += B.nsamp;
+            off += B.size;
+        }
+        out.woff = off;
+    }
+
+    /* encode any incomplete final block, then write block table and header.
+     * Returns the CRC32C of the whole file.
+     */
+    uint32_t finish(rawfile& out) {
+        out.sync();
+        if(!pending.empty()) {
+            encode(out, pending.data(), pending.size());
+            pending.clear();
+        }
+        out.sync();
+
+        JzHead head;
+        head.nsamp = nsamp;
+        head.table = out.woff;
+        pwrite_all(out.fd, (const char*)table.data(), table.size()*sizeof(uint64_t), out.woff);
+        out.woff += table.size()*sizeof(uint64_t);
+        pwrite_all(out.fd, (const char*)&head, sizeof(head), 0u);
+
+        out.crc = crc32c(out.crc, table.data(), table.size()*sizeof(uint64_t));
+        return crc32c_combine(crc32c(0u, &head, sizeof(head)), out.crc, out.woff - sizeof(head));
+    }
+};
+
+void rawfile::feed_encoder()
+{
+    jz->feed(*this, (const int32_t*)buf.data(), pos/sizeof(int32_t));
+}
+
+void rawfile::flush_encoded()
+{
+    jz->write(*this);
+}
+
+/* Sample decoding kernels.
+ *
+ * Packet body is a sequence of time points, each with one sample for each
+ * channel in chmask.  Each sample is 24-bit, big endian, two's complement.
+ *
+ * decode24() converts 'n' samples into sign extended 32-bit,
+ * preserving order.
+ * deinterleave() then scatters 'ntime' time points of 'nchan' channels
+ * into one output array per channel.
+ * scale32() and scale64() optionally convert the samples of one channel
+ * to engineering units.  in[i]*slope + intercept, without fused multiply-add
+ * so that all kernels give identical results.
+ *
+ * Selected at runtime based on CPU support.
+ */
+struct kernel {
+    const char *name;
+    void (*decode24)(const uint8_t *in, int32_t *out, size_t n);
+    void (*deinterleave)(const int32_t *in, size_t ntime, size_t nchan, uint32_t* const* out);
+    void (*scale32)(const int32_t *in, size_t n, float slope, float intercept, float *out);
+    void (*scale64)(const int32_t *in, size_t n, double slope, double intercept, double *out);
+};
+
+void decode24_scalar(const uint8_t *in, int32_t *out, size_t n)
+{
+    for(size_t i=0; i<n; i++, in+=3) {
+        auto s = uint32_t(in[0])<<16u | uint32_t(in[1])<<8u | uint32_t(in[2]);
+        if(s&0x00800000)
+            s |= 0xff000000; // sign extend
+        out[i] = s;
+    }
+}
+
+void deinterleave_scalar(const int32_t *in, size_t ntime, size_t nchan, uint32_t* const* out)
+{
+    for(size_t t=0; t<ntime; t++, in+=nchan) {
+        for(size_t c=0; c<nchan; c++)
+            out[c][t] = in[c];
+    }
+}
+
+void scale32_scalar(const int32_t *in, size_t n, float slope, float intercept, float *out)
+{
+    for(size_t i=0; i<n; i++)
+        out[i] = float(in[i])*slope + intercept;
+}
+
+void scale64_scalar(const int32_t *in, size_t n, double slope, double intercept, double *out)
+{
+    for(size_t i=0; i<n; i++)
+        out[i] = double(in[i])*slope + intercept;
+}
+
+#if defined(__x86_64__) || defined(__i386__)
+
+/* Shuffle 4x 24-bit BE into the upper 3 bytes of each 32-bit LE lane.
+ * An arithmetic right shift then sign extends.
+ */
+#define SHUF24 -1, 2, 1, 0, -1, 5, 4, 3, -1, 8, 7, 6, -1, 11, 10, 9
+
+__attribute__((target("ssse3")))
+void decode24_ssse3(const uint8_t *in, int32_t *out, size_t n)
+{
+    const auto shuf(_mm_setr_epi8(SHUF24));
+    size_t i=0;
+    // each iteration consumes 12 bytes, but loads 16
+    for(; i+6 <= n; i+=4, in+=12) {
+        auto v(_mm_loadu_si128((const __m128i*)in));
+        v = _mm_srai_epi32(_mm_shuffle_epi8(v, shuf), 8);
+        _mm_storeu_si128((__m128i*)(out+i), v);
+    }
+    decode24_scalar(in, out+i, n-i);
+}
+
+// transpose blocks of 4 time points x 4 channels
+__attribute__((target("ssse3")))
+void deinterleave_ssse3(const int32_t *in, size_t ntime, size_t nchan, uint32_t* const* out)
+{
+    if(nchan%4u)
+        return deinterleave_scalar(in, ntime, nchan, out);
+
+    size_t t=0;
+    for(; t+4 <= ntime; t+=4) {
+        auto row = in + t*nchan;
+        for(size_t c=0; c<nchan; c+=4) {
+            auto r0(_mm_loadu_si128((const __m128i*)(row + c)));
+            auto r1(_mm_loadu_si128((const __m128i*)(row + nchan + c)));
+            auto r2(_mm_loadu_si128((const __m128i*)(row + 2*nchan + c)));
+            auto r3(_mm_loadu_si128((const __m128i*)(row + 3*nchan + c)));
+
+            auto t0(_mm_unpacklo_epi32(r0, r1));
+            auto t1(_mm_unpackhi_epi32(r0, r1));
+            auto t2(_mm_unpacklo_epi32(r2, r3));
+            auto t3(_mm_unpackhi_epi32(r2, r3));
+
+            _mm_storeu_si128((__m128i*)(out[c+0]+t), _mm_unpacklo_epi64(t0, t2));
+            _mm_storeu_si128((__m128i*)(out[c+1]+t), _mm_unpackhi_epi64(t0, t2));
+            _mm_storeu_si128((__m128i*)(out[c+2]+t), _mm_unpacklo_epi64(t1, t3));
+            _mm_storeu_si128((__m128i*)(out[c+3]+t), _mm_unpackhi_epi64(t1, t3));
+        }
+    }
+    for(; t<ntime; t++) {
+        for(size_t c=0; c<nchan; c++)
+            out[c][t] = in[t*nchan + c];
+    }
+}
+
+// (SSE2 is sufficient)
+__attribute__((target("ssse3")))
+void scale32_ssse3(const int32_t *in, size_t n, float slope, float intercept, float *out)
+{
+    const auto m(_mm_set1_ps(slope)), b(_mm_set1_ps(intercept));
+    size_t i=0;
+    for(; i+4 <= n; i+=4) {
+        auto v(_mm_cvtepi32_ps(_mm_loadu_si128((const __m128i*)(in+i))));
+        _mm_storeu_ps(out+i, _mm_add_ps(_mm_mul_ps(v, m), b));
+    }
+    scale32_scalar(in+i, n-i, slope, intercept, out+i);
+}
+
+__attribute__((target("ssse3")))
+void scale64_ssse3(const int32_t *in, size_t n, double slope, double intercept, double *out)
+{
+    const auto m(_mm_set1_pd(slope)), b(_mm_set1_pd(intercept));
+    size_t i=0;
+    for(; i+2 <= n; i+=2) {
+        auto v(_mm_cvtepi32_pd(_mm_loadl_epi64((const __m128i*)(in+i))));
+        _mm_storeu_pd(out+i, _mm_add_pd(_mm_mul_pd(v, m), b));
+    }
+    scale64_scalar(in+i, n-i, slope, intercept, out+i);
+}
+
+__attribute__((target("avx2")))
+void decode24_avx2(const uint8_t *in, int32_t *out, size_t n)
+{
+    const auto shuf(_mm256_setr_epi8(SHUF24, SHUF24));
+    size_t i=0;
+    // each iteration consumes 24 bytes, but loads 12+16
+    for(; i+10 <= n; i+=8, in+=24) {
+        auto v(_mm256_inserti128_si256(_mm256_castsi128_si256(_mm_loadu_si128((const __m128i*)in)),
+                                       _mm_loadu_si128((const __m128i*)(in+12)), 1));
+        v = _mm256_srai_epi32(_mm256_shuffle_epi8(v, shuf), 8);
+        _mm256_storeu_si256((__m256i*)(out+i), v);
+    }
+    decode24_ssse3(in, out+i, n-i);
+}
+
+// transpose blocks of 8 time points x 8 channels
+__attribute__((target("avx2")))
+void deinterleave_avx2(const int32_t *in, size_t ntime, size_t nchan, uint32_t* const* out)
+{
+    if(nchan%8u)
+        return deinterleave_ssse3(in, ntime, nchan, out);
+
+    size_t t=0;
+    for(; t+8 <= ntime; t+=8) {
+        auto row = in + t*nchan;
+        for(size_t c=0; c<nchan; c+=8) {
+            __m256i r[8], u[8];
+            for(unsigned k=0; k<8; k++)
+                r[k] = _mm256_loadu_si256((const __m256i*)(row + k*nchan + c));
+
+            for(unsigned k=0; k<8; k+=4) {
+                auto t0(_mm256_unpacklo_epi32(r[k+0], r[k+1]));
+                auto t1(_mm256_unpackhi_epi32(r[k+0], r[k+1]));
+                auto t2(_mm256_unpacklo_epi32(r[k+2], r[k+3]));
+                auto t3(_mm256_unpackhi_epi32(r[k+2], r[k+3]));
+                u[k+0] = _mm256_unpacklo_epi64(t0, t2);
+                u[k+1] = _mm256_unpackhi_epi64(t0, t2);
+                u[k+2] = _mm256_unpacklo_epi64(t1, t3);
+                u[k+3] = _mm256_unpackhi_epi64(t1, t3);
+            }
+
+            for(unsigned k=0; k<4; k++) {
+                _mm256_storeu_si256((__m256i*)(out[c+k]+t), _mm256_permute2x128_si256(u[k], u[k+4], 0x20));
+                _mm256_storeu_si256((__m256i*)(out[c+k+4]+t), _mm256_permute2x128_si256(u[k], u[k+4], 0x31));
+            }
+        }
+    }
+    for(; t<ntime; t++) {
+        for(size_t c=0; c<nchan; c++)
+            out[c][t] = in[t*nchan + c];
+    }
+}
+
+__attribute__((target("avx2")))
+void scale32_avx2(const int32_t *in, size_t n, float slope, float intercept, float *out)
+{
+    const auto m(_mm256_set1_ps(slope)), b(_mm256_set1_ps(intercept));
+    size_t i=0;
+    for(; i+8 <= n; i+=8) {
+        auto v(_mm256_cvtepi32_ps(_mm256_loadu_si256((const __m256i*)(in+i))));
+        _mm256_storeu_ps(out+i, _mm256_add_ps(_mm256_mul_ps(v, m), b));
+    }
+    scale32_ssse3(in+i, n-i, slope, intercept, out+i);
+}
+
+__attribute__((target("avx2")))
+void scale64_avx2(const int32_t *in, size_t n, double slope, double intercept, double *out)
+{
+    const auto m(_mm256_set1_pd(slope)), b(_mm256_set1_pd(intercept));
+    size_t i=0;
+    for(; i+4 <= n; i+=4) {
+        auto v(_mm256_cvtepi32_pd(_mm_loadu_si128((const __m128i*)(in+i))));
+        _mm256_storeu_pd(out+i, _mm256_add_pd(_mm256_mul_pd(v, m), b));
+    }
+    scale64_ssse3(in+i, n-i, slope, intercept, out+i);
+}
+
+#undef SHUF24
+
+#endif // x86
+
+const kernel kernels[] = {
+    {"scalar", decode24_scalar, deinterleave_scalar, scale32_scalar, scale64_scalar},
+#if defined(__x86_64__) || defined(__i386__)
+    {"ssse3", decode24_ssse3, deinterleave_ssse3, scale32_ssse3, scale64_ssse3},
+    {"avx2", decode24_avx2, deinterleave_avx2, scale32_avx2, scale64_avx2},
+#endif
+};
+
+bool kernel_supported(const kernel& K)
+{
+#if defined(__x86_64__) || defined(__i386__)
+    if(strcmp(K.name, "ssse3")==0)
+        return __builtin_cpu_supports("ssse3");
+    else if(strcmp(K.name, "avx2")==0)
+        return __builtin_cpu_supports("avx2");
+#endif
+    return true;
+}
+
+const kernel* kernel_best()
+{
+    const kernel* best = &kernels[0];
+    for(auto& K : kernels) {
+        if(kernel_supported(K))
+            best = &K;
+    }
+    return best;
+}
+
+std::atomic<const kernel*> kernel_current{kernel_best()};
+
+// counters of one conversion
+struct convstats {
+    uint64_t bytes = 0u; // of .dat read
+    uint64_t packets = 0u; // data packets converted
+    uint64_t samples = 0u; // decoded, of all channels
+    uint64_t gaps = 0u; // runs of missing packets
+    uint64_t missing = 0u; // packets
+    uint64_t placeholders = 0u; // samples per channel inserted for missing packets
+    // time spent waiting for input, decoding, and writing output (including overviews and compression)
+    uint64_t read_ns = 0u, decode_ns = 0u, write_ns = 0u;
+
+    convstats& operator+=(const convstats& o) {
+        bytes += o.bytes;
+        packets += o.packets;
+        samples += o.samples;
+        gaps += o.gaps;
+        missing += o.missing;
+        placeholders += o.placeholders;
+        read_ns += o.read_ns;
+        decode_ns += o.decode_ns;
+        write_ns += o.write_ns;
+        return *this;
+    }
+};
+
+struct priv {
+    uint64_t last_seqno;
+    uint64_t last_ns;
+    uint32_t last_chmask;
+    size_t last_nsamp;
+    std::array<uint32_t, 32> last_channel;
+    bool first = true;
+    bool force = false;
+    // only convert packets with timestamps in [tstart, tend)
+    uint64_t tstart = 0u, tend = UINT64_MAX;
+    // set after a packet at or past tend
+    bool stop = false;
+    // read input through a mapping when possible
+    bool usemap = true;
+
+    // active channel indices, in order, for last_chmask
+    std::array<uint8_t, 32> chans;
+    unsigned nchan = 0;
+    // decoded samples of current packet
+    std::vector<int32_t> samples;
+
+    std::string outdir;
+
+    // expected number of input bytes remaining.  0 if unknown.
+    uint64_t expect = 0;
+
+    /* Bytes of buffer memory which this conversion may use.  0 for default buffer sizes.
+     * Buffers are drawn from a bounded pool: one for input (unless mapped),
+     * one per active channel and the index, and nspare write-behind buffers shared by all.
+     */
+    uint64_t budget = 0;
+    static constexpr unsigned nspare = 4u;
+
+    size_t in_bufsize() const {
+        return in_bufsize(budget);
+    }
+    static size_t in_bufsize(uint64_t budget) {
+        // before the first packet, the number of channels is not known.  Assume all.
+        return budget ? clamp_bufsize(budget/(1u + 32u + nspare)) : default_bufsize;
+    }
+    size_t out_bufsize() const {
+        if(!budget)
+            return default_bufsize;
+        // a mapping may fail, so always count input.  When compressing, each channel also stages samples
+        auto inbuf = in_bufsize() + (compress ? nchan*min_bufsize : 0u);
+        return clamp_bufsize(budget > inbuf ? (budget - inbuf)/(nchan + negu() + 1u + nspare) : 0u);
+    }
+
+    // must out-live out_channel
+    std::unique_ptr<writer> wb;
+
+    // also write min/max overviews of each channel
+    bool overview = false;
+    std::array<pyramid, 32> ovr;
+
+    // write compressed .jz instead of .j
+    bool compress = false;
+    std::array<jzcodec, 32> jz;
+
+    /* Also write samples of some channels scaled to engineering units.
+     * Raw arrays of float32 (.f32) or float64 (.f64), without header.
+     */
+    struct scaling {
+        double slope = 1.0, intercept = 0.0;
+        unsigned width = 0u; // bytes per sample.  0 (not written), 4, or 8
+        bool operator==(const scaling& o) const {
+            return slope==o.slope && intercept==o.intercept && width==o.width;
+        }
+    };
+    std::array<scaling, 32> egu;
+    std::array<rawfile, 32> out_egu;
+    std::array<uint32_t, 32> egu_crcs{};
+    // number of active channels with scaled output
+    unsigned negu() const {
+        unsigned n = 0u;
+        for(unsigned k=0; k<nchan; k++)
+            n += egu[chans[k]].width ? 1u : 0u;
+        return n;
+    }
+
+    std::array<rawfile, 32> out_channel;
+    rawfile out_status;
+    rawfile out_index;
+    // samples written to each output channel
+    uint64_t ntime = 0;
+
+    // list of corrected/non-fatel errors
+    std::vector<std::string> errors;
+    // (first sample, number of samples) of each run of placeholders for missing packets
+    std::vector<std::pair<uint64_t, uint64_t>> gaps;
+    convstats stats;
+
+    // number of input files completed, and hash of their names
+    size_t ndat = 0;
+    uint64_t dathash = fnv1a_init;
+
+    /* CRC32C of each input file completed, in order.
+     * Not computed when converting a time window, which may skip reading some files.
+     */
+    bool dat_crc = true;
+    std::vector<uint32_t> dat_crcs;
+    // CRC32C of each complete output channel file
+    std::array<uint32_t, 32> out_crcs{};
+
+    void prepare_output();
+    void finalize_output();
+    void start_writer();
+    // write out, and free, output buffers.  Re-allocate with start_writer()
+    void release_buffers();
+
+    void set_chmask(uint32_t chmask) {
+        last_chmask = chmask;
+        nchan = 0;
+        for(unsigned i=0; i<32; i++) {
+            if((1u<<i) & chmask)
+                chans[nchan++] = i;
+        }
+    }
+
+    void decode(const uint8_t *body, size_t ntime);
+    void fill(uint64_t ntime);
+    void write_egu(const kernel *K, unsigned i, const int32_t *v, size_t n);
+    void fill_egu(unsigned i, int32_t s, uint64_t n);
+
+    std::string chan_name(unsigned i) const {
+        return chan_name(i, compress);
+    }
+    std::string chan_name(unsigned i, bool jz) const {
+        // eg. "CH01.j" or "CH01.jz"
+        return SB()<<outdir<<"/CH"<<std::dec<<std::setw(2)<<std::setfill('0')<<i<<(jz ? ".jz" : ".j");
+    }
+    std::string index_name() const {
+        return SB()<<outdir<<"/packets.idx";
+    }
+    std::string gaps_name() const {
+        return SB()<<outdir<<"/gaps.json";
+    }
+    std::string egu_name(unsigned i) const {
+        return egu_name(i, egu[i].width);
+    }
+    std::string egu_name(unsigned i, unsigned width) const {
+        // eg. "CH01.f32"
+        return SB()<<outdir<<"/CH"<<std::dec<<std::setw(2)<<std::setfill('0')<<i<<(width==8u ? ".f64" : ".f32");
+    }
+    std::string checksums_name() const {
+        return SB()<<outdir<<"/checksums.json";
+    }
+    std::string ovr_name(unsigned i, unsigned level) const {
+        // eg. "CH01.16.ovr"
+        return SB()<<outdir<<"/CH"<<std::dec<<std::setw(2)<<std::setfill('0')<<i
+                   <<"."<<ovr_factor(level)<<".ovr";
+    }
+
+    // read back n samples of channel i, beginning with sample s0
+    void read_samples(unsigned i, uint64_t s0, size_t n, std::vector<int32_t>& out);
+    // recompute partial overview blocks from the .j files, when continuing from ntime
+    void prime_overview();
+    // compute overviews from samples as written.  priv must not be moved afterwards.
+    void attach_overview() {
+        for(unsigned k=0; k<nchan; k++)
+            out_channel[chans[k]].ovr = overview ? &ovr[chans[k]] : nullptr;
+    }
+
+    void checkpoint(const std::string& indat);
+    size_t resume(const std::vector<std::string>& indats);
+    bool load_checkpoint(const std::vector<std::string>& indats);
+    void discard_output();
+
+    static constexpr uint64_t fnv1a_init = 0xcbf29ce484222325ull;
+    static uint64_t fnv1a(uint64_t hash, const std::string& s) {
+        for(auto c : s) {
+            hash ^= uint8_t(c);
+            hash *= 0x100000001b3ull;
+        }
+        return hash;
+    }
+};
+
+/* Check for a chain of packet headers beginning at 'off'.
+ * True if three follow one another, or the chain ends exactly at EoF.
+ */
+bool packet_chain(const char *base, size_t len, size_t off)
+{
+    for(unsigned n=0; n<3u; n++) {
+        if(off==len)
+            return n>0u;
+        PSCHead head;
+        if(len-off < sizeof(head))
+            return false;
+        memcpy(&head, base+off, sizeof(head));
+        auto msgid = be16toh(head.msgid);
+        if(be16toh(head.ps)!=0x5053 || (msgid!=0x4e41 && msgid!=0x4e42))
+            return false;
+        off += sizeof(head) + uint64_t(be32toh(head.msglen));
+        if(off > len)
+            return false;
+    }
+    return true;
+}
+
+/* Find the offset of a data packet near the first with a timestamp >= 'ns'.
+ * Bisect by re-synchronizing to packet boundaries from arbitrary offsets.
+ * Returns the offset of a packet before, from which to continue reading.
+ */
+size_t seek_time(const char *base, size_t len, uint64_t ns)
+{
+    size_t lo = 0u, hi = len;
+    while(hi-lo > 64u*1024u) {
+        auto mid = lo + (hi-lo)/2u;
+        auto pkt = mid;
+        while(pkt < hi && !(base[pkt]=='P' && packet_chain(base, len, pkt)))
+            pkt++;
+
+        if(pkt >= hi || len-pkt < sizeof(PSCHead)+sizeof(QuartzNA)) {
+            hi = mid;
+            continue;
+        }
+
+        QuartzNA hdrA;
+        memcpy(&hdrA, base+pkt+sizeof(PSCHead), sizeof(hdrA));
+        auto nsec = uint64_t(be32toh(hdrA.sec))*1000000000 + be32toh(hdrA.ns);
+        if(nsec < ns)
+            lo = pkt;
+        else
+            hi = mid;
+    }
+    return lo;
+}
+
+// Timestamp of the first packet of a .dat file.  UINT64_MAX if unknown
+uint64_t first_time(const std::string& fname)
+{
+    uint64_t ret = UINT64_MAX;
+    int fd = open(fname.c_str(), O_RDONLY | O_LARGEFILE);
+    if(fd>=0) {
+        struct {
+            PSCHead head;
+            QuartzNA hdrA;
+        } pkt;
+        if(pread(fd, &pkt, sizeof(pkt), 0)==ssize_t(sizeof(pkt))
+                && be16toh(pkt.head.ps)==0x5053
+                && (be16toh(pkt.head.msgid)==0x4e41 || be16toh(pkt.head.msgid)==0x4e42))
+        {
+            ret = uint64_t(be32toh(pkt.hdrA.sec))*1000000000 + be32toh(pkt.hdrA.ns);
+        }
+        ::close(fd);
+    }
+    return ret;
+}
+
+void convert1(priv& pvt, const std::string& indat)
+{
+    rawfile istrm(indat.c_str(), false, pvt.usemap, pvt.in_bufsize());
+    istrm.checksum = pvt.dat_crc;
+
+    if(pvt.tstart && istrm.mapped)
+        istrm.pos = seek_time(istrm.map, istrm.limit, pvt.tstart);
+    const uint64_t begin = istrm.tell();
+
+    PSCHead head;
+    while(istrm.read_into(head)) {
+        istrm.readahead();
+
+        uint64_t pktoff = istrm.tell() - sizeof(head);
+        uint16_t msgid = be16toh(head.msgid);
+        uint32_t msglen = be32toh(head.msglen);
+        bool hasB = false;
+
+        // headers already validated during recording process.
+        // An error here implies some later disk error.
+        // Treat as fatal
+        if(be16toh(head.ps)!=0x5053 || msglen<sizeof(QuartzNA)) { // "PS"
+            throw std::runtime_error(SB()<<"Corrupt header in '"<<indat<<"' near "<<istrm.tell());
+        }
+        if(!istrm.ensure(msglen)) {
+            throw std::runtime_error(SB()<<"Truncated msg in '"<<indat<<"' near "<<istrm.tell());
+        }
+
+        switch(msgid) {
+        case 0x4e41: // "NA"
+            break;
+        case 0x4e42: // "NB"
+            hasB = true;
+            if(msglen<sizeof(QuartzNA)+sizeof(QuartzNB))
+                throw std::runtime_error(SB()<<"Corrupt headerB in '"<<indat<<"' near "<<istrm.tell());
+            break;
+        default:
+            istrm.drain(msglen);
+            continue;
+        }
+
+        auto hdrA(istrm.read_as<QuartzNA>());
+        msglen -= sizeof(QuartzNA);
+        auto chmask = be32toh(hdrA.chmask);
+        auto seqno = be64toh(hdrA.seqno);
+        auto nsec = uint64_t(be32toh(hdrA.sec))*1000000000 + be32toh(hdrA.ns);
+
+        if(nsec < pvt.tstart) {
+            istrm.drain(msglen);
+            continue;
+        } else if(nsec >= pvt.tend) {
+            pvt.stop = true;
+            break;
+        }
+
+        if(pvt.first) {
+            pvt.first = false;
+            pvt.set_chmask(chmask);
+            pvt.prepare_output();
+
+        } else {
+            if(pvt.last_chmask != chmask)
+                throw std::runtime_error("channel mask changes mid-stream not supported");
+
+            auto nchan = __builtin_popcount(chmask);
+
+            if(pvt.last_seqno+1 != seqno) {
+                // eg. expect 15, have 17.  15 and 16 missing.
                 auto nmissing = seqno - (pvt.last_seqno+1);
                 auto deltaT = (nsec - pvt.last_ns)*1e-9;
                 auto Fsamp = (nmissing*pvt.last_nsamp/nchan)/deltaT;
@@ -357,23 +1843,12 @@ void convert1(priv& pvt, const std::string& indat)
                     throw std::runtime_error(SB()<<"Inconsistency between timestamp "
                                              <<deltaT<<" and seqno "<<nmissing<<", Fsamp "<<Fsamp);
 
-                const auto chmask = pvt.last_chmask;
-
                 // inject placeholder samples based on last packet processed
-                while(nmissing--) {
-                    auto nsamp = pvt.last_nsamp;
-
-                    while(nsamp) {
-                        for(unsigned i=0; i<32; i++) {
-                            if(!((1u<<i) & chmask))
-                                continue;
-
-                            auto s = pvt.last_channel[i];
-                            pvt.out_channel[i].write_from(s);
-                            nsamp--;
-                        }
-                    }
-                }
+                uint64_t nfill = nmissing*(pvt.last_nsamp/nchan);
+                pvt.gaps.emplace_back(pvt.ntime, nfill);
+                pvt.stats.gaps++;
+                pvt.stats.missing += nmissing;
+                pvt.fill(nfill);
             }
         }
         pvt.last_seqno = seqno;
@@ -390,96 +1865,1208 @@ void convert1(priv& pvt, const std::string& indat)
         auto nsamp = msglen/3u;
         pvt.last_nsamp = nsamp;
 
-        // 'pos' pointed at first byte of first sample
-        auto cur = (const uint8_t*)istrm.buf.data() + istrm.pos;
-
-        while(nsamp) {
-            // first sample in each packet is for first channel in mask.
-            // each packet contains only complete time points
-            for(unsigned i=0; i<32; i++) {
-                if(!((1u<<i) & chmask))
-                    continue;
-
-                if(!nsamp)
-                    throw std::runtime_error("Trucated body");
-
-                auto s = uint32_t(cur[0])<<16u | uint32_t(cur[1])<<8u | uint32_t(cur[2]);
-                if(s&0x00800000)
-                    s |= 0xff000000; // sign extend
-                cur += 3;
-                nsamp--;
-
-                pvt.last_channel[i] = s;
-                pvt.out_channel[i].write_from(s);
-            }
+        // first sample in each packet is for first channel in mask.
+        // each packet contains only complete time points
+        if(nsamp % pvt.nchan)
+            throw std::runtime_error("Trucated body");
+
+        PktIndexRec rec{seqno, nsec, pvt.ntime, pktoff, uint32_t(pvt.ndat), uint32_t(nsamp / pvt.nchan)};
+        pvt.out_index.write_from(rec);
+        pvt.stats.packets++;
+
+        // 'pos' pointed at first byte of first sample
+        auto cur = (const uint8_t*)istrm.data();
+
+        pvt.decode(cur, nsamp / pvt.nchan);
+
+        // warn on leftovers?
+
+        istrm.drain(msglen);
+    }
+    pvt.stats.bytes += istrm.tell() - begin;
+    if(pvt.dat_crc) {
+        istrm.checksum_rest(); // any trailing bytes
+        pvt.dat_crcs.push_back(istrm.crc);
+    }
+    pvt.stats.read_ns += istrm.read_ns;
+}
+
+// CRC32C of a whole file
+uint32_t crc32c_file(const std::string& fname)
+{
+    rawfile istrm(fname.c_str(), false, false);
+    istrm.checksum = true;
+    istrm.checksum_rest();
+    return istrm.crc;
+}
+
+// Begin reading the start of the next input file in the background
+void prefetch_file(const std::string& fname)
+{
+    int fd = open(fname.c_str(), O_RDONLY | O_LARGEFILE);
+    if(fd>=0) {
+        (void)posix_fadvise(fd, 0, 32u*1024u*1024u, POSIX_FADV_WILLNEED);
+        ::close(fd);
+    }
+}
+
+// Summary of one .dat file from its packet headers
+struct datscan {
+    // number of data packets.  When zero, other members are not set.
+    size_t npkt = 0;
+    uint32_t chmask = 0;
+    uint64_t first_seqno = 0;
+    // as priv::last_*
+    uint64_t last_seqno = 0;
+    uint64_t last_ns = 0;
+    size_t last_nsamp = 0;
+    std::array<uint32_t, 32> last_channel{};
+    // output samples per channel, including placeholders for packets missing within this file
+    uint64_t ntime = 0;
+};
+
+/* Read the headers of one .dat file, and the last time point.
+ * Throws on anything convert1() would treat as an error.
+ */
+void scan1(datscan& S, const std::string& indat, bool usemap, size_t bufsize)
+{
+    rawfile istrm(indat.c_str(), false, usemap, bufsize);
+    unsigned nchan = 0;
+
+    PSCHead head;
+    while(istrm.read_into(head)) {
+        istrm.readahead();
+
+        uint16_t msgid = be16toh(head.msgid);
+        uint32_t msglen = be32toh(head.msglen);
+
+        if(be16toh(head.ps)!=0x5053 || msglen<sizeof(QuartzNA) || !istrm.ensure(msglen))
+            throw std::runtime_error("Corrupt header");
+
+        size_t hlen = sizeof(QuartzNA);
+        if(msgid==0x4e42) { // "NB"
+            hlen += sizeof(QuartzNB);
+            if(msglen<hlen)
+                throw std::runtime_error("Corrupt headerB");
+        } else if(msgid!=0x4e41) { // not "NA"
+            istrm.drain(msglen);
+            continue;
+        }
+
+        QuartzNA hdrA;
+        memcpy(&hdrA, istrm.data(), sizeof(hdrA));
+        auto chmask = be32toh(hdrA.chmask);
+        auto seqno = be64toh(hdrA.seqno);
+        auto nsamp = (msglen-hlen)/3u;
+
+        if(!S.npkt) {
+            S.chmask = chmask;
+            S.first_seqno = seqno;
+            nchan = __builtin_popcount(chmask);
+
+        } else if(S.chmask != chmask) {
+            throw std::runtime_error("channel mask changes");
+
+        } else if(S.last_seqno+1u != seqno) {
+            if(seqno <= S.last_seqno)
+                throw std::runtime_error("seqno out of order");
+            S.ntime += (seqno - (S.last_seqno+1u))*(S.last_nsamp/nchan);
+        }
+        if(!nchan || nsamp % nchan)
+            throw std::runtime_error("Trucated body");
+
+        S.npkt++;
+        S.last_seqno = seqno;
+        S.last_ns = uint64_t(be32toh(hdrA.sec))*1000000000 + be32toh(hdrA.ns);
+        S.last_nsamp = nsamp;
+        S.ntime += nsamp/nchan;
+
+        if(nsamp) {
+            // last time point
+            auto last = (const uint8_t*)istrm.data() + hlen + (nsamp-nchan)*3u;
+            std::array<int32_t, 32> vals;
+            decode24_scalar(last, vals.data(), nchan);
+            for(unsigned i=0, k=0; i<32; i++) {
+                if((1u<<i) & chmask)
+                    S.last_channel[i] = vals[k++];
+            }
+        }
+
+        istrm.drain(msglen);
+    }
+}
+
+/* Run fn(n) for each n in [0, N) with up to 'threads' threads.
+ * After all complete, re-throw the exception of the lowest n which failed.
+ */
+template<typename Fn>
+void parallel_for(size_t N, unsigned threads, Fn&& fn)
+{
+    std::atomic<size_t> next{0u};
+    std::vector<std::exception_ptr> fails(N);
+
+    auto work = [&]() {
+        for(size_t n; (n = next++) < N; ) {
+            try {
+                fn(n);
+            }catch(...){
+                fails[n] = std::current_exception();
+            }
+        }
+    };
+
+    std::vector<std::thread> workers;
+    for(unsigned t=1; t<threads && t<N; t++)
+        workers.emplace_back(work);
+    work();
+    for(auto& T : workers)
+        T.join();
+
+    for(auto& fail : fails) {
+        if(fail)
+            std::rethrow_exception(fail);
+    }
+}
+
+/* Convert indats[skip, skip+N) with several files decoded concurrently.
+ * A scan of packet headers finds where the output of each file begins,
+ * including any placeholders for packets missing at file boundaries.
+ * Then each file is decoded by convert1() with a separate priv, which writes
+ * at those offsets.  Output and errors are the same as serial conversion.
+ * Checkpoints once all N are complete.
+ *
+ * The buffers of pvt are released while the workers run, so that each
+ * worker may use an equal share of the memory budget.
+ *
+ * Returns false, before writing any output, if the scan finds anything
+ * unusual.  eg. a corrupt packet.  Serial conversion then reports it.
+ */
+bool convert_parallel(priv& pvt, const std::vector<std::string>& indats, size_t skip, size_t N, unsigned threads)
+{
+    const uint64_t wbudget = pvt.budget/threads;
+    const auto bufsize = priv::in_bufsize(wbudget);
+
+    pvt.release_buffers();
+    auto restore = [&pvt]() -> bool {
+        if(!pvt.first)
+            pvt.start_writer();
+        return false;
+    };
+
+    std::vector<datscan> scans(N);
+    auto T0 = now_ns();
+    try {
+        parallel_for(N, threads, [&](size_t n) {
+            scan1(scans[n], indats[skip+n], pvt.usemap, bufsize);
+        });
+    }catch(std::exception&){
+        return restore();
+    }
+    pvt.stats.read_ns += now_ns() - T0;
+
+    // state before each file, and output position (in samples per channel) of its first
+    datscan init;
+    if(!pvt.first) {
+        init.npkt = 1u;
+        init.chmask = pvt.last_chmask;
+        init.last_seqno = pvt.last_seqno;
+        init.last_ns = pvt.last_ns;
+        init.last_nsamp = pvt.last_nsamp;
+        init.last_channel = pvt.last_channel;
+    }
+    std::vector<const datscan*> prevs(N);
+    std::vector<uint64_t> starts(N+1u);
+    const datscan* prev = &init;
+    uint64_t ntime = 0u;
+
+    for(size_t n=0; n<N; n++) {
+        auto& S = scans[n];
+        prevs[n] = prev;
+        starts[n] = ntime;
+        if(!S.npkt)
+            continue;
+
+        if(!prev->npkt) {
+            // first packet of conversion.  No placeholders
+            init.npkt = 1u;
+            init.chmask = S.chmask;
+            init.last_seqno = S.first_seqno-1u;
+
+        } else if(prev->chmask != S.chmask || S.first_seqno <= prev->last_seqno) {
+            return restore();
+
+        } else {
+            auto nmissing = S.first_seqno - (prev->last_seqno+1u);
+            ntime += nmissing*(prev->last_nsamp/__builtin_popcount(S.chmask));
+        }
+        ntime += S.ntime;
+        prev = &S;
+    }
+    starts[N] = ntime;
+
+    if(!prev->npkt)
+        return restore(); // nothing to do in parallel
+
+    if(pvt.first) {
+        pvt.first = false;
+        pvt.set_chmask(init.chmask);
+        pvt.prepare_output();
+        pvt.release_buffers();
+    }
+
+    std::array<uint64_t, 32> base{}, base_egu{};
+    for(unsigned k=0; k<pvt.nchan; k++) {
+        auto i = pvt.chans[k];
+        auto& out = pvt.out_channel[i];
+        out.sync();
+        base[i] = out.tell();
+        if(pvt.egu[i].width) {
+            pvt.out_egu[i].sync();
+            base_egu[i] = pvt.out_egu[i].tell();
+        }
+    }
+    // position of first index record of each file
+    pvt.out_index.sync();
+    std::vector<uint64_t> ioffs(N+1u);
+    ioffs[0] = pvt.out_index.tell();
+    for(size_t n=0; n<N; n++)
+        ioffs[n+1u] = ioffs[n] + scans[n].npkt*sizeof(PktIndexRec);
+
+    /* Overview blocks spanning a file boundary are skipped by both workers,
+     * and computed afterwards.
+     */
+    const uint64_t S0 = pvt.ntime;
+    auto ovr_off = [](uint64_t nblock) -> uint64_t {
+        return sizeof(OvrHead) + nblock*2u*sizeof(int32_t);
+    };
+    for(unsigned k=0; pvt.overview && k<pvt.nchan; k++) {
+        for(auto& L : pvt.ovr[pvt.chans[k]].levels)
+            L.out.sync();
+    }
+
+    std::vector<std::vector<std::string>> errors(N);
+    std::vector<std::vector<std::pair<uint64_t, uint64_t>>> gaps(N);
+    // times are summed over all workers
+    std::vector<convstats> stats(N);
+    // of each input file, and of the output of each file to each channel
+    std::vector<uint32_t> dat_crcs(N);
+    std::vector<std::array<uint32_t, 32>> out_crcs(N), egu_crcs(N);
+
+    parallel_for(N, threads, [&](size_t n) {
+        if(!scans[n].npkt) {
+            if(pvt.dat_crc)
+                dat_crcs[n] = crc32c_file(indats[skip+n]);
+            return;
+        }
+        auto& P = *prevs[n];
+
+        priv w{};
+        w.outdir = pvt.outdir;
+        w.force = pvt.force;
+        w.usemap = pvt.usemap;
+        w.dat_crc = pvt.dat_crc;
+        w.egu = pvt.egu;
+        w.budget = wbudget;
+        w.first = false;
+        w.set_chmask(pvt.last_chmask);
+        w.last_seqno = P.last_seqno;
+        w.last_ns = P.last_ns;
+        w.last_nsamp = P.last_nsamp;
+        w.last_channel = P.last_channel;
+        w.ntime = pvt.ntime + starts[n];
+        w.ndat = pvt.ndat + n;
+
+        auto reopen = [](const rawfile& orig, uint64_t off) -> rawfile {
+            int fd = dup(orig.fd);
+            if(fd<0) {
+                int err = errno;
+                throw std::runtime_error(SB()<<"Unable to dup : "<<err<<" "<<strerror(err));
+            }
+            return rawfile(fd, off);
+        };
+        for(unsigned k=0; k<w.nchan; k++) {
+            auto i = w.chans[k];
+            w.out_channel[i] = reopen(pvt.out_channel[i], base[i] + starts[n]*sizeof(uint32_t));
+            if(w.egu[i].width)
+                w.out_egu[i] = reopen(pvt.out_egu[i], base_egu[i] + starts[n]*w.egu[i].width);
+        }
+        w.out_index = reopen(pvt.out_index, ioffs[n]);
+
+        // first and last sample of this file
+        const uint64_t gs = S0 + starts[n], ge = S0 + starts[n+1u];
+        w.overview = pvt.overview;
+        for(unsigned k=0; w.overview && k<w.nchan; k++) {
+            auto i = w.chans[k];
+            for(unsigned l=0; l<ovr_levels; l++) {
+                auto F = ovr_factor(l);
+                w.ovr[i].levels[l].out = reopen(pvt.ovr[i].levels[l].out, ovr_off((gs+F-1u)/F));
+            }
+        }
+        w.start_writer();
+        for(unsigned k=0; w.overview && k<w.nchan; k++)
+            w.ovr[w.chans[k]].start_at(gs);
+        w.attach_overview();
+
+        convert1(w, indats[skip+n]);
+
+        for(unsigned k=0; k<w.nchan; k++) {
+            auto& out = w.out_channel[w.chans[k]];
+            out.sync();
+            if(out.tell() != base[w.chans[k]] + starts[n+1u]*sizeof(uint32_t))
+                throw std::logic_error(SB()<<"Parallel conversion size mismatch for '"<<indats[skip+n]<<"'");
+
+            auto width = w.egu[w.chans[k]].width;
+            if(!width)
+                continue;
+            auto& eout = w.out_egu[w.chans[k]];
+            eout.sync();
+            if(eout.tell() != base_egu[w.chans[k]] + starts[n+1u]*width)
+                throw std::logic_error(SB()<<"Parallel conversion scaled size mismatch for '"<<indats[skip+n]<<"'");
+        }
+        w.out_index.sync();
+        if(w.out_index.tell() != ioffs[n+1u])
+            throw std::logic_error(SB()<<"Parallel conversion index mismatch for '"<<indats[skip+n]<<"'");
+        for(unsigned k=0; w.overview && k<w.nchan; k++) {
+            for(unsigned l=0; l<ovr_levels; l++) {
+                auto F = ovr_factor(l);
+                auto& out = w.ovr[w.chans[k]].levels[l].out;
+                out.sync();
+                // complete blocks, if any, which begin and end within this file
+                if(out.tell() != ovr_off(std::max((gs+F-1u)/F, ge/F)))
+                    throw std::logic_error(SB()<<"Parallel conversion overview mismatch for '"<<indats[skip+n]<<"'");
+            }
+        }
+        errors[n] = std::move(w.errors);
+        gaps[n] = std::move(w.gaps);
+        stats[n] = w.stats;
+        if(w.dat_crc)
+            dat_crcs[n] = w.dat_crcs.at(0);
+        for(unsigned k=0; k<w.nchan; k++) {
+            out_crcs[n][w.chans[k]] = w.out_channel[w.chans[k]].crc;
+            egu_crcs[n][w.chans[k]] = w.out_egu[w.chans[k]].crc;
+        }
+    });
+
+    for(size_t n=0; n<N; n++) {
+        for(auto& err : errors[n])
+            pvt.errors.push_back(std::move(err));
+        pvt.gaps.insert(pvt.gaps.end(), gaps[n].begin(), gaps[n].end());
+        pvt.stats += stats[n];
+        if(pvt.dat_crc)
+            pvt.dat_crcs.push_back(dat_crcs[n]);
+        // output of each file follows that of the previous
+        for(unsigned k=0; k<pvt.nchan; k++) {
+            auto i = pvt.chans[k];
+            auto& out = pvt.out_channel[i];
+            out.crc = crc32c_combine(out.crc, out_crcs[n][i], (starts[n+1u]-starts[n])*sizeof(uint32_t));
+            auto& eout = pvt.out_egu[i];
+            eout.crc = crc32c_combine(eout.crc, egu_crcs[n][i], (starts[n+1u]-starts[n])*pvt.egu[i].width);
+        }
+    }
+
+    pvt.last_seqno = prev->last_seqno;
+    pvt.last_ns = prev->last_ns;
+    pvt.last_nsamp = prev->last_nsamp;
+    pvt.last_channel = prev->last_channel;
+    for(unsigned k=0; k<pvt.nchan; k++) {
+        auto i = pvt.chans[k];
+        pvt.out_channel[i].woff = base[i] + ntime*sizeof(uint32_t);
+        if(pvt.egu[i].width)
+            pvt.out_egu[i].woff = base_egu[i] + ntime*pvt.egu[i].width;
+    }
+    pvt.out_index.woff = ioffs[N];
+    pvt.ntime += ntime;
+    pvt.start_writer();
+
+    if(pvt.overview) {
+        std::vector<int32_t> block;
+        for(unsigned k=0; k<pvt.nchan; k++) {
+            auto i = pvt.chans[k];
+            pvt.out_channel[i].sync();
+
+            for(unsigned l=0; l<ovr_levels; l++) {
+                auto F = ovr_factor(l);
+                auto& out = pvt.ovr[i].levels[l].out;
+                uint64_t prevb = UINT64_MAX;
+
+                for(size_t n=0; n<N; n++) {
+                    auto b = (S0 + starts[n])/F;
+                    if(!scans[n].npkt || (S0 + starts[n])%F==0u || b==prevb || (b+1u)*F > pvt.ntime)
+                        continue; // aligned, already done, or incomplete final block
+                    prevb = b;
+
+                    pvt.read_samples(i, b*F, F, block);
+                    auto ent(pyramid::span(block.data(), F));
+                    int32_t pair[2] = {ent.first, ent.second};
+                    out.pwrite_at(ovr_off(b), pair, sizeof(pair));
+                }
+                out.woff = ovr_off(pvt.ntime/F);
+            }
+        }
+        pvt.prime_overview();
+    }
+
+    for(size_t n=0; n+1u<N; n++) {
+        pvt.ndat++;
+        pvt.dathash = priv::fnv1a(pvt.dathash, indats[skip+n]);
+    }
+    pvt.checkpoint(indats[skip+N-1u]);
+    return true;
+}
+
+void convert2j(const std::vector<std::string>& indats,
+               const std::string& outdir,
+               std::vector<std::string>& errors,
+               convstats& stats,
+               bool force,
+               bool resume,
+               bool usemap,
+               uint64_t budget,
+               unsigned threads,
+               uint64_t tstart,
+               uint64_t tend,
+               bool overview,
+               bool compress,
+               const std::array<priv::scaling, 32>& egu)
+{
+    priv pvt{};
+    pvt.overview = overview;
+    pvt.compress = compress;
+    pvt.egu = egu;
+    pvt.outdir = outdir;
+    pvt.force = force;
+    pvt.usemap = usemap;
+    pvt.budget = budget;
+    pvt.tstart = tstart;
+    pvt.tend = tend;
+    const bool windowed = tstart!=0u || tend!=UINT64_MAX;
+    pvt.dat_crc = !windowed;
+
+    size_t skip = resume ? pvt.resume(indats) : 0u;
+
+    std::vector<uint64_t> sizes(indats.size());
+    for(size_t n=skip; n<indats.size(); n++) {
+        struct stat info;
+        if(stat(indats[n].c_str(), &info)==0)
+            sizes[n] = info.st_size;
+        if(!windowed) // output size not known in advance
+            pvt.expect += sizes[n];
+    }
+
+    // compressed output size, so the offset of each file's output, is not known in advance
+    const bool parallel = threads>1u && !windowed && !compress;
+    // files of a batch which could not be decoded in parallel are converted serially
+    size_t serial_until = skip;
+
+    for(size_t n=skip; n<indats.size() && !pvt.stop; n++) {
+        /* Decode batches of up to 'threads' files in parallel.
+         * Each batch is checkpointed, so an interruption loses at most one batch.
+         */
+        auto batch = std::min<size_t>(threads, indats.size()-n);
+        if(parallel && n>=serial_until && batch>1u) {
+            if(convert_parallel(pvt, indats, n, batch, threads)) {
+                for(size_t m=n; m<n+batch; m++)
+                    pvt.expect -= sizes[m];
+                n += batch-1u;
+                continue;
+            }
+            serial_until = n+batch;
+        }
+
+        if(tstart && n+1u < indats.size() && first_time(indats[n+1])<=tstart) {
+            // all packets before window
+            pvt.checkpoint(indats[n]);
+            continue;
+        }
+        if(n+1u < indats.size())
+            prefetch_file(indats[n+1]);
+
+        convert1(pvt, indats[n]);
+        pvt.checkpoint(indats[n]);
+        if(!windowed)
+            pvt.expect -= sizes[n];
+    }
+
+    pvt.finalize_output();
+    errors = std::move(pvt.errors);
+    stats = pvt.stats;
+}
+
+void priv::decode(const uint8_t *body, size_t ntime)
+{
+    if(!ntime)
+        return;
+
+    auto K = kernel_current.load(std::memory_order_relaxed);
+    auto nsamp = ntime*nchan;
+
+    if(samples.size() < nsamp)
+        samples.resize(nsamp);
+
+    auto T0 = now_ns();
+    std::array<uint32_t*, 32> outs;
+    for(unsigned k=0; k<nchan; k++)
+        outs[k] = (uint32_t*)out_channel[chans[k]].reserve(ntime*sizeof(uint32_t));
+
+    auto T1 = now_ns();
+    K->decode24(body, samples.data(), nsamp);
+    K->deinterleave(samples.data(), ntime, nchan, outs.data());
+    for(unsigned k=0; k<nchan; k++) {
+        if(egu[chans[k]].width)
+            write_egu(K, chans[k], (const int32_t*)outs[k], ntime);
+    }
+
+    stats.write_ns += T1 - T0;
+    stats.decode_ns += now_ns() - T1;
+    stats.samples += nsamp;
+
+    auto last = samples.data() + (ntime-1u)*nchan;
+    for(unsigned k=0; k<nchan; k++) {
+        out_channel[chans[k]].commit(ntime*sizeof(uint32_t));
+        last_channel[chans[k]] = last[k];
+    }
+    this->ntime += ntime;
+}
+
+// append n samples of channel i, scaled
+void priv::write_egu(const kernel *K, unsigned i, const int32_t *v, size_t n)
+{
+    const auto& E = egu[i];
+    auto& out = out_egu[i];
+    while(n) {
+        // fill out the current buffer, or all of the next
+        size_t avail = (out.buf.size() - out.pos)/E.width;
+        size_t m = std::min(n, avail ? avail : out.buf.size()/E.width);
+        auto p = out.reserve(m*E.width);
+        if(E.width==8u) {
+            K->scale64(v, m, E.slope, E.intercept, (double*)p);
+        } else {
+            K->scale32(v, m, float(E.slope), float(E.intercept), (float*)p);
+        }
+        out.commit(m*E.width);
+        v += m;
+        n -= m;
+    }
+}
+
+// append n copies of sample s of channel i, scaled
+void priv::fill_egu(unsigned i, int32_t s, uint64_t n)
+{
+    const auto& E = egu[i];
+    auto& out = out_egu[i];
+    // as fill(), in blocks of the output buffer
+    auto fill_with = [&out, n](auto val) {
+        typedef decltype(val) T;
+        for(uint64_t remaining = n; remaining; ) {
+            size_t avail = (out.buf.size() - out.pos)/sizeof(T);
+            size_t m = std::min<uint64_t>(remaining, avail ? avail : out.buf.size()/sizeof(T));
+            auto p = (T*)out.reserve(m*sizeof(T));
+            std::fill_n(p, m, val);
+            out.commit(m*sizeof(T));
+            remaining -= m;
+        }
+    };
+    if(E.width==8u) {
+        double val;
+        scale64_scalar(&s, 1u, E.slope, E.intercept, &val);
+        fill_with(val);
+    } else {
+        float val;
+        scale32_scalar(&s, 1u, float(E.slope), float(E.intercept), &val);
+        fill_with(val);
+    }
+}
+
+// repeat the last sample of each channel
+void priv::fill(uint64_t ntime)
+{
+    auto T0 = now_ns();
+    for(unsigned k=0; k<nchan; k++) {
+        auto& out = out_channel[chans[k]];
+        const auto s = last_channel[chans[k]];
+
+        for(uint64_t remaining = ntime; remaining; ) {
+            // fill out the current buffer, or all of the next
+            size_t avail = (out.buf.size() - out.pos)/sizeof(uint32_t);
+            size_t n = std::min<uint64_t>(remaining, avail ? avail : out.buf.size()/sizeof(uint32_t));
+            auto p = (uint32_t*)out.reserve(n*sizeof(uint32_t));
+            std::fill_n(p, n, s);
+            out.commit(n*sizeof(uint32_t));
+            remaining -= n;
+        }
+
+        if(egu[chans[k]].width)
+            fill_egu(chans[k], int32_t(s), ntime);
+    }
+    this->ntime += ntime;
+    stats.placeholders += ntime;
+    stats.write_ns += now_ns() - T0;
+}
+
+void priv::prepare_output()
+{
+    auto chmask = last_chmask; // in this context, the last received is the first
+    if(!chmask)
+        throw std::logic_error(SB()<<__func__<<" Missing chmask");
+
+//    rawfile(SB()<<outdir<<"/STATUS.j", true)
+//            .swap(out_status);
+
+    for(unsigned i=0; i<32; i++) {
+        if(!((1u<<i) & chmask))
+            continue;
+
+        auto& out = out_channel[i];
+
+        rawfile(chan_name(i), true)
+                .swap(out);
+        if(egu[i].width)
+            rawfile(egu_name(i), true)
+                    .swap(out_egu[i]);
+    }
+    rawfile(index_name(), true)
+            .swap(out_index);
+
+    for(unsigned k=0; overview && k<nchan; k++) {
+        for(unsigned l=0; l<ovr_levels; l++) {
+            rawfile(ovr_name(chans[k], l), true)
+                    .swap(ovr[chans[k]].levels[l].out);
+        }
+    }
+
+    start_writer();
+
+    for(unsigned k=0; overview && k<nchan; k++) {
+        for(unsigned l=0; l<ovr_levels; l++) {
+            OvrHead ohdr;
+            ohdr.factor = ovr_factor(l);
+            ovr[chans[k]].levels[l].out.write_from(ohdr);
+        }
+    }
+
+    PktIndexHead ihdr;
+    out_index.write_from(ihdr);
+
+    for(unsigned k=0; !compress && k<nchan; k++) {
+        // invalid placeholder.  Only samples through overview and checksum
+        uint32_t hdr[5] = {0xffffffff, 0xffffffff, 0xffffffff, 0, 0};
+        auto& out = out_channel[chans[k]];
+        pwrite_all(out.fd, (const char*)hdr, sizeof(hdr), 0u);
+        out.woff = sizeof(hdr);
+    }
+    for(unsigned k=0; compress && k<nchan; k++) {
+        // incomplete until table is written.  Samples through encoder
+        JzHead jhdr;
+        auto& out = out_channel[chans[k]];
+        pwrite_all(out.fd, (const char*)&jhdr, sizeof(jhdr), 0u);
+        out.woff = sizeof(jhdr);
+    }
+    attach_overview();
+}
+
+void priv::start_writer()
+{
+    // bounds the number of extra buffers
+    wb.reset(new writer(nspare));
+
+    auto bufsize = out_bufsize();
+    out_index.buffer(bufsize);
+    out_index.wb = wb.get();
+
+    // overviews are small.  Written without write-behind, which would exchange buffers of different sizes
+    for(unsigned k=0; overview && k<nchan; k++) {
+        for(auto& L : ovr[chans[k]].levels)
+            L.out.buffer(min_bufsize);
+    }
+
+    for(unsigned k=0; k<nchan; k++) {
+        auto& out = out_channel[chans[k]];
+        out.wb = wb.get();
+        out.checksum = true;
+
+        if(compress) {
+            // stage samples in a small buffer.  Blocks are encoded into a full size buffer
+            out.buffer(min_bufsize);
+            auto& Z = jz[chans[k]];
+            Z.zbuf.resize(bufsize);
+            out.jz = &Z;
+            continue;
+        }
+        out.buffer(bufsize);
+
+        /* Each input sample of 3 bytes becomes 4 bytes of output.
+         * Over-estimates slightly as packet headers are counted.
+         */
+        if(expect)
+            out.preallocate(out.tell() + expect/3u/nchan*4u);
+    }
+
+    for(unsigned k=0; k<nchan; k++) {
+        auto i = chans[k];
+        if(!egu[i].width)
+            continue;
+        auto& out = out_egu[i];
+        out.wb = wb.get();
+        out.checksum = true;
+        out.buffer(bufsize);
+        if(expect)
+            out.preallocate(out.tell() + expect/3u/nchan*egu[i].width);
+    }
+}
+
+void priv::release_buffers()
+{
+    auto release = [](rawfile& out) {
+        if(!out.is_open())
+            return;
+        out.sync();
+        buffer_t().swap(out.buf);
+        out.wb = nullptr;
+    };
+    for(unsigned k=0; k<nchan; k++) {
+        auto i = chans[k];
+        release(out_channel[i]);
+        release(out_egu[i]);
+        for(auto& L : ovr[i].levels)
+            release(L.out);
+    }
+    release(out_index);
+    wb.reset(); // and spares
+    std::vector<int32_t>().swap(samples);
+}
+
+void priv::finalize_output()
+{
+    // TODO: finish out_status
+    auto T0 = now_ns();
+
+    for(unsigned i=0; i<32; i++) {
+        if(!((1u<<i) & last_chmask))
+            continue;
+
+        auto& out = out_channel[i];
+        if(compress) {
+            out_crcs[i] = jz[i].finish(out);
+            out.trim();
+            out.close();
+
+        } else {
+            uint32_t hdr[5] = {1, 0, 0, 0, 0};
+
+            out.trim();
+            uint64_t fsize = out.tell() - sizeof(hdr);
+            memcpy(&hdr[3], &fsize, sizeof(fsize)); // yup, size stored unaligned...
+            out.pwrite_at(0, hdr, sizeof(hdr));
+            out_crcs[i] = crc32c_combine(crc32c(0u, hdr, sizeof(hdr)), out.crc, fsize);
+            out.close();
         }
 
-        // warn on leftovers?
+        if(overview) {
+            ovr[i].finish();
+            for(auto& L : ovr[i].levels)
+                L.out.close();
+        }
 
-        istrm.drain(msglen);
+        if(egu[i].width) {
+            out_egu[i].trim();
+            egu_crcs[i] = out_egu[i].crc;
+            out_egu[i].close();
+        }
+    }
+    out_index.close();
+
+    // eg. [{"Start": 1000, "Length": 14}, ...]
+    std::ofstream strm(gaps_name());
+    strm<<"[";
+    for(size_t n=0; n<gaps.size(); n++)
+        strm<<(n ? ", " : "")<<"{\"Start\": "<<gaps[n].first<<", \"Length\": "<<gaps[n].second<<"}";
+    strm<<"]\n";
+    strm.close();
+    if(strm.fail())
+        throw std::runtime_error(SB()<<"Unable to write '"<<gaps_name()<<"'");
+
+    // eg. {"Dat": [1234, ...], "CH00.j": 5678, ...}
+    std::ofstream cstrm(checksums_name());
+    cstrm<<"{\"Dat\": [";
+    for(size_t n=0; n<dat_crcs.size(); n++)
+        cstrm<<(n ? ", " : "")<<dat_crcs[n];
+    cstrm<<"]";
+    for(unsigned i=0; i<32; i++) {
+        if((1u<<i) & last_chmask)
+            cstrm<<", \"CH"<<std::setw(2)<<std::setfill('0')<<i<<(compress ? ".jz" : ".j")<<"\": "<<out_crcs[i];
+        if(((1u<<i) & last_chmask) && egu[i].width)
+            cstrm<<", \"CH"<<std::setw(2)<<std::setfill('0')<<i<<(egu[i].width==8u ? ".f64" : ".f32")<<"\": "<<egu_crcs[i];
     }
+    cstrm<<"}\n";
+    cstrm.close();
+    if(cstrm.fail())
+        throw std::runtime_error(SB()<<"Unable to write '"<<checksums_name()<<"'");
+    stats.write_ns += now_ns() - T0;
 }
 
-void convert2j(const std::vector<std::string>& indats,
-               const std::string& outdir,
-               std::vector<std::string>& errors,
-               bool force)
+void priv::read_samples(unsigned i, uint64_t s0, size_t n, std::vector<int32_t>& out)
 {
-    priv pvt{};
-    pvt.outdir = outdir;
-    pvt.force = force;
-
-    for(auto& indat : indats) {
-        convert1(pvt, indat);
+    if(compress) {
+        // only the incomplete final block remains un-encoded
+        auto& Z = jz[i];
+        if(s0 < Z.nsamp || s0+n > Z.samples())
+            throw std::logic_error(SB()<<__func__<<" beyond incomplete block of "<<chan_name(i));
+        auto first = Z.pending.begin() + (s0 - Z.nsamp);
+        out.assign(first, first + n);
+        return;
+    }
+    out.resize(n);
+    auto fd = out_channel[i].fd;
+    auto off = 5u*sizeof(uint32_t) + s0*sizeof(int32_t);
+    auto buf = (char*)out.data();
+    for(size_t len = n*sizeof(int32_t), j=0; j<len; ) {
+        auto ret = ::pread(fd, buf+j, len-j, off+j);
+        if(ret<=0) {
+            int err = ret<0 ? errno : EIO;
+            throw std::runtime_error(SB()<<"Unable to re-read "<<chan_name(i)<<" : "<<err<<" "<<strerror(err));
+        }
+        j += ret;
     }
-
-    pvt.finalize_output();
-    errors = std::move(pvt.errors);
 }
 
-void priv::prepare_output()
+void priv::prime_overview()
 {
-    auto chmask = last_chmask; // in this context, the last received is the first
-    if(!chmask)
-        throw std::logic_error(SB()<<__func__<<" Missing chmask");
+    // aligned to blocks of every level
+    auto s0 = ntime - ntime % ovr_factor(ovr_levels-1u);
+    std::vector<int32_t> tail;
+    for(unsigned k=0; k<nchan; k++) {
+        auto i = chans[k];
+        out_channel[i].sync();
+        read_samples(i, s0, ntime-s0, tail);
+
+        auto& P = ovr[i];
+        P.start_at(s0);
+        P.quiet = true;
+        P.feed(tail.data(), tail.size());
+        P.quiet = false;
+    }
+}
 
-//    rawfile(SB()<<outdir<<"/STATUS.j", true)
-//            .swap(out_status);
+/* Record progress after each input file is completed.
+ * Output files are flushed to the OS, so a checkpoint survives a crash
+ * or kill of this process.  (not loss of power)
+ *
+ * Text format, one item per line.
+ *
+ *   atf-convert-checkpoint 2
+ *   ndat <# of .dat complete>
+ *   dathash <hash of completed .dat names>
+ *   first <0|1>
+ *   window <tstart> <tend>
+ *   overview <0|1>
+ *   compress <0|1>
+ *   scale <channel#> <bytes per sample> <slope> <intercept>
+ *   chmask <mask>
+ *   seqno <last_seqno>
+ *   ns <last_ns>
+ *   nsamp <last_nsamp>
+ *   channel <last_channel[0]> ... <last_channel[31]>
+ *   size <channel#> <file size>
+ *   crc <channel#> <CRC32C of bytes written after the header>
+ *   egucrc <channel#> <CRC32C of scaled output>
+ *   index <file size>
+ *   stats <bytes> <packets> <samples> <gaps> <missing> <placeholders> <read_ns> <decode_ns> <write_ns>
+ *   gap <first sample> <number of samples>
+ *   error <message>
+ *   datcrc <CRC32C of one input file>
+ *
+ * A .jz file is checkpointed with its incomplete final block, which is re-encoded on resume.
+ */
+void priv::checkpoint(const std::string& indat)
+{
+    auto T0 = now_ns();
+    ndat++;
+    dathash = fnv1a(dathash, indat);
 
+    std::ostringstream strm;
+    strm<<"atf-convert-checkpoint 2\n"
+          "ndat "<<ndat<<"\n"
+          "dathash "<<dathash<<"\n"
+          "first "<<first<<"\n"
+          "window "<<tstart<<" "<<tend<<"\n"
+          "overview "<<overview<<"\n"
+          "compress "<<compress<<"\n";
     for(unsigned i=0; i<32; i++) {
-        if(!((1u<<i) & chmask))
-            continue;
-
-        auto& out = out_channel[i];
+        if(egu[i].width)
+            strm<<"scale "<<i<<" "<<egu[i].width<<" "<<std::setprecision(17)<<egu[i].slope<<" "<<egu[i].intercept<<"\n";
+    }
+    if(!first) {
+        strm<<"chmask "<<last_chmask<<"\n"
+              "seqno "<<last_seqno<<"\n"
+              "ns "<<last_ns<<"\n"
+              "nsamp "<<last_nsamp<<"\n"
+              "channel";
+        for(auto v : last_channel)
+            strm<<" "<<v;
+        strm<<"\n";
+
+        for(unsigned i=0; i<32; i++) {
+            if(!((1u<<i) & last_chmask))
+                continue;
+            auto& out = out_channel[i];
+            uint64_t size;
+            if(compress) {
+                size = jz[i].checkpoint(out);
+            } else {
+                out.sync();
+                size = out.tell();
+            }
+            strm<<"size "<<i<<" "<<size<<"\n"
+                  "crc "<<i<<" "<<out.crc<<"\n";
+            if(egu[i].width) {
+                out_egu[i].sync();
+                strm<<"egucrc "<<i<<" "<<out_egu[i].crc<<"\n";
+            }
+        }
+        out_index.sync();
+        strm<<"index "<<out_index.tell()<<"\n";
 
-        // eg. "CH01.j"
-        rawfile(SB()<<outdir<<"/CH"<<std::dec<<std::setw(2)<<std::setfill('0')<<i<<".j", true)
-                .swap(out);
+        for(unsigned k=0; overview && k<nchan; k++) {
+            for(auto& L : ovr[chans[k]].levels)
+                L.out.sync();
+        }
+    }
+    stats.write_ns += now_ns() - T0; // excludes writing this checkpoint
+    strm<<"stats "<<stats.bytes<<" "<<stats.packets<<" "<<stats.samples<<" "<<stats.gaps<<" "<<stats.missing
+        <<" "<<stats.placeholders<<" "<<stats.read_ns<<" "<<stats.decode_ns<<" "<<stats.write_ns<<"\n";
+    for(auto& gap : gaps)
+        strm<<"gap "<<gap.first<<" "<<gap.second<<"\n";
+    for(auto& err : errors)
+        strm<<"error "<<err<<"\n";
+    for(auto crc : dat_crcs)
+        strm<<"datcrc "<<crc<<"\n";
+
+    auto content(strm.str());
+    std::string fname(SB()<<outdir<<"/checkpoint");
+    std::string tname(fname+".tmp");
+
+    int fd = open(tname.c_str(), O_CREAT|O_TRUNC|O_WRONLY, 0644);
+    if(fd<0) {
+        auto err = errno;
+        throw std::runtime_error(SB()<<"Unable to write '"<<tname<<"' : "<<err<<" "<<strerror(err));
+    }
+    for(size_t i=0; i<content.size(); ) {
+        auto ret = ::write(fd, content.data()+i, content.size()-i);
+        if(ret<=0) {
+            auto err = errno;
+            ::close(fd);
+            throw std::runtime_error(SB()<<"Unable to write '"<<tname<<"' : "<<err<<" "<<strerror(err));
+        }
+        i += ret;
+    }
+    ::close(fd);
 
-        // invalid placeholder
-        uint32_t hdr[5] = {0xffffffff, 0xffffffff, 0xffffffff, 0, 0};
-        out.write(hdr, sizeof(hdr));
+    if(rename(tname.c_str(), fname.c_str())) {
+        auto err = errno;
+        throw std::runtime_error(SB()<<"Unable to write '"<<fname<<"' : "<<err<<" "<<strerror(err));
     }
 }
 
-void priv::finalize_output()
+/* Returns the number of leading entries of indats which have already been converted.
+ * Any output beyond the checkpoint is discarded.
+ * Without a valid checkpoint, any partial output is removed and 0 is returned.
+ */
+size_t priv::resume(const std::vector<std::string>& indats)
 {
-    // TODO: finish out_status
+    if(!first || ndat)
+        throw std::logic_error("resume() only allowed before conversion");
+
+    bool ok = false;
+    try {
+        ok = load_checkpoint(indats);
+    }catch(std::runtime_error&){
+        // fall through to discard.  Partial output may be open
+    }
+    if(!ok) {
+        priv fresh{};
+        fresh.outdir = outdir;
+        fresh.force = force;
+        fresh.usemap = usemap;
+        fresh.budget = budget;
+        fresh.tstart = tstart;
+        fresh.tend = tend;
+        fresh.overview = overview;
+        fresh.compress = compress;
+        fresh.dat_crc = dat_crc;
+        fresh.egu = egu;
+        fresh.discard_output();
+        std::swap(*this, fresh);
+    }
+    return ndat;
+}
 
-    for(unsigned i=0; i<32; i++) {
-        if(!((1u<<i) & last_chmask))
+bool priv::load_checkpoint(const std::vector<std::string>& indats)
+{
+    std::ifstream strm(SB()<<outdir<<"/checkpoint");
+    if(!strm.is_open())
+        return false;
+
+    std::string line, key;
+    if(!std::getline(strm, line) || line!="atf-convert-checkpoint 2")
+        return false;
+
+    std::array<size_t, 32> sizes{};
+    std::array<uint32_t, 32> crcs{}, egucrcs{};
+    std::array<scaling, 32> egu_prev;
+    size_t isize = 0;
+    uint64_t wstart = 0u, wend = UINT64_MAX;
+    bool ovr_prev = false, jz_prev = false;
+    while(std::getline(strm, line)) {
+        std::istringstream lstrm(line);
+        lstrm>>key;
+        if(key=="ndat") {
+            lstrm>>ndat;
+        } else if(key=="dathash") {
+            lstrm>>dathash;
+        } else if(key=="first") {
+            lstrm>>first;
+        } else if(key=="overview") {
+            lstrm>>ovr_prev;
+        } else if(key=="compress") {
+            lstrm>>jz_prev;
+        } else if(key=="window") {
+            lstrm>>wstart>>wend;
+        } else if(key=="chmask") {
+            uint32_t chmask;
+            lstrm>>chmask;
+            set_chmask(chmask);
+        } else if(key=="seqno") {
+            lstrm>>last_seqno;
+        } else if(key=="ns") {
+            lstrm>>last_ns;
+        } else if(key=="nsamp") {
+            lstrm>>last_nsamp;
+        } else if(key=="channel") {
+            for(auto& v : last_channel)
+                lstrm>>v;
+        } else if(key=="size") {
+            unsigned i;
+            lstrm>>i;
+            if(i>=32)
+                return false;
+            lstrm>>sizes[i];
+        } else if(key=="crc") {
+            unsigned i;
+            lstrm>>i;
+            if(i>=32)
+                return false;
+            lstrm>>crcs[i];
+        } else if(key=="scale") {
+            unsigned i;
+            lstrm>>i;
+            if(i>=32)
+                return false;
+            lstrm>>egu_prev[i].width>>egu_prev[i].slope>>egu_prev[i].intercept;
+        } else if(key=="egucrc") {
+            unsigned i;
+            lstrm>>i;
+            if(i>=32)
+                return false;
+            lstrm>>egucrcs[i];
+        } else if(key=="datcrc") {
+            uint32_t crc;
+            lstrm>>crc;
+            dat_crcs.push_back(crc);
+        } else if(key=="index") {
+            lstrm>>isize;
+        } else if(key=="stats") {
+            lstrm>>stats.bytes>>stats.packets>>stats.samples>>stats.gaps>>stats.missing
+                 >>stats.placeholders>>stats.read_ns>>stats.decode_ns>>stats.write_ns;
+        } else if(key=="gap") {
+            std::pair<uint64_t, uint64_t> gap;
+            lstrm>>gap.first>>gap.second;
+            gaps.push_back(gap);
+        } else if(key=="error") {
+            lstrm.get(); // skip ' '
+            std::getline(lstrm, line);
+            errors.push_back(line);
             continue;
+        } else {
+            return false;
+        }
+        if(lstrm.fail())
+            return false;
+    }
 
-        uint32_t hdr[5] = {1, 0, 0, 0, 0};
+    // must be for the same time window
+    if(wstart!=tstart || wend!=tend || ovr_prev!=overview || jz_prev!=compress || egu_prev!=egu)
+        return false;
+
+    // must be a prefix of the current list of inputs
+    if(ndat > indats.size() || (dat_crc && dat_crcs.size()!=ndat))
+        return false;
+    uint64_t hash = fnv1a_init;
+    for(size_t n=0; n<ndat; n++)
+        hash = fnv1a(hash, indats[n]);
+    if(hash!=dathash)
+        return false;
+
+    if(!first) {
+        for(unsigned i=0; i<32; i++) {
+            if(!((1u<<i) & last_chmask))
+                continue;
+            rawfile(chan_name(i), sizes[i])
+                    .swap(out_channel[i]);
+            out_channel[i].crc = crcs[i];
+            if(compress)
+                jz[i].load(out_channel[i]);
+        }
+        rawfile(index_name(), isize)
+                .swap(out_index);
+        if(compress) {
+            ntime = jz[chans[0]].samples();
+        } else {
+            ntime = (sizes[chans[0]] - 5u*sizeof(uint32_t))/sizeof(uint32_t);
+        }
+        for(unsigned k=0; overview && k<nchan; k++) {
+            for(unsigned l=0; l<ovr_levels; l++) {
+                // only complete blocks
+                rawfile(ovr_name(chans[k], l), sizeof(OvrHead) + ntime/ovr_factor(l)*2u*sizeof(int32_t))
+                        .swap(ovr[chans[k]].levels[l].out);
+            }
+        }
+        for(unsigned k=0; k<nchan; k++) {
+            auto i = chans[k];
+            if(!egu[i].width)
+                continue;
+            rawfile(egu_name(i), ntime*egu[i].width)
+                    .swap(out_egu[i]);
+            out_egu[i].crc = egucrcs[i];
+        }
+        start_writer();
+        if(overview)
+            prime_overview();
+        attach_overview();
+    }
+    return true;
+}
 
-        auto& out = out_channel[i];
-        out.flush();
-        auto fsize = out.tell() - sizeof(hdr);
-        out.seek(0);
-        memcpy(&hdr[3], &fsize, sizeof(fsize)); // yup, size stored unaligned...
-        out.write(hdr, sizeof(hdr));
-        out.close();
+void priv::discard_output()
+{
+    for(unsigned i=0; i<32; i++) {
+        out_channel[i].close();
+        (void)unlink(chan_name(i, false).c_str());
+        (void)unlink(chan_name(i, true).c_str());
+        out_egu[i].close();
+        (void)unlink(egu_name(i, 4u).c_str());
+        (void)unlink(egu_name(i, 8u).c_str());
+    }
+    out_index.close();
+    (void)unlink(index_name().c_str());
+    (void)unlink(gaps_name().c_str());
+    (void)unlink(checksums_name().c_str());
+    for(unsigned i=0; i<32; i++) {
+        for(unsigned l=0; l<ovr_levels; l++) {
+            ovr[i].levels[l].out.close();
+            (void)unlink(ovr_name(i, l).c_str());
+        }
     }
+    (void)unlink((SB()<<outdir<<"/checkpoint").str().c_str());
 }
 
 struct PyRef {
@@ -579,42 +3166,378 @@ struct PyRef {
     explicit operator bool() const { return obj; }
 };
 
+/* parse {channel: (slope, intercept[, float64])} of channels to also write scaled.
+ * channel is zero indexed.
+ */
+bool egu_dict(PyObject *dict_py, std::array<priv::scaling, 32>& out)
+{
+    if(!dict_py || dict_py==Py_None)
+        return true;
+    if(!PyDict_Check(dict_py)) {
+        PyErr_SetString(PyExc_TypeError, "egu must be a dict");
+        return false;
+    }
+    Py_ssize_t pos = 0;
+    PyObject *key, *val;
+    while(PyDict_Next(dict_py, &pos, &key, &val)) {
+        auto i = PyLong_AsUnsignedLong(key);
+        if(PyErr_Occurred())
+            return false;
+        if(i>=32u) {
+            PyErr_Format(PyExc_ValueError, "egu channel %lu out of range", i);
+            return false;
+        }
+        auto& E = out[i];
+        int wide = false;
+        if(!PyArg_ParseTuple(val, "dd|p", &E.slope, &E.intercept, &wide))
+            return false;
+        E.width = wide ? sizeof(double) : sizeof(float);
+    }
+    return true;
+}
+
+// parse list of filenames
+bool fslist(PyObject *list_py, std::vector<std::string>& out)
+{
+    for(size_t i=0, N=PyList_Size(list_py); i<N; i++) {
+        auto item = PyList_GetItem(list_py, i);
+        if(!item)
+            return false;
+        PyRef item_py;
+        if(!PyUnicode_FSConverter(item, (PyObject**)item_py.acquire()))
+            return false;
+        out.push_back(PyBytes_AsString(item_py.obj));
+    }
+    return true;
+}
+
+PyObject* stats_dict(const convstats& stats)
+{
+    return Py_BuildValue("{sKsKsKsKsKsKsdsdsd}",
+                         "bytes", (unsigned long long)stats.bytes,
+                         "packets", (unsigned long long)stats.packets,
+                         "samples", (unsigned long long)stats.samples,
+                         "gaps", (unsigned long long)stats.gaps,
+                         "missing_packets", (unsigned long long)stats.missing,
+                         "placeholders", (unsigned long long)stats.placeholders,
+                         "read_time", stats.read_ns*1e-9,
+                         "decode_time", stats.decode_ns*1e-9,
+                         "write_time", stats.write_ns*1e-9);
+}
+
 PyObject* call_convert2j(PyObject *unused, PyObject *args, PyObject *kws) noexcept
 {
-    static const char* kwnames[] = {"indats", "outdir", "force", nullptr};
+    static const char* kwnames[] = {"indats", "outdir", "force", "resume", "mmap", "memory_budget", "threads",
+                                    "start", "end", "overview", "compress", "stats", "egu", nullptr};
     try{
         (void)unused;
 
         PyObject *indats_py = nullptr;
         PyRef outdir_py;
         int force = false;
-
-        if(!PyArg_ParseTupleAndKeywords(args, kws, "O!O&|p", const_cast<char**>(kwnames),
+        int resume = false;
+        int usemap = true;
+        unsigned long long budget = 0u;
+        unsigned threads = 1u;
+        unsigned long long tstart = 0u, tend = UINT64_MAX;
+        int overview = false;
+        int compress = false;
+        int want_stats = false;
+        PyObject *egu_py = nullptr;
+
+        if(!PyArg_ParseTupleAndKeywords(args, kws, "O!O&|pppKIKKpppO", const_cast<char**>(kwnames),
                              &PyList_Type, &indats_py,
                              PyUnicode_FSConverter, (PyObject**)outdir_py.acquire(),
-                             &force))
+                             &force, &resume, &usemap, &budget, &threads, &tstart, &tend, &overview, &compress,
+                             &want_stats, &egu_py))
             return NULL;
 
         std::vector<std::string> indats;
-        for(size_t i=0, N=PyList_Size(indats_py); i<N; i++) {
-            auto item = PyList_GetItem(indats_py, i);
-            if(!item)
+        if(!fslist(indats_py, indats))
+            return nullptr;
+        std::array<priv::scaling, 32> egu;
+        if(!egu_dict(egu_py, egu))
+            return nullptr;
+
+        std::vector<std::string> errors;
+        convstats stats;
+
+        Py_BEGIN_ALLOW_THREADS;
+        try{
+            convert2j(indats, PyBytes_AsString(outdir_py.obj), errors, stats, force, resume, usemap, budget, threads, tstart, tend, overview, compress, egu);
+        }catch(...){
+            Py_BLOCK_THREADS;
+            throw;
+        }
+        Py_END_ALLOW_THREADS;
+
+        PyRef errors_py(PyList_New(errors.size()));
+        for(size_t i=0; i<errors.size(); i++) {
+            auto& err = errors[i];
+            PyRef item(PyUnicode_FromString(err.c_str()));
+            if(PyList_SetItem(errors_py.obj, i, item.release()))
                 return nullptr;
-            PyRef indat_py(PyUnicode_EncodeFSDefault(item));
-            indats.push_back(PyBytes_AsString(indat_py.obj));
         }
 
-        std::vector<std::string> errors;
+        if(want_stats) {
+            PyRef stats_py(stats_dict(stats));
+            return Py_BuildValue("(OO)", errors_py.obj, stats_py.obj);
+        }
+        return errors_py.release();
+
+    }catch(std::exception& e){
+        if(PyErr_Occurred())
+            return nullptr; // exception already raised
+
+        return PyErr_Format(PyExc_RuntimeError, "Unhandled error: %s", e.what());
+    }
+}
+
+PyObject* call_isa(PyObject *unused, PyObject *args, PyObject *kws) noexcept
+{
+    static const char* kwnames[] = {"name", nullptr};
+    (void)unused;
+
+    const char *name = nullptr;
+
+    if(!PyArg_ParseTupleAndKeywords(args, kws, "|z", const_cast<char**>(kwnames),
+                         &name))
+        return NULL;
+
+    auto prev = kernel_current.load();
+
+    if(name) {
+        const kernel* sel = nullptr;
+        for(auto& K : kernels) {
+            if(strcmp(K.name, name)==0 && kernel_supported(K))
+                sel = &K;
+        }
+        if(!sel)
+            return PyErr_Format(PyExc_ValueError, "Unknown or unsupported ISA '%s'", name);
+        kernel_current = sel;
+    }
+
+    return PyUnicode_FromString(prev->name);
+}
+
+PyObject* call_crc32c(PyObject *unused, PyObject *args, PyObject *kws) noexcept
+{
+    static const char* kwnames[] = {"fname", nullptr};
+    try{
+        (void)unused;
+        PyRef fname_py;
+
+        if(!PyArg_ParseTupleAndKeywords(args, kws, "O&", const_cast<char**>(kwnames),
+                             PyUnicode_FSConverter, (PyObject**)fname_py.acquire()))
+            return NULL;
+
+        std::string fname(PyBytes_AsString(fname_py.obj));
+        uint32_t crc = 0u;
 
         Py_BEGIN_ALLOW_THREADS;
         try{
-            convert2j(indats, PyBytes_AsString(outdir_py.obj), errors, force);
+            crc = crc32c_file(fname);
         }catch(...){
             Py_BLOCK_THREADS;
             throw;
         }
         Py_END_ALLOW_THREADS;
 
+        return PyLong_FromUnsignedLong(crc);
+
+    }catch(std::exception& e){
+        if(PyErr_Occurred())
+            return nullptr; // exception already raised
+
+        return PyErr_Format(PyExc_RuntimeError, "Unhandled error: %s", e.what());
+    }
+}
+
+PyObject* call_buffer_usage(PyObject *unused, PyObject *args, PyObject *kws) noexcept
+{
+    static const char* kwnames[] = {"reset", nullptr};
+    (void)unused;
+
+    int reset = 0;
+
+    if(!PyArg_ParseTupleAndKeywords(args, kws, "|p", const_cast<char**>(kwnames),
+                         &reset))
+        return NULL;
+
+    auto cur = buffer_bytes.load();
+    auto peak = buffer_peak.load();
+    if(reset)
+        buffer_peak = cur;
+
+    return Py_BuildValue("KK", (unsigned long long)cur, (unsigned long long)peak);
+}
+
+/* Incremental conversion.  Holds a priv between calls to add()
+ * so that .dat files may be converted as they are closed.
+ */
+struct ConverterPy {
+    PyObject_HEAD
+    priv *pvt;
+    // set while the GIL is released.  Guards against concurrent use.
+    bool busy;
+    // after finish(), or any failure, no further add()
+    bool done;
+};
+
+PyObject* Converter_new(PyTypeObject *type, PyObject *args, PyObject *kws) noexcept
+{
+    static const char* kwnames[] = {"outdir", "force", "mmap", "memory_budget", "overview", "compress", "egu", nullptr};
+    try{
+        PyRef outdir_py;
+        int force = false;
+        int usemap = true;
+        unsigned long long budget = 0u;
+        int overview = false;
+        int compress = false;
+        PyObject *egu_py = nullptr;
+
+        if(!PyArg_ParseTupleAndKeywords(args, kws, "O&|ppKppO", const_cast<char**>(kwnames),
+                             PyUnicode_FSConverter, (PyObject**)outdir_py.acquire(),
+                             &force, &usemap, &budget, &overview, &compress, &egu_py))
+            return NULL;
+
+        std::unique_ptr<priv> pvt(new priv{});
+        pvt->outdir = PyBytes_AsString(outdir_py.obj);
+        pvt->force = force;
+        pvt->usemap = usemap;
+        pvt->budget = budget;
+        pvt->overview = overview;
+        pvt->compress = compress;
+        if(!egu_dict(egu_py, pvt->egu))
+            return nullptr;
+
+        auto alloc = (allocfunc)PyType_GetSlot(type, Py_tp_alloc);
+        PyRef self(alloc(type, 0));
+        auto conv = (ConverterPy*)self.obj;
+        conv->pvt = pvt.release();
+        conv->busy = conv->done = false;
+
+        return self.release();
+
+    }catch(std::exception& e){
+        if(PyErr_Occurred())
+            return nullptr; // exception already raised
+
+        return PyErr_Format(PyExc_RuntimeError, "Unhandled error: %s", e.what());
+    }
+}
+
+void Converter_dealloc(PyObject *self) noexcept
+{
+    auto conv = (ConverterPy*)self;
+    auto type = Py_TYPE(self);
+    // closes any open output files
+    delete conv->pvt;
+    auto tfree = (freefunc)PyType_GetSlot(type, Py_tp_free);
+    tfree(self);
+    Py_DECREF(type);
+}
+
+// Run 'fn' on the priv of 'self' with the GIL released
+template<typename Fn>
+bool Converter_call(PyObject *self, Fn&& fn)
+{
+    auto conv = (ConverterPy*)self;
+    if(conv->busy) {
+        PyErr_SetString(PyExc_RuntimeError, "Converter in use by another thread");
+        return false;
+    } else if(conv->done) {
+        PyErr_SetString(PyExc_RuntimeError, "Converter already finished, or failed");
+        return false;
+    }
+    conv->busy = true;
+
+    Py_BEGIN_ALLOW_THREADS;
+    try{
+        fn(*conv->pvt);
+    }catch(...){
+        Py_BLOCK_THREADS;
+        conv->busy = false;
+        conv->done = true; // state unknown after partial conversion
+        throw;
+    }
+    Py_END_ALLOW_THREADS;
+
+    conv->busy = false;
+    return true;
+}
+
+PyObject* Converter_add(PyObject *self, PyObject *args, PyObject *kws) noexcept
+{
+    static const char* kwnames[] = {"indat", nullptr};
+    try{
+        PyRef indat_py;
+
+        if(!PyArg_ParseTupleAndKeywords(args, kws, "O&", const_cast<char**>(kwnames),
+                             PyUnicode_FSConverter, (PyObject**)indat_py.acquire()))
+            return NULL;
+
+        std::string indat(PyBytes_AsString(indat_py.obj));
+
+        if(!Converter_call(self, [&indat](priv& pvt) {
+                convert1(pvt, indat);
+                pvt.checkpoint(indat);
+            }))
+            return nullptr;
+
+        Py_RETURN_NONE;
+
+    }catch(std::exception& e){
+        if(PyErr_Occurred())
+            return nullptr; // exception already raised
+
+        return PyErr_Format(PyExc_RuntimeError, "Unhandled error: %s", e.what());
+    }
+}
+
+PyObject* Converter_resume(PyObject *self, PyObject *args, PyObject *kws) noexcept
+{
+    static const char* kwnames[] = {"indats", nullptr};
+    try{
+        PyObject *indats_py = nullptr;
+
+        if(!PyArg_ParseTupleAndKeywords(args, kws, "O!", const_cast<char**>(kwnames),
+                             &PyList_Type, &indats_py))
+            return NULL;
+
+        std::vector<std::string> indats;
+        if(!fslist(indats_py, indats))
+            return nullptr;
+
+        size_t skip = 0;
+        if(!Converter_call(self, [&indats, &skip](priv& pvt) {
+                skip = pvt.resume(indats);
+            }))
+            return nullptr;
+
+        return PyLong_FromSize_t(skip);
+
+    }catch(std::exception& e){
+        if(PyErr_Occurred())
+            return nullptr; // exception already raised
+
+        return PyErr_Format(PyExc_RuntimeError, "Unhandled error: %s", e.what());
+    }
+}
+
+PyObject* Converter_finish(PyObject *self, PyObject *unused) noexcept
+{
+    try{
+        (void)unused;
+
+        if(!Converter_call(self, [](priv& pvt) {
+                pvt.finalize_output();
+            }))
+            return nullptr;
+
+        auto& errors = ((ConverterPy*)self)->pvt->errors;
+        ((ConverterPy*)self)->done = true;
+
         PyRef errors_py(PyList_New(errors.size()));
         for(size_t i=0; i<errors.size(); i++) {
             auto& err = errors[i];
@@ -633,16 +3556,103 @@ PyObject* call_convert2j(PyObject *unused, PyObject *args, PyObject *kws) noexce
     }
 }
 
+PyObject* Converter_stats(PyObject *self, PyObject *unused) noexcept
+{
+    try{
+        (void)unused;
+        auto conv = (ConverterPy*)self;
+        if(conv->busy) {
+            PyErr_SetString(PyExc_RuntimeError, "Converter in use by another thread");
+            return nullptr;
+        }
+        return stats_dict(conv->pvt->stats);
+
+    }catch(std::exception& e){
+        if(PyErr_Occurred())
+            return nullptr; // exception already raised
+
+        return PyErr_Format(PyExc_RuntimeError, "Unhandled error: %s", e.what());
+    }
+}
+
+PyMethodDef Converter_methods[] = {
+    {"add", (PyCFunction)Converter_add, METH_VARARGS|METH_KEYWORDS,
+     "add(indat)\n\nConvert one more .dat file, continuing from the previous."},
+    {"resume", (PyCFunction)Converter_resume, METH_VARARGS|METH_KEYWORDS,
+     "resume(indats) -> int\n\n"
+     "Continue from a checkpoint left in outdir by a previous, interrupted, conversion.\n"
+     "Returns the number of leading entries of indats already converted."},
+    {"finish", (PyCFunction)Converter_finish, METH_NOARGS,
+     "finish() -> [str]\n\nFinalize .j files.  Returns list of non-fatal errors."},
+    {"stats", (PyCFunction)Converter_stats, METH_NOARGS,
+     "stats() -> dict\n\nCounters of the conversion so far.  See convert2j()."},
+    {NULL}
+};
+
+PyType_Slot Converter_slots[] = {
+    {Py_tp_new, (void*)Converter_new},
+    {Py_tp_dealloc, (void*)Converter_dealloc},
+    {Py_tp_methods, (void*)Converter_methods},
+    {Py_tp_doc, (void*)"Converter(outdir, force=False, mmap=True, memory_budget=0, overview=False, compress=False, egu=None)\n\n"
+                       "Incrementally convert a sequence of .dat files into outdir"},
+    {0, nullptr},
+};
+
+PyType_Spec Converter_spec = {
+    .name = "atf_engine._convert.Converter",
+    .basicsize = sizeof(ConverterPy),
+    .itemsize = 0,
+    .flags = Py_TPFLAGS_DEFAULT,
+    .slots = Converter_slots,
+};
+
+int engine_convert_exec(PyObject *mod) noexcept
+{
+    auto type = PyType_FromSpec(&Converter_spec);
+    if(!type)
+        return -1;
+    int ret = PyModule_AddObjectRef(mod, "Converter", type);
+    Py_DECREF(type);
+    return ret;
+}
+
 PyMethodDef methods[] = {
-    {"convert2j", (PyCFunction)call_convert2j, METH_VARARGS|METH_KEYWORDS, ""},
+    {"convert2j", (PyCFunction)call_convert2j, METH_VARARGS|METH_KEYWORDS,
+     "convert2j(indats, outdir, force=False, resume=False, mmap=True, memory_budget=0, threads=1,\n"
+     "          start=0, end=2**64-1, overview=False, compress=False, stats=False, egu=None) -> [str]\n\n"
+     "Convert .dat files of one chassis into .j files in outdir.  Returns list of non-fatal errors.\n"
+     "With stats=True, returns (errors, stats) where stats is a dict of counters: bytes, packets, samples,\n"
+     "gaps, missing_packets, placeholders (samples per channel), read_time, decode_time, write_time (seconds).\n"
+     "Also writes checksums.json to outdir with the CRC32C of each input (unless start or end is given),\n"
+     "and of each output file.\n"
+     "egu is a dict {channel: (slope, intercept[, float64])} with zero indexed channel numbers.\n"
+     "Samples of these channels are also written scaled (sample*slope + intercept) as raw arrays\n"
+     "of float32 (CH<N>.f32), or float64 (CH<N>.f64)."},
+    {"isa", (PyCFunction)call_isa, METH_VARARGS|METH_KEYWORDS,
+     "isa(name=None) -> str\n\n"
+     "Returns the name of the sample decoding kernel in use.\n"
+     "If name is given, select 'scalar', 'ssse3', or 'avx2' for subsequent conversions."},
+    {"crc32c", (PyCFunction)call_crc32c, METH_VARARGS|METH_KEYWORDS,
+     "crc32c(fname) -> int\n\n"
+     "CRC32C of the whole file.  As recorded in checksums.json by conversion."},
+    {"buffer_usage", (PyCFunction)call_buffer_usage, METH_VARARGS|METH_KEYWORDS,
+     "buffer_usage(reset=False) -> (int, int)\n\n"
+     "Bytes of buffers currently allocated by all conversions in this process,\n"
+     "and the most allocated at once since the last reset.  As bounded by memory_budget."},
     {NULL}
 };
 
+PyModuleDef_Slot engine_convert_slots[] = {
+    {Py_mod_exec, (void*)engine_convert_exec},
+    {0, nullptr},
+};
+
 struct PyModuleDef engine_convert = {
     .m_base = PyModuleDef_HEAD_INIT,
     .m_name = "atf_engine._convert",
     .m_size = 0,
     .m_methods = methods,
+    .m_slots = engine_convert_slots,
 };
 
 } // namespace
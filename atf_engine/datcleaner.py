@@ -1,111 +1,376 @@
-
 import asyncio
+import ctypes
+import ctypes.util
 import logging
-from fnmatch import fnmatch
+import os
+import re
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatchcase
 from pathlib import Path
 
-from inotify.constants import IN_ALL_EVENTS, IN_MODIFY, IN_CLOSE_WRITE
-from inotify.adapters import Inotify, _DEFAULT_TERMINAL_EVENTS, TerminalEventException
-
 _log = logging.getLogger(__name__)
 
-class AInotify(Inotify):
-    '''PyInotify circa 0.2.10 does not include asyncio support.
+# from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_CREATE      = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF   = 0x00000800
+IN_UNMOUNT     = 0x00002000
+IN_Q_OVERFLOW  = 0x00004000
+IN_IGNORED     = 0x00008000
+
+_libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+_libc.inotify_init1.argtypes = [ctypes.c_int]
+_libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+
+class Inotify:
+    '''Minimal asyncio interface to Linux inotify
+
+    >>> with Inotify() as I:
+    ...     I.add_watch('/some/dir', IN_CREATE|IN_CLOSE_WRITE)
+    ...     async for batch in I.events():
+    ...         for wd, mask, cookie, name in batch:
+    ...             ...
     '''
-    def __init__(self, *args, **kws):
-        super().__init__(*args, **kws)
+    _event = struct.Struct('iIII')
 
-    async def aevent_gen(self, terminal_events=_DEFAULT_TERMINAL_EVENTS):
-        loop = asyncio.get_running_loop()
-        try:
-            while True:
-                ready = loop.create_future()
-                # replaces previous reader for this FD
-                loop.add_reader(self._Inotify__inotify_fd, ready.set_result, None)
+    def __init__(self):
+        self.fd = _libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            E = ctypes.get_errno()
+            raise OSError(E, os.strerror(E))
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
 
-                await ready
+    def __enter__(self):
+        return self
 
-                # _handle_inotify_event() must call read(fd) exactly once,
-                # so we can get away with not setting FD to non-blocking
-                for (header, type_names, path, filename) in self._handle_inotify_event(self._Inotify__inotify_fd):
-                    e = (header, type_names, path, filename)
-                    for type_name in type_names:
-                        if type_name in terminal_events:
-                            raise TerminalEventException(type_name, e)
+    def __exit__(self, A, B, C):
+        self.close()
 
-                    yield e
+    def add_watch(self, path:Path, mask:int) -> int:
+        wd = _libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            E = ctypes.get_errno()
+            raise OSError(E, os.strerror(E), str(path))
+        return wd
 
+    def read(self, bufsize:int=64*1024) -> [(int, int, int, str)]:
+        '''All events currently queued, without blocking
+
+        Returns list of (wd, mask, cookie, name)
+        '''
+        evts = []
+        while True:
+            try:
+                buf = os.read(self.fd, bufsize) # kernel only returns whole events
+            except BlockingIOError:
+                return evts
+            off = 0
+            while off < len(buf):
+                wd, mask, cookie, namelen = self._event.unpack_from(buf, off)
+                off += self._event.size
+                name = os.fsdecode(buf[off:off+namelen].rstrip(b'\0'))
+                off += namelen
+                evts.append((wd, mask, cookie, name))
+
+    async def events(self):
+        '''Yield batches of events as they arrive
+        '''
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        loop.add_reader(self.fd, ready.set)
+        try:
+            while True:
+                await ready.wait()
+                ready.clear()
+                evts = self.read()
+                if evts:
+                    yield evts
         finally:
-            loop.remove_reader(self._Inotify__inotify_fd)
+            loop.remove_reader(self.fd)
 
 class DatCleaner:
     '''Watch for FS operations in a directory on files matching given patterns
-       Remove all but the most recent N files.
+       Remove the oldest files beyond the retention limits.
 
     >>> patterns = ['some*.dat', 'other*.dat']
     >>> D = DatCleaner('/tmp', patterns)
     >>> with D:
            ... accumulate files, and close all!
+           await D.drained(10.0) # wait for last files to be closed
     >>> for pat, dats in D.tracked(): # perserves order of patterns
         print(pat, dats)
+
+    Retention limits, each zero for no limit.  At least the most recent
+    file of each pattern is always kept.
+
+    - getCount() number of files of each pattern
+    - max_bytes total size of files of each pattern
+    - max_total total size of files of all patterns
+    - max_age seconds between the closing of the oldest and newest file of each pattern
+    - min_free bytes of free space in the filesystem.
+      If exceeded, max_total is reduced to free space.
     '''
 
-    def __init__(self, base:Path, patterns:[str]):
+    def __init__(self, base:Path, patterns:[str], max_bytes:int=0, max_total:int=0,
+                 max_age:float=0, min_free:int=0, period:float=1.0):
         self._base = Path(base)
         self._patterns = [(pat, []) for pat in patterns]
+        self.max_bytes, self.max_total, self.max_age, self.min_free = max_bytes, max_total, max_age, min_free
+        self._period = period # free space check interval
+        self._size = {} # file name -> (bytes, mtime) of tracked files
+        self._bytes = [0]*len(patterns) # total of tracked files
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='DatCleaner') # in order
+        self._deleting = set() # Futures
+        self._unlinking = set() # names of files no longer tracked, and not yet deleted
+        self._watchdogT = None
+        # index by literal prefix.  eg. 'some' for 'some*.dat'
+        self._prefix = {}
+        for idx, pat in enumerate(patterns):
+            self._prefix.setdefault(re.split(r'[*?[]', pat, maxsplit=1)[0], []).append(idx)
+        self._prefix_len = sorted({len(pre) for pre in self._prefix}, reverse=True)
+        self._open = [set() for pat in patterns] # created, not yet closed
+        self._closed = asyncio.Event()
         self._T = None
 
     def getCount(self) -> int:
         raise NotImplementedError()
 
+    def onClose(self, idx:int, fname:str):
+        '''Called when a file matching patterns[idx] has been closed after writing
+        '''
+        pass
+
+    def keeps_all(self) -> bool:
+        'True if no files will be removed, except when running out of free space'
+        return self.getCount()==0 and not (self.max_bytes or self.max_total or self.max_age)
+
     async def __aenter__(self):
         assert self._T is None, self._T
-        self._T = asyncio.create_task(self._handle())
+        # watch before returning, so no files are missed
+        _log.debug('Tracking in %r', self._base)
+        self._I = I = Inotify()
+        try:
+            I.add_watch(self._base, IN_CREATE|IN_CLOSE_WRITE|IN_DELETE_SELF|IN_MOVE_SELF)
+        except:
+            I.close()
+            raise
+        self._T = asyncio.create_task(self._handle(I))
+        if self.min_free:
+            self._watchdogT = asyncio.create_task(self._watchdog())
 
     async def __aexit__(self,A,B,C):
-        self._T.cancel()
+        for T in (self._T, self._watchdogT):
+            if T is None:
+                continue
+            T.cancel()
+            try:
+                await T
+            except asyncio.CancelledError:
+                pass
+        self._T = self._watchdogT = None
+        self._I.close()
+        await asyncio.gather(*self._deleting)
+
+    def _match(self, name:str) -> int:
+        'Index of pattern matching file name, or None'
+        for L in self._prefix_len:
+            for idx in self._prefix.get(name[:L], ()):
+                if fnmatchcase(name, self._patterns[idx][0]):
+                    return idx # treat patterns as non-overlapping
+        return None
+
+    def _scan(self) -> [[os.DirEntry]]:
+        'List files matching each pattern'
+        full = [[] for pat in self._patterns]
+        with os.scandir(self._base) as it:
+            for E in it:
+                idx = self._match(E.name)
+                if idx is not None:
+                    full[idx].append(E)
+        return full
+
+    async def _handle(self, I:Inotify):
+        async for evts in I.events():
+            for wd, mask, cookie, file in evts:
+                if mask & IN_Q_OVERFLOW:
+                    _log.warning('inotify queue overflow in %r.  Rescan', self._base)
+                    self._rescan()
+
+                elif mask & (IN_DELETE_SELF|IN_MOVE_SELF|IN_UNMOUNT|IN_IGNORED):
+                    raise RuntimeError(f'Lost watch of {self._base} : {mask:#x}')
+
+                elif (idx := self._match(file)) is None:
+                    pass
+
+                elif mask & IN_CREATE:
+                    self._open[idx].add(file)
+
+                elif mask & IN_CLOSE_WRITE:
+                    self._open[idx].discard(file)
+                    # eg. already closed by _rescan(), or since removed
+                    if file not in self._patterns[idx][1] and file not in self._unlinking:
+                        self._close(idx, file)
+
+        _log.debug('End Tracking in %r', self._base)
+
+    def _close(self, idx:int, file:str):
+        pat, trk = self._patterns[idx]
+        _log.debug('Close event %r, %r : %r', pat, file, trk)
         try:
-            await self._T
-        except asyncio.CancelledError:
-            pass
-        finally:
-            self._T = None
+            S = os.stat(self._base / file)
+            self._size[file] = (S.st_size, S.st_mtime)
+        except FileNotFoundError:
+            self._size[file] = (0, 0.0)
+        self._bytes[idx] += self._size[file][0]
+        self._closed.set()
+        trk.append(file)
+        self.onClose(idx, file)
+        self._retain()
 
-    async def _handle(self):
-        _log.debug('Tracking in %r', self._base)
-        I = AInotify()
-        I.add_watch(str(self._base), IN_ALL_EVENTS&~IN_MODIFY) # exclude chatty modify event
+    def _retain(self):
+        'Apply retention limits'
+        C = self.getCount()
+        victims = []
+        def drop(idx):
+            rm = self._patterns[idx][1].pop(0)
+            self._bytes[idx] -= self._size.pop(rm)[0]
+            victims.append(rm)
 
-        async for evt, evtnames, path, file in I.aevent_gen():
-            if not (evt.mask & IN_CLOSE_WRITE):
+        for idx, (pat, trk) in enumerate(self._patterns):
+            if C>0:
+                while len(trk)>C:
+                    drop(idx)
+            if self.max_bytes:
+                while len(trk)>1 and self._bytes[idx]>self.max_bytes:
+                    drop(idx)
+            if self.max_age:
+                while len(trk)>1 and self._size[trk[0]][1] <= self._size[trk[-1]][1] - self.max_age:
+                    drop(idx)
+
+        if self.max_total:
+            while sum(self._bytes)>self.max_total:
+                # oldest file of any pattern, excluding the newest of each
+                oldest = [(self._size[trk[0]][1], idx) for idx, (pat, trk) in enumerate(self._patterns) if len(trk)>1]
+                if not oldest:
+                    break
+                drop(min(oldest)[1])
+
+        if victims:
+            _log.debug('Delete %r', victims)
+            self._unlinking.update(victims)
+            F = asyncio.wrap_future(self._pool.submit(self._unlink, victims))
+            self._deleting.add(F)
+            F.add_done_callback(self._deleting.discard)
+            F.add_done_callback(lambda F: self._unlinking.difference_update(victims))
+
+    def _unlink(self, victims:[str]):
+        # in worker
+        for rm in victims:
+            try:
+                (self._base / rm).unlink(missing_ok=True)
+            except OSError:
+                _log.exception('Unable to delete %r', rm)
+
+    async def _watchdog(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self._period)
+            # after any pending deletions
+            S = await loop.run_in_executor(self._pool, os.statvfs, self._base)
+            free = S.f_bavail * S.f_frsize
+            if free >= self.min_free:
                 continue
+            limit = max(1, sum(self._bytes) - (self.min_free - free))
+            if not self.max_total or limit<self.max_total:
+                _log.warning('Free space %d < %d bytes.  Reduce retention from %d to %d bytes',
+                             free, self.min_free, self.max_total, limit)
+                self.max_total = limit
+                self._retain()
 
-            C = self.getCount()
+    def _rescan(self):
+        '''Recover after events were lost.
 
-            for pat, trk in self._patterns:
-                if not fnmatch(file, pat):
-                    _log.debug('mis-match %r, %r',pat, file)
-                    continue
+        Files of each pattern are written one after another.
+        So all but the most recently modified must have been closed.
+        '''
+        def mtime(E):
+            try:
+                return E.stat().st_mtime_ns
+            except FileNotFoundError:
+                return 0
+        for idx, files in enumerate(self._scan()):
+            files = [E for E in files if E.name not in self._unlinking]
+            if not files:
+                continue
+            files.sort(key=lambda E: (mtime(E), E.name))
+            trk, opened = set(self._patterns[idx][1]), self._open[idx]
+            for E in files[:-1]:
+                opened.discard(E.name)
+                if E.name not in trk:
+                    self._close(idx, E.name)
+            last = files[-1].name
+            if last not in trk:
+                opened.add(last) # assume still open.  If not, drained() will time out.
 
-                _log.debug('Close event %r, %r, %s : %r', pat, file, C, trk)
-                trk.append(file)
+    def opened(self) -> [int]:
+        'Indices of patterns with files open for writing'
+        return [idx for idx, files in enumerate(self._open) if files]
 
-                if C>0:
-                    while len(trk)>C:
-                        rm = trk.pop(0)
-                        _log.debug('Delete %r', rm)
-                        (self._base / rm).unlink(missing_ok=True)
+    async def settle(self, quiet:float=0.25, timeout:float=3.0) -> [int]:
+        '''Wait until no open file has grown for quiet seconds.  eg. in-flight packets have landed.
 
-                break # treat patterns as non-overlapping
+        Returns indices of patterns with files still growing after timeout.
+        '''
+        def sizes():
+            S = {}
+            for idx, files in enumerate(self._open):
+                for f in files:
+                    try:
+                        S[(idx, f)] = os.stat(self._base / f).st_size
+                    except FileNotFoundError:
+                        pass
+            return S
 
-        _log.debug('End Tracking in %r', self._base)
+        deadline = time.monotonic() + timeout
+        prev, since, growing = sizes(), time.monotonic(), []
+        while True:
+            now = time.monotonic()
+            if now - since >= quiet:
+                return []
+            elif now >= deadline:
+                return growing
+            await asyncio.sleep(min(quiet/4, deadline - now))
+            cur = sizes()
+            if cur!=prev:
+                growing = sorted({idx for idx,f in cur.keys() | prev.keys() if cur.get((idx,f))!=prev.get((idx,f))})
+                prev, since = cur, time.monotonic()
+
+    async def drained(self, timeout:float=10.0) -> [int]:
+        '''Wait until all files matching patterns have been closed.
+
+        Returns indices of patterns with files still open after timeout.
+        '''
+        try:
+            async with asyncio.timeout(timeout):
+                while self.opened():
+                    self._closed.clear()
+                    await self._closed.wait()
+        except TimeoutError:
+            pass
+        return self.opened()
 
     def tracked(self) -> [(str, str)]:
         # cross check the accumulated delta with the full list.
         # must be the same entries, also order which we can not check here
-        for pat, trk in self._patterns:
-            full = set(self._base.glob(pat))
-            trk = {self._base / t for t in trk}
-            assert full==trk, (full, trk)
+        for (pat, trk), full in zip(self._patterns, self._scan()):
+            full = {E.name for E in full}
+            assert full==set(trk), (pat, full, trk)
 
         return self._patterns
@@ -0,0 +1,157 @@
+'''Persistent queue of post-processing jobs
+
+Jobs are run one at a time, in order of submission, by a background task.
+Each change of state is appended to a journal file, so that jobs which
+were queued, or interrupted, when the engine stopped are run again
+when it next starts.
+
+>>> async def run(job): # called from the worker task
+...     ... convert job.hdr
+...     return 'Success' # final state
+>>> async with JobQueue(Path('/data/.convert-queue.jsonl'), run) as Q:
+...     Q.submit('/data/.../run.hdr')
+'''
+
+import asyncio
+import json
+import logging
+import os
+from pathlib import Path
+
+_log = logging.getLogger(__name__)
+
+__all__ = (
+    'Job',
+    'JobQueue',
+)
+
+class Job:
+    'One queued .hdr'
+    def __init__(self, id:int, hdr:str, state:str='Queued'):
+        self.id, self.hdr, self.state = id, hdr, state
+        self.extra = None # not journaled.  Lost on restart.  eg. IncrementalConvert
+
+    @property
+    def name(self) -> str:
+        return Path(self.hdr).stem
+
+    def __repr__(self):
+        return f'Job({self.id!r}, {self.hdr!r}, {self.state!r})'
+
+class JobQueue:
+    '''Run jobs in the background, journaling state changes.
+
+    Final state is the string returned by run(job), or 'Failed' if it raises.
+    The most recent keep finished jobs are retained in jobs for status display.
+    '''
+    PENDING = ('Queued', 'Running')
+
+    def __init__(self, journal:Path, run, keep:int=16):
+        self._journal = Path(journal)
+        self._run = run
+        self._keep = keep
+        self._Q = asyncio.Queue()
+        self._T = None
+        self.jobs = [] # [Job] pending and recently finished
+        self._load()
+
+    def onChange(self, job:Job):
+        '''Called after any job changes state
+        '''
+        pass
+
+    def depth(self) -> int:
+        'Number of jobs queued or running'
+        return sum(J.state in self.PENDING for J in self.jobs)
+
+    def submit(self, hdr:Path, extra=None) -> Job:
+        J = Job(self._next, str(hdr))
+        J.extra = extra
+        self._next += 1
+        self.jobs.append(J)
+        self._write(J)
+        self._Q.put_nowait(J)
+        self.onChange(J)
+        _log.info('Queued %r', J)
+        return J
+
+    async def __aenter__(self):
+        assert self._T is None, self._T
+        self._T = asyncio.create_task(self._work(), name='Job Queue')
+        return self
+
+    async def __aexit__(self,A,B,C):
+        self._T.cancel()
+        try:
+            await self._T
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._T = None
+            self._F.close()
+
+    def _load(self):
+        jobs = {}
+        try:
+            with self._journal.open() as F:
+                for line in F:
+                    try:
+                        E = json.loads(line)
+                    except ValueError:
+                        _log.warning('Ignore corrupt journal entry %r', line) # eg. partial write during crash
+                        continue
+                    jobs.setdefault(E['id'], Job(E['id'], E['hdr'])).state = E['state']
+        except FileNotFoundError:
+            pass
+
+        self._next = max(jobs, default=0) + 1
+        pending = [J for J in jobs.values() if J.state in self.PENDING]
+        for J in pending:
+            if J.state!='Queued':
+                _log.warning('Resume interrupted %r', J)
+            J.state = 'Queued'
+            self.jobs.append(J)
+            self._Q.put_nowait(J)
+
+        # compact to remove finished jobs
+        tmp = self._journal.with_name(f'{self._journal.name}.tmp')
+        with tmp.open('w') as F:
+            for J in pending:
+                F.write(self._entry(J))
+            F.flush()
+            os.fsync(F.fileno())
+        os.rename(tmp, self._journal)
+        self._F = self._journal.open('a')
+
+    @staticmethod
+    def _entry(J:Job) -> str:
+        return json.dumps({'id':J.id, 'hdr':J.hdr, 'state':J.state}) + '\n'
+
+    def _write(self, J:Job):
+        self._F.write(self._entry(J))
+        self._F.flush()
+        os.fsync(self._F.fileno())
+
+    def _set(self, J:Job, state:str):
+        _log.debug('%r -> %s', J, state)
+        J.state = state
+        self._write(J)
+        self.onChange(J)
+
+    async def _work(self):
+        while True:
+            J = await self._Q.get()
+            self._set(J, 'Running')
+            try:
+                state = await self._run(J)
+            except asyncio.CancelledError:
+                raise # journal still 'Running' so resumed on restart
+            except:
+                _log.exception('Job failed %r', J)
+                state = 'Failed'
+            J.extra = None
+            self._set(J, state)
+
+            finished = [J for J in self.jobs if J.state not in self.PENDING]
+            for J in finished[:-self._keep or None]:
+                self.jobs.remove(J)
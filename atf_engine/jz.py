@@ -0,0 +1,110 @@
+'''Read compressed (.jz) sample files
+
+Written by convert2j(..., compress=True) in place of .j files.
+Samples are stored in fixed size blocks, each the first sample followed by
+bit packed differences.  A table of block offsets allows reading any
+range of samples by decoding only the blocks which contain it.
+
+>>> with JZFile('/data/.../run-CH01/ch3.jz') as J:
+...     len(J) # number of samples
+...     J.read(1000, 2000) # array('i') of samples [1000, 2000)
+...     J[-1] # last sample
+'''
+
+import mmap
+import struct
+from array import array
+from pathlib import Path
+
+__all__ = (
+    'JZFile',
+    'decode_block',
+)
+
+_head = struct.Struct('<8sIIQQ')
+_block = struct.Struct('<IIi')
+
+def decode_block(buf, off:int=0) -> array:
+    '''Decode one block beginning at buf[off:]
+
+    Returns array('i') of samples.
+    '''
+    size, nsamp, prev = _block.unpack_from(buf, off)
+    out = array('i', [prev])
+    p = off + _block.size
+    for g in range(1, nsamp, 128):
+        m = min(128, nsamp - g)
+        w = buf[p]
+        p += 1
+        nbytes = (m*w + 7)//8
+        bits = int.from_bytes(buf[p:p+nbytes], 'little')
+        p += nbytes
+        mask = (1<<w) - 1
+        for j in range(m):
+            z = (bits >> (j*w)) & mask
+            prev = (prev + ((z >> 1) ^ -(z & 1)) + 0x80000000) % 0x100000000 - 0x80000000
+            out.append(prev)
+    if p != off + size:
+        raise ValueError('Corrupt .jz block')
+    return out
+
+class JZFile:
+    '''Read a complete .jz file.
+
+    Behaves as a sequence of samples.
+    '''
+    MAGIC = b'ATFJZ\0\0\0'
+
+    def __init__(self, fname:Path):
+        with open(fname, 'rb') as F:
+            try:
+                self._map = mmap.mmap(F.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError: # empty file
+                raise ValueError(f'Not a .jz file: {fname}')
+        if len(self._map) < _head.size:
+            self._map.close()
+            raise ValueError(f'Not a .jz file: {fname}')
+        magic, version, self.block, self._len, table = _head.unpack_from(self._map)
+        if magic!=self.MAGIC or version!=1 or not self.block:
+            self._map.close()
+            raise ValueError(f'Not a .jz file: {fname}')
+        if table==0:
+            self._map.close()
+            raise ValueError(f'Incomplete .jz file: {fname}')
+        nblock = (self._len + self.block - 1)//self.block
+        self._table = array('Q')
+        self._table.frombytes(self._map[table : table + nblock*8])
+        if len(self._table)!=nblock:
+            self._map.close()
+            raise ValueError(f'Truncated .jz file: {fname}')
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, A, B, C):
+        self.close()
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, i:int) -> int:
+        if i<0:
+            i += self._len
+        if not 0<=i<self._len:
+            raise IndexError(i)
+        return self.read(i, i+1)[0]
+
+    def read(self, start:int, stop:int) -> array:
+        'Return array of samples [start, stop)'
+        start, stop = max(0, start), min(stop, self._len)
+        out = array('i')
+        if start >= stop:
+            return out
+        first, last = start//self.block, (stop - 1)//self.block
+        for b in range(first, last+1):
+            out.extend(decode_block(self._map, self._table[b]))
+        base = first*self.block
+        return out[start-base : stop-base]
@@ -0,0 +1,85 @@
+'''Min/max overviews written alongside converted .j files
+
+Each channel has several levels, each a file of (min, max) pairs.
+One pair for each block of 'factor' samples (16, 256, 4096).
+So a zoomed out view reads far less than the whole .j file.
+
+>>> levels = find_overviews(Path('/data/.../run-CH01/ch3.j'))
+>>> with Overview(levels[4096]) as ovr:
+...     mins, maxs = ovr.read(0, len(ovr)) # covers samples [0, 4096*len(ovr))
+'''
+
+import mmap
+import struct
+from array import array
+from pathlib import Path
+
+__all__ = (
+    'FACTORS',
+    'Overview',
+    'find_overviews',
+)
+
+FACTORS = (16, 256, 4096)
+
+_head = struct.Struct('<8sII')
+
+def find_overviews(jfile:Path) -> {int:Path}:
+    'Map factor -> overview file for a .j file.  eg. "ch3.j" -> {16:"ch3.16.ovr", ...}'
+    jfile = Path(jfile)
+    ret = {}
+    for F in FACTORS:
+        ovr = jfile.with_suffix(f'.{F}.ovr')
+        if ovr.exists():
+            ret[F] = ovr
+    return ret
+
+class Overview:
+    '''Read one level of an overview.
+
+    Entry i is the (min, max) of samples [i*factor, (i+1)*factor).
+    The final entry may cover fewer samples.
+    '''
+    MAGIC = b'ATFOVR\0\0'
+
+    def __init__(self, fname:Path):
+        with open(fname, 'rb') as F:
+            try:
+                self._map = mmap.mmap(F.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError: # empty file
+                raise ValueError(f'Not an overview: {fname}')
+        if len(self._map) < _head.size:
+            self._map.close()
+            raise ValueError(f'Not an overview: {fname}')
+        magic, version, self.factor = _head.unpack_from(self._map)
+        if magic!=self.MAGIC or version!=1:
+            self._map.close()
+            raise ValueError(f'Not an overview: {fname}')
+        self._len = (len(self._map) - _head.size) // 8
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, A, B, C):
+        self.close()
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, i:int) -> (int, int):
+        if i<0:
+            i += self._len
+        if not 0<=i<self._len:
+            raise IndexError(i)
+        return struct.unpack_from('<ii', self._map, _head.size + i*8)
+
+    def read(self, start:int, stop:int) -> (array, array):
+        'Return arrays of min and max for entries [start, stop)'
+        start, stop = max(0, start), min(stop, self._len)
+        pairs = array('i')
+        if start < stop:
+            pairs.frombytes(self._map[_head.size + start*8 : _head.size + stop*8])
+        return pairs[0::2], pairs[1::2]
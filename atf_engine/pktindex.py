@@ -0,0 +1,106 @@
+'''Packet index written alongside converted .j files
+
+One index per chassis records, for each data packet received, its seqno,
+timestamp, and where to find it in both the .dat and .j files.
+Allows jumping directly to the packets of interest without decoding
+from the start of a run.
+
+>>> with PacketIndex('/data/.../run-CH01/packets.idx') as idx:
+...     pkt = idx.by_time(1700000000_000000000) # POSIX time in nanoseconds
+...     pkt.dat, pkt.offset # .dat file number, and byte offset within
+...     pkt.sample # index of first sample in the .j files
+'''
+
+import mmap
+import struct
+from bisect import bisect_right
+from collections import namedtuple
+from pathlib import Path
+
+__all__ = (
+    'Packet',
+    'PacketIndex',
+)
+
+Packet = namedtuple('Packet', ['seqno', 'time', 'sample', 'offset', 'dat', 'ntime'])
+Packet.__doc__ = '''One data packet.
+
+seqno  - Sequence number
+time   - Timestamp as POSIX time in nanoseconds
+sample - Index in .j files of the first sample of this packet
+offset - Byte offset of the packet header in its .dat file
+dat    - .dat file number.  Index in the 'Dat' list of the chassis
+ntime  - Number of samples per channel in this packet
+'''
+
+_head = struct.Struct('<8sII')
+_rec = struct.Struct('<QQQQII')
+
+class PacketIndex:
+    '''Read a packet index file.
+
+    Behaves as a sequence of Packet.
+    '''
+    MAGIC = b'ATFPIDX\0'
+
+    def __init__(self, fname:Path):
+        with open(fname, 'rb') as F:
+            try:
+                self._map = mmap.mmap(F.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError: # empty file
+                raise ValueError(f'Not a packet index: {fname}')
+        if len(self._map) < _head.size or _head.unpack_from(self._map)!=(self.MAGIC, 1, _rec.size):
+            self._map.close()
+            raise ValueError(f'Not a packet index: {fname}')
+        # ignore any partial record
+        self._len = (len(self._map) - _head.size) // _rec.size
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, A, B, C):
+        self.close()
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, i:int) -> Packet:
+        if i<0:
+            i += self._len
+        if not 0<=i<self._len:
+            raise IndexError(i)
+        return Packet._make(_rec.unpack_from(self._map, _head.size + i*_rec.size))
+
+    def _search(self, key:int, field:int) -> Packet:
+        # last packet with field <= key
+        i = bisect_right(range(self._len), key,
+                         key=lambda i: _rec.unpack_from(self._map, _head.size + i*_rec.size)[field])
+        if i==0:
+            raise KeyError(key)
+        return self[i-1]
+
+    def by_seqno(self, seqno:int) -> Packet:
+        '''Packet with the given seqno, or the last packet before it if missing.
+
+        Raises KeyError if before the first packet.
+        '''
+        return self._search(seqno, 0)
+
+    def by_time(self, time:int) -> Packet:
+        '''Last packet with a timestamp at or before time (POSIX nanoseconds).
+
+        Raises KeyError if before the first packet.
+        '''
+        return self._search(time, 1)
+
+    def by_sample(self, sample:int) -> Packet:
+        '''Packet containing the given .j sample index.
+
+        For a sample within placeholders for missing packets,
+        the last packet received before.
+        Raises KeyError if sample is negative.
+        '''
+        return self._search(sample, 2)
@@ -3,7 +3,7 @@ import asyncio
 import json
 import logging
 from pathlib import Path
-from weakref import WeakValueDictionary
+from weakref import WeakValueDictionary, finalize
 
 from p4p.client.asyncio import Context, Disconnected
 
@@ -19,20 +19,66 @@ class PVEncoder(json.JSONEncoder):
             o = super().default(o)
         return o
 
+def unwrap(V):
+    'Plain value from a Value as returned with Context(nt=False)'
+    V = V.value
+    if hasattr(V, 'choices'):
+        V = V.choices[V.index]
+    elif isinstance(V, str):
+        V = V.strip()
+    return V
+
+class LazyPV:
+    '''Name of a PV which is not monitored.  Current value fetched only when needed.
+
+    See PVCache.fetch()
+    '''
+    def __init__(self, name:str):
+        self.name = name
+
+    def __repr__(self):
+        return f'LazyPV({self.name!r})'
+
 class PVCache:
-    def __init__(self, ctxt:Context, cond:asyncio.Condition = None):
+    '''Monitor many PVs.
+
+    Waiters on cond are notified at most once per holdoff seconds,
+    after a burst of updates.  eg. when an IOC (re)connects.
+    '''
+    def __init__(self, ctxt:Context, cond:asyncio.Condition = None, holdoff:float=0.05):
         self.ctxt = ctxt
         self._C = WeakValueDictionary()
         self._cond = cond or asyncio.Condition()
+        self._holdoff = holdoff
+        self._notifyT = None
+        self._discon = set() # names of disconnected entries
 
     def __call__(self, pv:str, signed=None) -> 'PVEntry':
         try:
             R = self._C[pv]
             assert signed is None or signed is R.signed
         except KeyError:
+            self._discon.add(pv)
             self._C[pv] = R = PVEntry(self, pv, signed=signed)
+            finalize(R, self._discon.discard, pv)
         return R
 
+    def _changed(self, pv:str, connected:bool):
+        if connected:
+            self._discon.discard(pv)
+        else:
+            self._discon.add(pv)
+        if self._notifyT is None:
+            self._notifyT = asyncio.create_task(self._notify())
+
+    async def _notify(self):
+        try:
+            await asyncio.sleep(self._holdoff) # coalesce
+        finally:
+            self._notifyT = None
+        async with self._cond:
+            self._cond.notify_all()
+
     # delegate to asyncio.Condition
     async def __aenter__(self):
         await self._cond.__aenter__()
@@ -44,10 +90,25 @@ class PVCache:
         await self._cond.wait()
 
     def all_connected(self):
-        return all([e._value is not None for e in self._C.values()])
+        return not self._discon
 
     def disconnected(self):
-        return [k for k,e in self._C.items() if e._value is None]
+        return sorted(self._discon)
+
+    async def fetch(self, pvs:[LazyPV], timeout:float=5.0) -> list:
+        '''Concurrently get current values of many PVs
+
+        Raises ValueError if any can not be fetched within timeout.
+        '''
+        async def get1(name):
+            async with asyncio.timeout(timeout):
+                return unwrap(await self.ctxt.get(name))
+        R = await asyncio.gather(*[get1(pv.name) for pv in pvs], return_exceptions=True)
+        failed = [pv.name for pv, V in zip(pvs, R) if isinstance(V, Exception)]
+        if failed:
+            _log.debug('Fetch failed: %r', [V for V in R if isinstance(V, Exception)][:10])
+            raise ValueError(f'{failed[0]} Disconnect, and {len(failed)-1} others')
+        return R
 
 class PVEntry:
     def __init__(self, cache:PVCache, pv:str, signed=None):
@@ -64,19 +125,13 @@ class PVEntry:
         else:
             self._value = V
 
-        async with self.__cache._cond:
-            self.__cache._cond.notify_all()
+        self.__cache._changed(self.name, self._value is not None)
 
     @property
     def value(self):
         V = self._value
         if V is not None:
-            V = V.value
-            if hasattr(V, 'choices'):
-                V = V.choices[V.index]
-            elif isinstance(V, str):
-                V = V.strip()
-            return V
+            return unwrap(V)
         else:
             return None
 
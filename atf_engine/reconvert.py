@@ -0,0 +1,145 @@
+'''Convert many runs again.  eg. after a converter fix.
+
+Each .hdr is converted in place, as with "python -m atf_engine.convert X.hdr X.hdr".
+The chassis of all runs share one pool of workers.
+
+$ python -m atf_engine.reconvert /data/2024
+
+Runs already converted by this version of the converter, with the same options,
+from .dat files which have not changed since, are skipped.  If interrupted,
+running the same command again skips completed runs, and resumes partially
+converted runs from their scratch checkpoints.  With --all, completed runs are
+instead noted in a --progress file.
+'''
+
+import asyncio
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from pathlib import Path
+
+from .catalog import find_hdrs
+from .convert import (parse_size, default_memory_budget, default_jobs,
+                      prepare, convert_run, up_to_date)
+
+_log = logging.getLogger(__name__)
+
+def load_progress(fname:Path) -> {str}:
+    'Set of .hdr completed by a previous invocation'
+    done = set()
+    try:
+        with fname.open() as F:
+            for line in F:
+                try:
+                    done.add(json.loads(line)['hdr'])
+                except (ValueError, KeyError):
+                    pass # eg. partial write when interrupted
+    except FileNotFoundError:
+        pass
+    return done
+
+async def main(args) -> int:
+    hdrs = sorted({hdr.absolute() for hdr in find_hdrs(args.paths)})
+    done = load_progress(args.progress) if args.progress else set()
+
+    njobs = args.jobs or default_jobs(args.paths[0])
+    share = args.memory_budget // njobs
+    threads = max(1, len(os.sched_getaffinity(0)) // njobs)
+    _log.info('%d .hdr.  %d concurrent jobs.  Memory budget %d bytes, %d threads per chassis',
+              len(hdrs), njobs, share, threads)
+
+    limit = asyncio.Semaphore(njobs) # chassis in progress, of all runs
+    runs = asyncio.Semaphore(njobs) # runs in progress.  Bounds memory used by .hdr info
+    counts = {'skipped':0, 'converted':0, 'errors':0, 'failed':0}
+    progress = args.progress.open('a') if args.progress else None
+
+    async def one(hdr:Path):
+        async with runs:
+            if str(hdr) in done:
+                counts['skipped'] += 1
+                return
+            try:
+                with hdr.open() as F:
+                    info = json.load(F)
+                if not info.get('Chassis'):
+                    _log.debug('Not a recording: %s', hdr)
+                    counts['skipped'] += 1
+                    return
+                if not args.all and up_to_date(info, hdr, overview=args.overview, compress=args.compress,
+                                               egu=args.egu, egu_double=args.egu_double):
+                    _log.debug('Up to date: %s', hdr)
+                    counts['skipped'] += 1
+                    return
+                if args.dry_run:
+                    print(hdr)
+                    return
+
+                _log.info('Convert %s', hdr)
+                window = prepare(args, info)
+                code = await convert_run(args, info, hdr, hdr, window, pool, limit, share, threads)
+            except Exception:
+                _log.exception('Failed to convert %s', hdr)
+                counts['failed'] += 1
+                return
+
+            counts['errors' if code else 'converted'] += 1
+            if progress:
+                progress.write(json.dumps({'hdr':str(hdr), 'code':code}) + '\n')
+                progress.flush()
+
+    Executor = ProcessPoolExecutor if args.processes else ThreadPoolExecutor
+    try:
+        with Executor(max_workers=njobs) as pool:
+            await asyncio.gather(*[one(hdr) for hdr in hdrs])
+    finally:
+        if progress:
+            progress.close()
+
+    _log.info('Converted %(converted)d, with errors %(errors)d, failed %(failed)d, skipped %(skipped)d', counts)
+    return 2 if counts['failed'] else 1 if counts['errors'] else 0
+
+def getargs():
+    from argparse import ArgumentParser
+    P = ArgumentParser(description='Convert many runs again, in place')
+    P.add_argument('-v', '--verbose', dest='level', default=logging.INFO,
+                   action='store_const', const=logging.DEBUG,
+                   help='Enable extra application logging')
+    P.add_argument('-d', '--debug', action='store_true',
+                   help='Enable extra asyncio logging')
+    P.add_argument('paths', nargs='+', type=Path,
+                   help='.hdr files and/or directories to search')
+    P.add_argument('--all', action='store_true',
+                   help='Convert even runs which are up to date')
+    P.add_argument('--progress', type=Path, metavar='FILE',
+                   help='Note completed runs in this file, and skip any already noted')
+    P.add_argument('-n', '--dry-run', action='store_true',
+                   help='Only list runs which would be converted')
+    P.add_argument('--force', action='store_true',
+                   help='Bypass limits on auto insertion of placeholder samples')
+    P.add_argument('--restart', action='store_true',
+                   help='Discard progress of any previous, interrupted, conversion')
+    P.add_argument('--no-mmap', dest='mmap', action='store_false',
+                   help='Always read .dat files with read() instead of mmap()')
+    P.add_argument('--memory-budget', type=parse_size, default=default_memory_budget(),
+                   help='Total buffer memory for all jobs.  eg. "8G".  Default half of physical memory')
+    P.add_argument('-j', '--jobs', type=int,
+                   help='Number of chassis to convert concurrently.  Default depends on CPU count and storage type')
+    P.add_argument('--processes', action='store_true',
+                   help='Convert each chassis in a worker process instead of a worker thread')
+    P.add_argument('--no-overview', dest='overview', action='store_false',
+                   help='Do not write min/max overview (.ovr) files')
+    P.add_argument('--compress', action='store_true',
+                   help='Write compressed .jz files instead of .j')
+    P.add_argument('--egu', action='store_true',
+                   help='Also write each signal scaled by Slope and Intercept, as float32 (.f32)')
+    P.add_argument('--egu-double', action='append', default=[], metavar='CHANNELS',
+                   help='Also write these signals scaled, as float64 (.f64).  Signal numbers or names, comma separated.  May be repeated')
+    P.set_defaults(start=None, end=None, channels=[]) # whole runs.  See convert.prepare()
+    return P
+
+if __name__=='__main__':
+    args = getargs().parse_args()
+    logging.basicConfig(level=args.level)
+    sys.exit(asyncio.run(main(args), debug=args.debug))
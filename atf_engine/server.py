@@ -11,12 +11,16 @@ from pathlib import Path
 from tempfile import TemporaryFile
 
 from p4p.nt import NTScalar, NTEnum
-from p4p.client.asyncio import Context
+from p4p.client.asyncio import Context, Disconnected, RemoteError
 from p4p.server import Server
 from p4p.server.asyncio import SharedPV
 
-from .pvcache import PVCache, PVEncoder
+from .pvcache import PVCache, PVEncoder, LazyPV
 from .datcleaner import DatCleaner
+from .convert import (IncrementalConvert, collect, record_conversion, scratch_dir,
+                      default_memory_budget, parse_size)
+from .jobqueue import Job, JobQueue
+from .catalog import Catalog, read_run
 
 _log = logging.getLogger(__name__)
 
@@ -49,9 +53,16 @@ async def runProc(*args, **kws):
     return P.returncode, output
 
 class Engine:
-    def __init__(self, prefix:str, nchas:int, base:Path):
+    def __init__(self, prefix:str, nchas:int, base:Path, journal:Path=None, nice:int=10,
+                 lazy_meta=False, retention:dict=None, catalog:Path=None):
         self.outbase = base
+        self.catalog = catalog or base / '.catalog.sqlite'
+        self.retention = retention or {} # DatCleaner limits.  eg. {'max_bytes':...}
         self.nchas = nchas
+        self.nice = nice
+        self.lazy_meta = lazy_meta
+        self.stop_quiet = 0.25 # sec. without growth of any .dat after Stop
+        self.stop_timeout = 10.0 # sec. bound on each stage of Stop
         self.ctxt = Context(nt=False)
         self.cond = asyncio.Condition()
         self.cache = PV = PVCache(self.ctxt, cond=self.cond)
@@ -70,6 +81,8 @@ class Engine:
             pv.post(op.value(), timestamp=time.time())
             op.done()
         self._convert_result = SharedPV(nt=NTScalar('s'), initial='')
+        self._queue_depth = SharedPV(nt=NTScalar('I'), initial=0)
+        self._queue_jobs = SharedPV(nt=NTScalar('as'), initial=[])
 
         self.serv_pvs = {
             f'{prefix}CTRL:Run-SP': self._run_stop,
@@ -79,14 +92,25 @@ class Engine:
             f'{prefix}CTRL:LastFile-I': self._last_out,
             f'{prefix}CTRL:FileCnt-SP': self._history,
             f'{prefix}CTRL:CnvtRslt-I':self._convert_result,
+            f'{prefix}CTRL:CnvtQueue-I':self._queue_depth,
+            f'{prefix}CTRL:CnvtJobs-I':self._queue_jobs,
         }
 
+        # post-processing of completed runs.  Persists across restart.
+        self.queue = JobQueue(journal or base / '.convert-queue.jsonl', self._convert)
+        self.queue.onChange = self.onJobChange
+        self.onJobChange(None)
+
         # ready input
         self.ready = PV(f'{prefix}SA:READY')
         # ADC run output
         self.acq = PV(f'{prefix}ACQ:enable')
 
 
+        # per-channel meta-data is only needed when recording.
+        # Optionally fetch on demand instead of monitoring.
+        M = LazyPV if lazy_meta else PV
+
         self.FileDir = [f'{prefix}{node:02d}:FileDir-SP' for node in range(1,self.nchas+1)]
         self.FileBase = [f'{prefix}{node:02d}:FileBase-SP' for node in range(1,self.nchas+1)]
         self.Record = [f'{prefix}{node:02d}:Record-Sel' for node in range(1,self.nchas+1)]
@@ -104,17 +128,17 @@ class Engine:
                     'Address': {'Chassis':node, 'Channel':ch},
                     'SigNum': (node-1)*32 + ch,
                     'Inuse': PV(f'{prefix}{node:02d}:SA:Ch{ch:02d}:USE'),
-                    'Name': PV(f'{prefix}{node:02d}:SA:Ch{ch:02d}:NAME'),
-                    'Desc': PV(f'{prefix}{node:02d}:SA:Ch{ch:02d}:DESC'),
-                    'Desc5': PV(f'{prefix}{node:02d}:SA:Ch{ch:02d}:DESC5'),
-                    'Egu': PV(f'{prefix}{node:02d}:SA:Ch{ch:02d}:EGU'),
-                    'Slope': PV(f'{prefix}{node:02d}:SA:Ch{ch:02d}:SLO'),
-                    'Intercept': PV(f'{prefix}{node:02d}:SA:Ch{ch:02d}:OFF'),
-                    'Coupling': PV(f'{prefix}{node:02d}:ACQ:coupling:{ch:02d}'),
-                    'ResponseNode': PV(f'{prefix}{node:02d}:SA:Ch{ch:02d}:RESPNODE'),
-                    'ResponseDirection': PV(f'{prefix}{node:02d}:SA:Ch{ch:02d}:RESPDIR_RVAL'),
-                    'Type': PV(f'{prefix}{node:02d}:SA:Ch{ch:02d}:SDTYP.RVAL'),
-                    'LastCal': PV(f'{prefix}{node:02d}:SA:Ch{ch:02d}:TCAL'), # posix time
+                    'Name': M(f'{prefix}{node:02d}:SA:Ch{ch:02d}:NAME'),
+                    'Desc': M(f'{prefix}{node:02d}:SA:Ch{ch:02d}:DESC'),
+                    'Desc5': M(f'{prefix}{node:02d}:SA:Ch{ch:02d}:DESC5'),
+                    'Egu': M(f'{prefix}{node:02d}:SA:Ch{ch:02d}:EGU'),
+                    'Slope': M(f'{prefix}{node:02d}:SA:Ch{ch:02d}:SLO'),
+                    'Intercept': M(f'{prefix}{node:02d}:SA:Ch{ch:02d}:OFF'),
+                    'Coupling': M(f'{prefix}{node:02d}:ACQ:coupling:{ch:02d}'),
+                    'ResponseNode': M(f'{prefix}{node:02d}:SA:Ch{ch:02d}:RESPNODE'),
+                    'ResponseDirection': M(f'{prefix}{node:02d}:SA:Ch{ch:02d}:RESPDIR_RVAL'),
+                    'Type': M(f'{prefix}{node:02d}:SA:Ch{ch:02d}:SDTYP.RVAL'),
+                    'LastCal': M(f'{prefix}{node:02d}:SA:Ch{ch:02d}:TCAL'), # posix time
                     'ReferenceNode':0,
                     'ReferenceDirection':0,
                 }
@@ -131,6 +155,7 @@ class Engine:
         _log.debug('Engine ctor complete')
 
     async def __aenter__(self):
+        await self.queue.__aenter__()
         return self
 
     async def __aexit__(self,A,B,C):
@@ -144,8 +169,17 @@ class Engine:
                 await T
             except asyncio.CancelledError:
                 pass
+        await self.queue.__aexit__(A,B,C)
+        for J in self.queue.jobs:
+            if J.extra is not None:
+                J.extra.close()
         _log.debug('Engine joined')
 
+    def onJobChange(self, job:Job):
+        now = time.time()
+        self._queue_depth.post(self.queue.depth(), timestamp=now)
+        self._queue_jobs.post([f'{J.name}: {J.state}' for J in self.queue.jobs], timestamp=now)
+
     def onRunStop(self, pv, op):
         val = op.value()
         _log.debug('onPut(%r)', val)
@@ -193,7 +227,7 @@ class Engine:
                 raise
             except:
                 _log.exception('oops!')
-                await time.sleep(10) # at least slow down the log spam...
+                await asyncio.sleep(10) # at least slow down the log spam...
 
     async def sequence(self):
         try:
@@ -226,16 +260,20 @@ class Engine:
 
         T = time.localtime(time.time()) # customer requests localtime for string representations...
 
+        info = self.info
+        if self.lazy_meta:
+            info = await self._fetch_meta(info)
+
         # snapshot full info tree.
         # Round trip uses PVEncoder to grab current value, or throw if any Disconnected
-        jmeta = json.dumps(self.info, cls=PVEncoder, indent='  ')
+        jmeta = json.dumps(info, cls=PVEncoder, indent='  ')
         info = json.loads(jmeta)
 
         # filter inuse signals and chassis
         info['Signals'] = Signals = [S for S in info['Signals'] if S['Inuse']=='Yes']
         if len(Signals)==0:
             raise RuntimeError('No signals in use, check CCCR')
-        Chassis = {S['Address']['Chassis'] for S in Signals} # {1->32}
+        Chassis = sorted({S['Address']['Chassis'] for S in Signals}) # [1->32]
         _log.debug('Recording with %d chassis', len(Chassis))
 
         desc = info['AcquisitionId'] # base ID w/o datetime
@@ -258,7 +296,6 @@ class Engine:
 
         await self.ctxt.put(self.FileDir, [{'value':str(rundir)}]*self.nchas)
         await self.ctxt.put(self.FileBase, [{'value':p} for p in CHprefix])
-        await self.ctxt.put(self.Record, [{'value.index':chas in Chassis} for chas in range(1,self.nchas+1)])
         _log.debug('Recording paths are set')
 
         # write out only meta-data before any .dat written for context if something goes wrong...
@@ -267,12 +304,52 @@ class Engine:
             F.write(jmeta)
             _log.debug('Wrote preliminary JSON %s', F.name)
 
-        DC = DatCleaner(rundir, [f'{CHprefix[chas-1]}*.dat' for chas in Chassis])
+        DC = DatCleaner(rundir, [f'{CHprefix[chas-1]}*.dat' for chas in Chassis], **self.retention)
         def getCount():
             return int(self._history.current())
         DC.getCount = getCount
 
+        # convert each .dat as it is closed.
+        # Only useful when all files are kept.
+        # Shares scratch with atf_engine.convert, which can resume if necessary.
+        # The next run may record while this one is converted.  So each gets a share of memory.
+        scratch = scratch_dir(Path(f'{hdr}.tmp'))
+        IC = IncrementalConvert(scratch, Chassis, memory_budget=default_memory_budget()//2,
+                                nice=self.nice)
+        def onClose(idx, fname):
+            if DC.keeps_all():
+                IC.feed(Chassis[idx], rundir / fname)
+        DC.onClose = onClose
+
+        try:
+            await self._acquire(DC, Chassis)
+
+            self._postprocess(info, hdr, rundir, Chassis, DC)
+        except:
+            IC.close()
+            raise
+        else:
+            # conversion continues in the background
+            self.queue.submit(hdr, extra=IC)
+            self._last_msg.post('Queued', timestamp=time.time(), severity=0)
+
+    async def _fetch_meta(self, info:dict) -> dict:
+        '''Copy of info with only in-use signals, with all LazyPV replaced by current value.
+        '''
+        info = dict(info)
+        info['Signals'] = Signals = [dict(S) for S in info['Signals'] if S['Inuse'].read()=='Yes']
+        fields = [(S, k) for S in Signals for k,v in S.items() if isinstance(v, LazyPV)]
+        T0 = time.monotonic()
+        values = await self.cache.fetch([S[k] for S,k in fields])
+        _log.debug('Fetched %d meta-data PVs in %f sec', len(fields), time.monotonic() - T0)
+        for (S, k), v in zip(fields, values):
+            S[k] = v
+        return info
+
+    async def _acquire(self, DC:DatCleaner, Chassis:[int]):
         async with DC:
+            # enable recording only once DC is watching
+            await self.ctxt.put(self.Record, [{'value.index':chas in Chassis} for chas in range(1,self.nchas+1)])
             await self.ctxt.put(self.acq.name, {'value.index':1})
             _log.info('Acquiring...')
             self._last_msg.post('Acquire', timestamp=time.time(), severity=1) # everything up to this point should happen quickly
@@ -285,14 +362,35 @@ class Engine:
             _log.debug('Stopped Acquire...')
 
             # need to wait for in-flight packets to land on disk.
-            # TODO: how to do this properly?
-            await asyncio.sleep(3.0)
+            # ie. until open .dat files stop growing.
+            T0 = time.monotonic()
+            growing = await DC.settle(quiet=self.stop_quiet, timeout=self.stop_timeout)
+            if growing:
+                _log.warning('Stop: chassis %r still writing after %.1f sec',
+                             [Chassis[idx] for idx in growing], self.stop_timeout)
 
             # cause IOC to close final .dat file
             await self.ctxt.put(self.Record, [{'value.index':0}]*self.nchas)
-
-            await asyncio.sleep(3.0)
-
+            T1 = time.monotonic()
+
+            still_open = await DC.drained(timeout=self.stop_timeout)
+            if still_open:
+                _log.warning('Stop: chassis %r did not close final .dat after %.1f sec',
+                             [Chassis[idx] for idx in still_open], self.stop_timeout)
+            else:
+                # IOC has processed the put, so readback is only a consistency check
+                try:
+                    async with asyncio.timeout(self.stop_timeout):
+                        record = await self.ctxt.get(self.Record)
+                except (TimeoutError, Disconnected, RemoteError) as e:
+                    _log.warning('Stop: unable to read back Record-Sel : %r', e)
+                else:
+                    busy = [chas for chas, R in zip(range(1, self.nchas+1), record) if R.value.index!=0]
+                    if busy:
+                        _log.warning('Stop: chassis %r Record-Sel not reset', busy)
+            _log.info('Stop: settled in %.2f sec, closed in %.2f sec', T1 - T0, time.monotonic() - T1)
+
+    def _postprocess(self, info:dict, hdr:Path, rundir:Path, Chassis:[int], DC:DatCleaner):
         T = time.localtime(time.time())
         info['AcquisitionEndDate'] = time.strftime('%Y%m%d %H%M%S%z', T)
 
@@ -313,15 +411,61 @@ class Engine:
             json.dump(info, F, indent=' ')
             _log.debug('Wrote second JSON %s', F.name)
 
-        self._last_msg.post('Post-process', timestamp=time.time(), severity=1)
+    async def _convert(self, job:Job) -> str:
+        '''Run from JobQueue to convert one run, given its second JSON .hdr
+
+        Incremental conversion is only available if the run was recorded
+        since the engine started.  Otherwise a full conversion resumes
+        from whatever was already converted.
+        '''
+        hdr, IC = Path(job.hdr), job.extra
+        try:
+            return await self._convert_hdr(hdr, IC)
+        finally:
+            if IC is not None:
+                IC.close()
+
+    async def _convert_hdr(self, hdr:Path, IC:IncrementalConvert) -> str:
+        with hdr.open() as F:
+            info = json.load(F)
+
+        if info['Chassis'] and all('Errors' in C for C in info['Chassis']):
+            # interrupted after rename, before journal updated
+            _log.info('Already converted: %s', hdr)
+            return 'Errors' if any(C['Errors'] for C in info['Chassis']) else 'Success'
+
+        if not self._sequenceT:
+            self._last_msg.post('Post-process', timestamp=time.time(), severity=1)
+
+        jfiles = None if IC is None else await IC.finish({
+            C['Chassis']: [hdr.parent / d for d in C['Dat']]
+            for C in info['Chassis']
+        })
+        if jfiles is not None:
+            _log.debug('Complete incremental conversion')
+            output = Path(f'{hdr}.tmp')
+            lines = []
+            for C in info['Chassis']:
+                C['Errors'] = errs = IC.errors[C['Chassis']]
+                C['Stats'] = IC.stats[C['Chassis']]
+                lines += [f'Error: Chas {C["Chassis"]} : {err}\n' for err in errs]
+            collect(info, hdr, output, jfiles)
+            record_conversion(info, output, overview=IC.overview, compress=IC.compress)
+            with output.open('w') as F:
+                json.dump(info, F, indent='  ')
+            shutil.rmtree(scratch_dir(output))
+            code, convert_output = (1 if lines else 0), ''.join(lines)
 
-        # run as seperate process to mimic testing environment
-        code, convert_output = await runProc(
-            sys.executable,
-            '-m', 'atf_engine.convert',
-            str(hdr),
-            f'{hdr}.tmp',
-        )
+        else:
+            # run as seperate process to mimic testing environment
+            # with lower CPU priority, and so I/O priority, than recording
+            code, convert_output = await runProc(
+                findexe('nice'), '-n', str(self.nice),
+                sys.executable,
+                '-m', 'atf_engine.convert',
+                str(hdr),
+                f'{hdr}.tmp',
+            )
         self._convert_result.post(convert_output)
         if code not in (0, 1):
             raise RuntimeError(f'Error from {hdr!r}')
@@ -330,10 +474,25 @@ class Engine:
 
         self._last_out.post(str(hdr.absolute()), timestamp=time.time())
 
-        if code==0:
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._catalog_add, hdr)
+        except Exception:
+            _log.exception('Unable to catalog %s', hdr)
+
+        if self._sequenceT:
+            pass # don't hide status of the run in progress
+        elif code==0:
             self._last_msg.post('Success', timestamp=time.time(), severity=0)
         else:
             self._last_msg.post('Cmpl with Errors', timestamp=time.time(), severity=2)
+        return 'Success' if code==0 else 'Errors'
+
+    def _catalog_add(self, hdr:Path):
+        # in worker
+        run = read_run(hdr)
+        with Catalog(self.catalog) as C:
+            C.add(run)
+        _log.debug('Catalog %s', hdr)
 
 def getargs():
     from argparse import ArgumentParser
@@ -349,6 +508,22 @@ def getargs():
                    help='Enable extra application logging')
     P.add_argument('-d', '--debug', action='store_true',
                    help='Enable extra asyncio logging')
+    P.add_argument('--journal', type=Path, metavar='FILE',
+                   help='Conversion queue journal.  Default: <root>/.convert-queue.jsonl')
+    P.add_argument('--nice', type=int, default=10,
+                   help='Nice level of conversion, relative to recording')
+    P.add_argument('--lazy-meta', action='store_true',
+                   help='Only monitor channel Inuse.  Fetch other meta-data of in-use channels when starting a run')
+    P.add_argument('--keep-bytes', dest='max_bytes', type=parse_size, default=0, metavar='SIZE',
+                   help='Keep at most this size of .dat files of each chassis.  eg. 100G')
+    P.add_argument('--keep-total', dest='max_total', type=parse_size, default=0, metavar='SIZE',
+                   help='Keep at most this size of .dat files of all chassis')
+    P.add_argument('--keep-seconds', dest='max_age', type=float, default=0, metavar='SEC',
+                   help='Keep .dat files closed within this many seconds of the latest, of each chassis')
+    P.add_argument('--min-free', type=parse_size, default=0, metavar='SIZE',
+                   help='Delete oldest .dat files while free space in --root is less than this')
+    P.add_argument('--catalog', type=Path, metavar='FILE',
+                   help='Run catalog database.  Default: <root>/.catalog.sqlite')
     P.add_argument('--fileConverter', dest='ignored',
                    help='Location of FileReformatter2 executable')
     return P
@@ -359,7 +534,11 @@ async def main(args):
     import signal
     loop = asyncio.get_running_loop()
 
-    async with Engine(prefix=args.prefix, nchas=args.num_chassis, base=args.root) as E:
+    async with Engine(prefix=args.prefix, nchas=args.num_chassis, base=args.root,
+                      journal=args.journal, nice=args.nice, lazy_meta=args.lazy_meta,
+                      retention={'max_bytes':args.max_bytes, 'max_total':args.max_total,
+                                 'max_age':args.max_age, 'min_free':args.min_free},
+                      catalog=args.catalog) as E:
         with Server(providers=[E.serv_pvs]):
             done = asyncio.Event()
             loop.add_signal_handler(signal.SIGINT, done.set)
@@ -0,0 +1,49 @@
+import json
+from array import array
+from pathlib import Path
+
+from .._convert import convert2j
+from ..bench import Generator, generate, compare, time_points, run, getargs
+
+def test_generate(tmp_path:Path):
+    'Generated packets, with gaps and a mix of NA and NB, convert as expected'
+    chmask = 0x00010003
+    hdr, npkt = generate(tmp_path / 'data', chassis=2, size=3*1024**2, dat_size=1024**2,
+                         chmask=chmask, gap_every=100, gap_length=2, nb_fraction=0.5)
+    info = json.loads(hdr.read_text())
+    assert [C['Chassis'] for C in info['Chassis']]==[1, 2]
+    assert len(info['Chassis'][0]['Dat'])==3
+    assert len(info['Signals'])==2*3
+
+    dats = [str(hdr.parent / d) for d in info['Chassis'][0]['Dat']]
+    outdir = tmp_path / 'out'
+    outdir.mkdir()
+    errs = convert2j(dats, outdir)
+    ngap = (npkt//2 - 1)//100
+    assert len(errs)==ngap, errs
+
+    ntime = time_points(chmask)
+    gaps = json.loads((outdir / 'gaps.json').read_text())
+    assert gaps[0]=={'Start':100*ntime, 'Length':2*ntime}
+
+    G = Generator(chmask, seed=1)
+    j = array('i', (outdir / 'CH16.j').read_bytes())[5:]
+    assert j[:ntime]==array('i', G.values(0, 2))
+    # first packet after the first gap
+    assert j[102*ntime:103*ntime]==array('i', G.values(102, 2))
+
+def test_compare():
+    base = {'stages':[{'name':'convert', 'MBps':100.0}, {'name':'convert', 'MBps':120.0}]}
+    assert compare({'stages':[{'name':'convert', 'MBps':110.0}]}, base, 0.1)==[]
+    assert len(compare({'stages':[{'name':'convert', 'MBps':100.0}]}, base, 0.1))==1
+    assert compare({'stages':[{'name':'generate', 'MBps':1.0}]}, base, 0.1)==[]
+
+def test_run(tmp_path:Path):
+    args = getargs().parse_args([str(tmp_path), '--chassis', '2', '--size', '256K', '--dat-size', '64K',
+                                 '--stages', 'convert2j'])
+    args.stages = args.stages.split(',')
+    result = run(args)
+    S = result['stages'][-1]
+    assert S['name']=='convert2j' and S['errors']==0
+    assert all(S[k]>0.0 for k in ('read_time', 'decode_time', 'write_time'))
+    assert not (tmp_path / 'out').exists()
@@ -0,0 +1,73 @@
+import json
+import os
+from pathlib import Path
+
+from ..catalog import Catalog, read_run
+
+def write_run(base:Path, name:str, start:str, signals:[(int,int,str)], converted=True) -> Path:
+    rundir = base / name
+    rundir.mkdir(parents=True)
+    (rundir / 'a.dat').write_bytes(b'x'*100)
+    info = {
+        'AcquisitionId': name,
+        'AcquisitionStartDate': start,
+        'AcquisitionEndDate': start,
+        'SampleRate': 250000,
+        'Signals': [],
+        'Chassis': [{'Chassis':chas, 'Dat':['a.dat']} for chas in sorted({S[0] for S in signals})],
+    }
+    for chas, chan, sname in signals:
+        sig = {'Address':{'Chassis':chas, 'Channel':chan}, 'SigNum':(chas-1)*32+chan, 'Name':sname}
+        if converted:
+            j = rundir / f'{name}-CH{chas:02d}' / f'ch{chan}.j'
+            j.parent.mkdir(exist_ok=True)
+            j.write_bytes(b'j'*40)
+            sig['OutDataFile'] = str(j.relative_to(rundir))
+        info['Signals'].append(sig)
+    if converted:
+        for C in info['Chassis']:
+            C['Errors'] = ['oops'] if C['Chassis']==7 else []
+    hdr = rundir / f'{name}.hdr'
+    hdr.write_text(json.dumps(info))
+    return hdr
+
+def test_read_run(tmp_path:Path):
+    hdr = write_run(tmp_path, 'one', '20240501 134500-0700', [(1, 2, 'X'), (7, 1, 'Y')])
+    run = read_run(hdr)
+    assert run['status']=='Errors'
+    assert run['errors']==1
+    assert run['dat_bytes']==200
+    assert run['j_bytes']==80
+    assert run['start_ns']==1714596300*10**9
+    assert [S['name'] for S in run['signals']]==['X', 'Y']
+    assert run['signals'][1]['jfile']==str(hdr.parent / 'one-CH07' / 'ch1.j')
+
+def test_index(tmp_path:Path):
+    data = tmp_path / 'data'
+    one = write_run(data, 'one', '20240501 134500+0000', [(1, 2, 'X'), (7, 1, 'Y')])
+    write_run(data, 'two', '20240801 000000+0000', [(7, 3, 'X')])
+    write_run(data, 'three', '20240901 000000+0000', [(2, 1, 'Z')], converted=False)
+
+    with Catalog(tmp_path / 'cat.sqlite') as C:
+        assert C.index([data], jobs=2)==3
+        assert C.index([data], jobs=2)==0 # unchanged
+
+        assert [R['acquisition_id'] for R in C.query()]==['one', 'two', 'three']
+        assert [R['acquisition_id'] for R in C.query(name='X', chassis=7)]==['two']
+        assert [R['acquisition_id'] for R in C.query(name='X', since=1714600000*10**9)]==['two']
+        assert [R['acquisition_id'] for R in C.query(status='Unconverted')]==['three']
+        R, = C.query(name='Y')
+        assert [S['name'] for S in C.signals(R['id'])]==['X', 'Y']
+
+        # update
+        info = json.loads(one.read_text())
+        info['Signals'][0]['Name'] = 'W'
+        one.write_text(json.dumps(info))
+        os.utime(one, ns=(1, 1))
+        assert C.index([data])==1
+        assert [R['acquisition_id'] for R in C.query(name='W')]==['one']
+        assert [R['acquisition_id'] for R in C.query(name='X')]==['two']
+
+        one.unlink()
+        C.index([data], prune=True)
+        assert [R['acquisition_id'] for R in C.query()]==['two', 'three']
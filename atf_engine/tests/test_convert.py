@@ -0,0 +1,47 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .. import convert
+from ..bench import generate
+from ..convert import default_jobs, getargs, main
+
+def test_default_jobs(tmp_path:Path, monkeypatch):
+    monkeypatch.setattr(convert.os, 'sched_getaffinity', lambda pid: set(range(8)))
+    monkeypatch.setattr(convert, 'is_rotational', lambda path: False)
+    assert default_jobs(tmp_path)==8
+    monkeypatch.setattr(convert, 'is_rotational', lambda path: True)
+    assert default_jobs(tmp_path)==2
+    monkeypatch.setattr(convert.os, 'sched_getaffinity', lambda pid: {0})
+    assert default_jobs(tmp_path)==1
+
+def test_largest_first(tmp_path:Path, monkeypatch):
+    'Chassis are submitted in order of decreasing .dat size'
+    hdr, npkt = generate(tmp_path / 'run', chassis=3, size=192*1024, dat_size=64*1024, chmask=0x3)
+    info = json.loads(hdr.read_text())
+    for C, ndat in zip(info['Chassis'], (1, 3, 2)):
+        del C['Dat'][ndat:]
+    hdr.write_text(json.dumps(info))
+
+    order = []
+    class Recording(ThreadPoolExecutor):
+        def submit(self, fn, *args, **kws):
+            order.append(Path(fn.keywords['outdir']).name)
+            return super().submit(fn, *args, **kws)
+    monkeypatch.setattr(convert, 'ThreadPoolExecutor', Recording)
+
+    args = getargs().parse_args([str(hdr), str(hdr), '-j', '1', '--memory-budget', '64M'])
+    assert asyncio.run(main(args))==0
+    assert order==['CH02', 'CH03', 'CH01']
+
+def test_processes(tmp_path:Path):
+    'Each chassis converted in a worker process'
+    hdr, npkt = generate(tmp_path / 'run', chassis=2, size=128*1024, dat_size=64*1024, chmask=0x3)
+    args = getargs().parse_args([str(hdr), str(hdr), '-j', '2', '--memory-budget', '64M', '--processes'])
+    assert asyncio.run(main(args))==0
+
+    info = json.loads(hdr.read_text())
+    assert all(C['Errors']==[] and C['Stats']['Packets']>0 for C in info['Chassis'])
+    assert sum(C['Stats']['Packets'] for C in info['Chassis'])==npkt
+    assert all((hdr.parent / S['OutDataFile']).exists() for S in info['Signals'])
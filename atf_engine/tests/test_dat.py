@@ -1,26 +1,38 @@
 
+import json
 import struct
 from array import array
 from pathlib import Path
 
-from .._convert import convert2j
+import pytest
+
+from .. import _convert
+from .._convert import convert2j, Converter
+from ..pktindex import PacketIndex
+from ..overview import FACTORS, Overview, find_overviews
+from ..jz import JZFile
 
 def make_packets(nsamp:int,
                  seqno:int=0,
                  limits:bool=True,
+                 chmask:int=0xffffffff,
+                 values:[int]=None,
                  ) -> [bytes]:
     mtu = 1500-40 # 40 is placeholder for IP+UDP headers
+    nchan = bin(chmask).count('1')
     pkts = []
     for i, n in enumerate(range(nsamp)):
-        if not pkts or (i%32==0 and len(pkts[-1])>mtu-16-3*32):
+        if not pkts or (i%nchan==0 and len(pkts[-1])>mtu-16-3*nchan):
             sec, ns = divmod(1000000*seqno, 1000000000)
             pkts.append(
-                struct.pack('>IIQII', 0, 0xffffffff, seqno, 0x12345678+sec, ns)
+                struct.pack('>IIQII', 0, chmask, seqno, 0x12345678+sec, ns)
             )
             seqno += 1
             if limits:
                 pkts[-1] += struct.pack('>IIII', 0x11111111,0x22222222,0x44444444,0x88888888)
 
+        if values is not None:
+            n = values[n]
         pkts[-1] += struct.pack('>i',n)[1:]
 
     pkts = [
@@ -60,6 +72,40 @@ def read_j(outdir:Path) -> {int:array}:
         ret[ch] = j
     return ret
 
+ISAs = ['scalar', 'ssse3', 'avx2']
+
+@pytest.fixture(params=ISAs)
+def isa(request):
+    try:
+        prev = _convert.isa(request.param)
+    except ValueError:
+        pytest.skip(f'{request.param} not supported')
+    try:
+        yield request.param
+    finally:
+        _convert.isa(prev)
+
+@pytest.mark.parametrize('chmask', [0xffffffff, 0x0000ff00, 0x00f0f0f0, 0x80000001, 0x00000004])
+def test_decode(tmp_path:Path, isa:str, chmask:int):
+    'Decode kernels must be bit identical, including sign extension and partial chmask'
+    chans = [c for c in range(32) if chmask&(1<<c)]
+    nchan = len(chans)
+    ntime = 1000
+    values = [((n*2654435761)&0xffffff) - 0x800000 for n in range(ntime*nchan)]
+    values[:4] = [-0x800000, 0x7fffff, -1, 0]
+
+    pkts = make_packets(ntime*nchan, chmask=chmask, values=values)
+    indat = tmp_path / 'input.dat'
+    indat.write_bytes(b''.join(pkts))
+
+    errs = convert2j([str(indat)],tmp_path)
+    assert errs == []
+
+    for k, ch in enumerate(chans):
+        j = array('i', (tmp_path / f'CH{ch:02d}.j').read_bytes())
+        assert j == array('i', [1, 0, 0, ntime*4, 0] + values[k::nchan]), ch
+    assert len(list(tmp_path.glob('*.j')))==nchan
+
 def test_single(tmp_path:Path):
     'A single packet, not full'
     pkts = make_packets(32*2, seqno=0x01020304)
@@ -121,6 +167,101 @@ def test_parts(tmp_path:Path):
         for n in range(32)
     }
 
+@pytest.mark.parametrize('mmap', [True, False])
+def test_parts_empty(tmp_path:Path, mmap:bool):
+    'Several packets, split across two files with an empty file between'
+    pkts = make_packets(32*100, seqno=0x01020304)
+    indat1 = tmp_path / 'part1.dat'
+    indat1.write_bytes(b''.join(pkts[:3]))
+    indat2 = tmp_path / 'part2.dat'
+    indat2.write_bytes(b''.join(pkts[3:]))
+    empty = tmp_path / 'empty.dat'
+    empty.write_bytes(b'')
+
+    errs = convert2j([
+        str(indat1),
+        str(empty),
+        str(indat2),
+    ],tmp_path, mmap=mmap)
+    assert errs == []
+
+    assert read_j(tmp_path)=={
+        n: array('i', [1, 0, 0, 100*4, 0] + list(range(n, 32*100, 32)))
+        for n in range(32)
+    }
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_memory_budget(tmp_path:Path, mmap:bool):
+    'Smallest buffers.  Output spans many flushes'
+    nsamp = 2*100000
+    indat = tmp_path / 'long.dat'
+    indat.write_bytes(b''.join(make_packets(nsamp, chmask=0x00010002)))
+
+    errs = convert2j([str(indat)], tmp_path, mmap=mmap, memory_budget=1)
+    assert errs == []
+
+    for n, ch in enumerate((1, 16)):
+        j = array('i', (tmp_path / f'CH{ch:02d}.j').read_bytes())
+        assert j[:5] == array('i', [1, 0, 0, nsamp*2, 0])
+        assert j[5:] == array('i', range(n, nsamp, 2))
+    # unused channels not created
+    assert not (tmp_path / 'CH00.j').exists()
+
+def test_incremental(tmp_path:Path):
+    'Several packets, split across files converted one at a time'
+    pkts = make_packets(32*100, seqno=0x01020304)
+    indats = []
+    for i, part in enumerate((pkts[:3], pkts[3:5], pkts[5:])):
+        indats.append(tmp_path / f'part{i}.dat')
+        indats[-1].write_bytes(b''.join(part))
+
+    conv = Converter(tmp_path)
+    for indat in indats:
+        conv.add(indat)
+    assert conv.finish() == []
+
+    assert read_j(tmp_path)=={
+        n: array('i', [1, 0, 0, 100*4, 0] + list(range(n, 32*100, 32)))
+        for n in range(32)
+    }
+
+    with pytest.raises(RuntimeError):
+        conv.add(indats[0])
+
+def test_resume(tmp_path:Path):
+    'Interrupted conversion continues from checkpoint'
+    pkts = make_packets(32*100, seqno=0x01020304)
+    indats = []
+    for i, part in enumerate((pkts[:3], pkts[3:5], pkts[5:])):
+        indats.append(tmp_path / f'part{i}.dat')
+        indats[-1].write_bytes(b''.join(part))
+
+    outdir = tmp_path / 'out'
+    outdir.mkdir()
+
+    conv = Converter(outdir)
+    assert conv.resume(indats) == 0
+    conv.add(indats[0])
+    conv.add(indats[1])
+    del conv # interrupted before finish()
+
+    # partial output past checkpoint is discarded
+    with (outdir / 'CH00.j').open('ab') as F:
+        F.write(b'junk')
+
+    errs = convert2j(indats, outdir, resume=True)
+    assert errs == []
+
+    assert read_j(outdir)=={
+        n: array('i', [1, 0, 0, 100*4, 0] + list(range(n, 32*100, 32)))
+        for n in range(32)
+    }
+
+    # checkpoint does not match a different list of inputs
+    conv = Converter(outdir)
+    assert conv.resume(indats[1:]) == 0
+    assert not (outdir / 'CH00.j').exists()
+
 def test_lost_one(tmp_path:Path):
     'A single missing packet'
 
@@ -142,6 +283,7 @@ def test_lost_one(tmp_path:Path):
         pos = 5+3*14 # first placeholder sample
         exp[pos:(pos+14)] = array('i', [exp[pos-1]]*14)
     assert read_j(tmp_path)==expect
+    assert json.loads((tmp_path / 'gaps.json').read_text())==[{'Start':3*14, 'Length':14}]
 
 def test_lost_two(tmp_path:Path):
     'A single missing packet'
@@ -164,3 +306,409 @@ def test_lost_two(tmp_path:Path):
         pos = 5+3*14 # first placeholder sample
         exp[pos:(pos+28)] = array('i', [exp[pos-1]]*28)
     assert read_j(tmp_path)==expect
+    assert json.loads((tmp_path / 'gaps.json').read_text())==[{'Start':3*14, 'Length':28}]
+
+def test_lost_many(tmp_path:Path):
+    'A long dropout spanning several output buffers'
+    chmask = 0x00000003
+    probe = make_packets(2*1000, chmask=chmask)
+    per = (len(probe[0]) - 16 - 24 - 16)//3//2 # samples per channel per full packet
+    n0, nmissing = 4*per, 1000
+    pkts = make_packets(2*n0, seqno=1200, chmask=chmask)
+    assert len(pkts)==4
+    pkts += make_packets(2*1000, seqno=1200+4+nmissing, chmask=chmask,
+                         values=range(2*n0, 2*n0+2*1000))
+
+    indat = tmp_path / 'input.dat'
+    indat.write_bytes(b''.join(pkts))
+
+    # placeholders also scaled
+    egu = {0: (2.0, 1.0), 1: (0.5, -1.0, True)}
+    errs = convert2j([str(indat)], tmp_path, memory_budget=1, egu=egu)
+    assert len(errs)==1, errs
+    nfill = nmissing*per
+    assert json.loads((tmp_path / 'gaps.json').read_text())==[{'Start':n0, 'Length':nfill}]
+
+    for ch, ext, typecode in ((0, 'f32', 'f'), (1, 'f64', 'd')):
+        j = array('i', (tmp_path / f'CH{ch:02d}.j').read_bytes())[5:]
+        assert j[:n0]==array('i', range(ch, 2*n0, 2))
+        assert j[n0:n0+nfill]==array('i', [2*n0-2+ch])*nfill
+        assert j[n0+nfill:]==array('i', range(2*n0+ch, 2*n0+2*1000, 2))
+
+        slope, intercept = egu[ch][:2]
+        f = array(typecode, (tmp_path / f'CH{ch:02d}.{ext}').read_bytes())
+        assert f==array(typecode, [v*slope + intercept for v in j])
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_stats(tmp_path:Path, threads:int):
+    'Counters of a conversion, also when resumed'
+    pkts = make_packets(32*14*10, seqno=1200)
+    del pkts[3:5]
+    indats = []
+    for i, part in enumerate((pkts[:2], pkts[2:6], pkts[6:])):
+        indats.append(tmp_path / f'part{i}.dat')
+        indats[-1].write_bytes(b''.join(part))
+    counts = {
+        'bytes': sum(len(p) for p in pkts),
+        'packets': 8,
+        'samples': 8*14*32,
+        'gaps': 1,
+        'missing_packets': 2,
+        'placeholders': 2*14,
+    }
+
+    outdir = tmp_path / 'out'
+    outdir.mkdir()
+    errs, stats = convert2j(indats, outdir, threads=threads, stats=True)
+    assert len(errs)==1
+    assert {k: stats[k] for k in counts}==counts
+    assert all(stats[k]>=0.0 for k in ('read_time', 'decode_time', 'write_time'))
+    # counted also when reading through a mapping
+    assert stats['read_time']>0.0
+
+    outdir = tmp_path / 'resume'
+    outdir.mkdir()
+    conv = Converter(outdir)
+    conv.add(indats[0])
+    conv.add(indats[1])
+    assert conv.stats()['packets']==6
+    del conv
+    conv = Converter(outdir)
+    assert conv.resume(indats)==2
+    conv.add(indats[2])
+    conv.finish()
+    assert {k: conv.stats()[k] for k in counts}==counts
+
+@pytest.mark.parametrize('chmask', [0xffffffff, 0x00010002])
+def test_parallel(tmp_path:Path, chmask:int):
+    'Files decoded concurrently give the same output as serial'
+    import random
+    nchan = bin(chmask).count('1')
+    ntime = 14*32*40//nchan
+    values = [random.randint(-2**23, 2**23-1) for _ in range(ntime*nchan)]
+    pkts = make_packets(ntime*nchan, seqno=1200, chmask=chmask, values=values)
+    N = len(pkts)
+    # gaps within files, and at file boundaries
+    parts = [pkts[:5]+pkts[7:N//4], [], pkts[N//4+1:N//2], pkts[N//2:N//2+3]+pkts[N//2+4:-2]]
+    indats = []
+    for i, part in enumerate(parts):
+        indats.append(tmp_path / f'part{i}.dat')
+        indats[-1].write_bytes(b''.join(part))
+
+    results = []
+    for name, threads in (('serial', 1), ('parallel', 4)):
+        outdir = tmp_path / name
+        outdir.mkdir()
+        errs = convert2j(indats, outdir, threads=threads)
+        results.append((errs, {j.name: j.read_bytes() for j in outdir.glob('*.j')} | {'idx': (outdir/'packets.idx').read_bytes(), 'gaps': (outdir/'gaps.json').read_bytes()}))
+
+    assert len(results[0][0])==3, results[0][0]
+    assert len(results[0][1])==nchan+2
+    assert len(json.loads(results[0][1]['gaps']))==3
+    assert results[0]==results[1]
+
+    # resume part way, then continue in parallel
+    outdir = tmp_path / 'resume'
+    outdir.mkdir()
+    conv = Converter(outdir)
+    conv.add(indats[0])
+    del conv
+    errs = convert2j(indats, outdir, resume=True, threads=4)
+    assert (errs, {j.name: j.read_bytes() for j in outdir.glob('*.j')} | {'idx': (outdir/'packets.idx').read_bytes(), 'gaps': (outdir/'gaps.json').read_bytes()})==results[0]
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_parallel_budget(tmp_path:Path, mmap:bool):
+    'Buffers of all workers together stay within the memory budget'
+    pkts = make_packets(32*14*400, seqno=1200)
+    indats = []
+    for i in range(8):
+        indats.append(tmp_path / f'part{i}.dat')
+        indats[-1].write_bytes(b''.join(pkts[i*50:(i+1)*50]))
+
+    budget = 64<<20
+    for threads in (1, 4):
+        outdir = tmp_path / f'out{threads}'
+        outdir.mkdir()
+        _convert.buffer_usage(reset=True)
+        assert convert2j(indats, outdir, mmap=mmap, memory_budget=budget, threads=threads)==[]
+        cur, peak = _convert.buffer_usage()
+        assert cur==0
+        assert budget//2 < peak <= budget, threads
+
+def test_parallel_checkpoint(tmp_path:Path):
+    'Each batch of files decoded in parallel is checkpointed'
+    pkts = make_packets(32*14*60, seqno=1200)
+    # a jump in seqno without a jump in time, which is only noticed while decoding
+    for i in range(55, 60):
+        pkt = bytearray(pkts[i])
+        struct.pack_into('>Q', pkt, 24, 1200+i+1000)
+        pkts[i] = bytes(pkt)
+    indats = []
+    for i in range(6):
+        indats.append(tmp_path / f'part{i}.dat')
+        indats[-1].write_bytes(b''.join(pkts[i*10:(i+1)*10]))
+
+    outdir = tmp_path / 'out'
+    outdir.mkdir()
+    with pytest.raises(RuntimeError, match='Inconsistency'):
+        convert2j(indats, outdir, threads=2)
+    # batches [0, 2) and [2, 4) complete.  [4, 6) fails
+    assert Converter(outdir).resume(indats)==4
+
+def test_index(tmp_path:Path):
+    'Packet index, with missing packets'
+    pkts = make_packets(32*14*10, seqno=1200)
+    del pkts[3:5]
+    indats = []
+    for i, part in enumerate((pkts[:2], pkts[2:6], pkts[6:])):
+        indats.append(tmp_path / f'part{i}.dat')
+        indats[-1].write_bytes(b''.join(part))
+
+    errs = convert2j(indats, tmp_path)
+    assert errs == ['Missing 2 [1203, 1205) 0.003 s']
+
+    pktlen = len(pkts[0])
+    with PacketIndex(tmp_path / 'packets.idx') as idx:
+        assert len(idx)==8
+        assert [(P.seqno, P.sample, P.dat, P.offset) for P in idx] == [
+            (1200,   0, 0, 0),
+            (1201,  14, 0, pktlen),
+            (1202,  28, 1, 0),
+            (1205,  70, 1, pktlen),
+            (1206,  84, 1, 2*pktlen),
+            (1207,  98, 1, 3*pktlen),
+            (1208, 112, 2, 0),
+            (1209, 126, 2, pktlen),
+        ]
+        assert idx[0].time == (0x12345678+1)*1000000000 + 200000000
+        assert idx[-1].ntime == 14
+
+        assert idx.by_seqno(1203).seqno == 1202
+        assert idx.by_seqno(1205).seqno == 1205
+        assert idx.by_time(idx[4].time+1).seqno == 1206
+        assert idx.by_sample(69).seqno == 1202
+        assert idx.by_sample(70).seqno == 1205
+        with pytest.raises(KeyError):
+            idx.by_seqno(1199)
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_window(tmp_path:Path, mmap:bool):
+    'Only packets with timestamps in [start, end)'
+    nsamp = 2*100000
+    pkts = make_packets(nsamp, chmask=0x3)
+    N = len(pkts)
+    indats = []
+    for i in range(3):
+        indats.append(tmp_path / f'part{i}.dat')
+        indats[-1].write_bytes(b''.join(pkts[i*N//3:(i+1)*N//3]))
+
+    def ptime(seqno):
+        return 0x12345678*1000000000 + seqno*1000000
+
+    first, last = N//3+N//5, 2*N//3+5 # middle of second file, and start of third
+    outdir = tmp_path / 'out'
+    outdir.mkdir()
+    errs = convert2j(indats, outdir, mmap=mmap, start=ptime(first)-1, end=ptime(last))
+    assert errs == []
+
+    with PacketIndex(outdir / 'packets.idx') as idx:
+        assert [P.seqno for P in idx] == list(range(first, last))
+        assert idx[0].dat==1 and idx[0].sample==0
+
+    ntime = nsamp//2
+    j0 = array('i', (outdir / 'CH00.j').read_bytes())
+    per = len(pkts[0]) - 16 - 24 - 16 # bytes of samples per full packet
+    per = per//3//2
+    assert j0[5:] == array('i', range(2*first*per, 2*last*per, 2))
+    assert ntime > last*per
+
+def expected_overviews(jfile:Path) -> {int:[(int,int)]}:
+    samps = array('i', jfile.read_bytes())[5:]
+    return {
+        F: [(min(samps[i:i+F]), max(samps[i:i+F])) for i in range(0, len(samps), F)]
+        for F in FACTORS
+    }
+
+def read_overviews(jfile:Path) -> {int:[(int,int)]}:
+    ret = {}
+    for F, fname in find_overviews(jfile).items():
+        with Overview(fname) as ovr:
+            assert ovr.factor==F
+            ret[F] = list(zip(*ovr.read(0, len(ovr))))
+    return ret
+
+def test_overview(tmp_path:Path):
+    'Min/max overview levels, also with parallel and resumed conversion'
+    import random
+    ntime = 60000
+    values = [random.randint(-2**23, 2**23-1) for _ in range(2*ntime)]
+    pkts = make_packets(2*ntime, chmask=0x00000110, values=values)
+    N = len(pkts)
+    del pkts[N//2:N//2+20] # a gap
+    parts = [pkts[:17], pkts[17:N//3], pkts[N//3:-10], pkts[-10:]]
+    indats = []
+    for i, part in enumerate(parts):
+        indats.append(tmp_path / f'part{i}.dat')
+        indats[-1].write_bytes(b''.join(part))
+
+    results = []
+    for name, threads in (('serial', 1), ('parallel', 4)):
+        outdir = tmp_path / name
+        outdir.mkdir()
+        errs = convert2j(indats, outdir, threads=threads, overview=True)
+        assert len(errs)==1, errs
+        results.append({f.name: f.read_bytes() for f in outdir.glob('*.ovr')})
+
+    assert len(results[0])==2*3
+    assert results[0]==results[1]
+    for ch in (4, 8):
+        jfile = tmp_path / 'serial' / f'CH{ch:02d}.j'
+        assert read_overviews(jfile)==expected_overviews(jfile)
+
+    outdir = tmp_path / 'resume'
+    outdir.mkdir()
+    conv = Converter(outdir, overview=True)
+    conv.add(indats[0])
+    conv.add(indats[1])
+    del conv
+    errs = convert2j(indats, outdir, resume=True, overview=True)
+    assert {f.name: f.read_bytes() for f in outdir.glob('*.ovr')}==results[0]
+
+def test_compress(tmp_path:Path):
+    'Compressed .jz output decodes to the same samples as .j, also when resumed'
+    import random
+    ntime = 30000
+    values, x = [], 0
+    for i in range(2*ntime):
+        if i%5000 < 100:
+            x = random.randint(-2**23, 2**23-1) # full range
+        else:
+            x = max(-2**23, min(2**23-1, x + random.randint(-20, 20))) # slowly varying
+        values.append(x)
+    pkts = make_packets(2*ntime, chmask=0x00000110, values=values)
+    N = len(pkts)
+    del pkts[N//2:N//2+20] # a gap
+    parts = [pkts[:17], pkts[17:N//3], pkts[N//3:-10], pkts[-10:]]
+    indats = []
+    for i, part in enumerate(parts):
+        indats.append(tmp_path / f'part{i}.dat')
+        indats[-1].write_bytes(b''.join(part))
+
+    plain = tmp_path / 'plain'
+    plain.mkdir()
+    assert len(convert2j(indats, plain, overview=True))==1
+
+    outdir = tmp_path / 'jz'
+    outdir.mkdir()
+    assert len(convert2j(indats, outdir, overview=True, compress=True, threads=4))==1
+    assert not list(outdir.glob('*.j'))
+
+    for ch in (4, 8):
+        expect = array('i', (plain / f'CH{ch:02d}.j').read_bytes())[5:]
+        jz = outdir / f'CH{ch:02d}.jz'
+        assert jz.stat().st_size*3 < len(expect)*4
+        with JZFile(jz) as J:
+            assert len(J)==len(expect)
+            assert J.read(0, len(J))==expect
+            assert J.read(4000, 9000)==expect[4000:9000]
+            assert J[-1]==expect[-1]
+        assert read_overviews(jz)==read_overviews(plain / f'CH{ch:02d}.j')
+
+    results = {f.name: f.read_bytes() for f in outdir.iterdir() if f.name!='checkpoint'}
+
+    outdir = tmp_path / 'resume'
+    outdir.mkdir()
+    conv = Converter(outdir, overview=True, compress=True)
+    conv.add(indats[0])
+    conv.add(indats[1])
+    del conv
+    conv = Converter(outdir, overview=True, compress=True)
+    assert conv.resume(indats)==2 # continues from incomplete block
+    for dat in indats[2:]:
+        conv.add(dat)
+    assert len(conv.finish())==1
+    assert {f.name: f.read_bytes() for f in outdir.iterdir() if f.name!='checkpoint'}==results
+
+@pytest.mark.parametrize('threads,compress', [(1, False), (4, False), (4, True)])
+def test_checksums(tmp_path:Path, threads:int, compress:bool):
+    'CRC32C computed while converting matches that of the files, also when resumed'
+    (tmp_path / 'check').write_bytes(b'123456789')
+    assert _convert.crc32c(tmp_path / 'check')==0xe3069283
+
+    pkts = make_packets(32*14*40, seqno=1200, chmask=0x00010002)
+    N = len(pkts)
+    indats = []
+    for i, part in enumerate((pkts[:N//4], [], pkts[N//4+2:N//2], pkts[N//2:])):
+        indats.append(tmp_path / f'part{i}.dat')
+        indats[-1].write_bytes(b''.join(part))
+
+    outdir = tmp_path / 'out'
+    outdir.mkdir()
+    convert2j(indats, outdir, threads=threads, compress=compress, overview=True)
+    sums = json.loads((outdir / 'checksums.json').read_text())
+    ext = '.jz' if compress else '.j'
+    assert set(sums)=={'Dat', f'CH01{ext}', f'CH16{ext}'}
+    assert sums['Dat']==[_convert.crc32c(d) for d in indats]
+    for name in (f'CH01{ext}', f'CH16{ext}'):
+        assert sums[name]==_convert.crc32c(outdir / name)
+
+    outdir = tmp_path / 'resume'
+    outdir.mkdir()
+    conv = Converter(outdir, compress=compress, overview=True)
+    conv.add(indats[0])
+    conv.add(indats[1])
+    del conv
+    convert2j(indats, outdir, resume=True, threads=threads, compress=compress, overview=True)
+    assert json.loads((outdir / 'checksums.json').read_text())==sums
+
+    # input checksums are not computed for a time window
+    outdir = tmp_path / 'window'
+    outdir.mkdir()
+    convert2j(indats, outdir, start=1, compress=compress)
+    assert json.loads((outdir / 'checksums.json').read_text())['Dat']==[]
+
+def test_egu(tmp_path:Path, isa:str):
+    'Scaled output is the same for all kernels, also with placeholders, and in parallel'
+    import random
+    chmask = 0x00010002
+    ntime = 14*32*20//2
+    values = [random.randint(-2**23, 2**23-1) for _ in range(ntime*2)]
+    values[:4] = [-0x800000, 0x7fffff, -1, 0]
+    pkts = make_packets(ntime*2, chmask=chmask, values=values)
+    N = len(pkts)
+    del pkts[N//2:N//2+2] # a gap
+    indats = []
+    for i, part in enumerate((pkts[:N//3], pkts[N//3:])):
+        indats.append(tmp_path / f'part{i}.dat')
+        indats[-1].write_bytes(b''.join(part))
+
+    egu = {1: (0.3, -2.5), 16: (1e-6, 7.0, True)}
+    results = []
+    for threads in (1, 2):
+        outdir = tmp_path / f'out{threads}'
+        outdir.mkdir()
+        assert len(convert2j(indats, outdir, threads=threads, egu=egu))==1
+        results.append({f.name: f.read_bytes() for f in outdir.iterdir() if f.name!='checkpoint'})
+    assert results[0]==results[1]
+
+    def f32(x):
+        return struct.unpack('f', struct.pack('f', x))[0]
+    j = array('i', results[0]['CH01.j'])[5:]
+    assert array('f', results[0]['CH01.f32'])==array('f', [f32(f32(v*f32(0.3)) + f32(-2.5)) for v in j])
+    j = array('i', results[0]['CH16.j'])[5:]
+    assert array('d', results[0]['CH16.f64'])==array('d', [v*1e-6 + 7.0 for v in j])
+
+    sums = json.loads(results[0]['checksums.json'])
+    assert sums['CH01.f32']==_convert.crc32c(tmp_path / 'out1' / 'CH01.f32')
+
+    # resume with different scaling starts again
+    outdir = tmp_path / 'resume'
+    outdir.mkdir()
+    conv = Converter(outdir, egu={1: (2.0, 0.0)})
+    conv.add(indats[0])
+    del conv
+    assert Converter(outdir, egu=egu).resume(indats)==0
+    assert not (outdir / 'CH01.f32').exists()
+
+    with pytest.raises(ValueError):
+        convert2j(indats, outdir, egu={32: (1.0, 0.0)})
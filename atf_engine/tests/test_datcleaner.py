@@ -1,16 +1,20 @@
 
 import asyncio
+import os
+import threading
 from pathlib import Path
 
 import pytest
 
-from ..datcleaner import DatCleaner
+from ..datcleaner import DatCleaner, IN_Q_OVERFLOW, IN_CLOSE_WRITE
 
 @pytest.mark.asyncio
 async def test_dat(tmp_path:Path):
     patterns = ["a*.dat", "b*.dat"]
     D = DatCleaner(tmp_path, patterns)
     D.getCount = lambda: 2
+    closed = []
+    D.onClose = lambda idx, fname: closed.append((idx, fname))
     async with D:
         (tmp_path / "canary.dat").write_text("Testing")
         await asyncio.sleep(0)
@@ -34,9 +38,157 @@ async def test_dat(tmp_path:Path):
         ('b*.dat', ["bfile.dat", "bother.dat"]),
     ]
 
+    assert closed==[
+        (0, "afile.dat"),
+        (1, "bfile.dat"),
+        (0, "another.dat"),
+        (1, "bother.dat"),
+        (0, "afinal.dat"),
+    ]
+
     assert (tmp_path / "canary.dat").exists()
     assert not (tmp_path / "afile.dat").exists()
     assert (tmp_path / "bfile.dat").exists()
     assert (tmp_path / "another.dat").exists()
     assert (tmp_path / "bother.dat").exists()
     assert (tmp_path / "afinal.dat").exists()
+
+@pytest.mark.asyncio
+async def test_drained(tmp_path:Path):
+    D = DatCleaner(tmp_path, ["a*.dat", "b*.dat"])
+    D.getCount = lambda: 0
+    async with D:
+        A = (tmp_path / "a1.dat").open('w')
+        B = (tmp_path / "b1.dat").open('w')
+        await asyncio.sleep(0.1)
+        assert D.opened()==[0, 1]
+
+        B.write('more')
+        B.flush()
+        assert await D.settle(quiet=0.1, timeout=1.0)==[]
+
+        async def grow():
+            while True:
+                A.write('x')
+                A.flush()
+                await asyncio.sleep(0.01)
+        T = asyncio.create_task(grow())
+        assert await D.settle(quiet=0.1, timeout=0.5)==[0]
+        T.cancel()
+
+        B.close()
+        assert await D.drained(timeout=0.2)==[0]
+        asyncio.get_running_loop().call_later(0.1, A.close)
+        assert await D.drained(timeout=1.0)==[]
+
+    assert D.tracked()==[('a*.dat', ['a1.dat']), ('b*.dat', ['b1.dat'])]
+
+def test_rescan(tmp_path:Path):
+    'Recover from lost events'
+    D = DatCleaner(tmp_path, ["x-CH01-*.dat", "x-CH02-*.dat"])
+    D.getCount = lambda: 0
+    closed = []
+    D.onClose = lambda idx, fname: closed.append((idx, fname))
+    for i, name in enumerate(["x-CH01-1.dat", "x-CH01-2.dat", "x-CH01-3.dat", "x-CH02-1.dat", "x-CH10-1.dat"]):
+        (tmp_path / name).write_text(name)
+        os.utime(tmp_path / name, ns=(i*10**9, i*10**9))
+    D._patterns[0][1].append("x-CH01-1.dat") # already closed
+
+    D._rescan()
+    assert closed==[(0, "x-CH01-2.dat")]
+    assert D.opened()==[0, 1]
+
+    D._close(0, "x-CH01-3.dat")
+    D._close(1, "x-CH02-1.dat")
+    assert D.tracked()==[
+        ("x-CH01-*.dat", ["x-CH01-1.dat", "x-CH01-2.dat", "x-CH01-3.dat"]),
+        ("x-CH02-*.dat", ["x-CH02-1.dat"]),
+    ]
+
+class FakeInotify:
+    'Delivers the given batches of events'
+    def __init__(self, *batches):
+        self.batches = batches
+    async def events(self):
+        for batch in self.batches:
+            yield batch
+
+@pytest.mark.asyncio
+async def test_overflow_close(tmp_path:Path):
+    'A close event arriving after an overflow rescan does not track the file again'
+    D = DatCleaner(tmp_path, ["x-*.dat"])
+    D.getCount = lambda: 1
+    closed = []
+    D.onClose = lambda idx, fname: closed.append(fname)
+    for i in range(1, 4):
+        (tmp_path / f'x-{i}.dat').write_text('x')
+        os.utime(tmp_path / f'x-{i}.dat', ns=(i*10**9, i*10**9))
+
+    await D._handle(FakeInotify(
+        [(1, IN_Q_OVERFLOW, 0, ''), (1, IN_CLOSE_WRITE, 0, 'x-2.dat')],
+        [(1, IN_CLOSE_WRITE, 0, 'x-2.dat'), (1, IN_CLOSE_WRITE, 0, 'x-3.dat')],
+    ))
+    await asyncio.gather(*D._deleting)
+    assert closed==['x-1.dat', 'x-2.dat', 'x-3.dat']
+    assert D.tracked()==[("x-*.dat", ["x-3.dat"])]
+
+@pytest.mark.asyncio
+async def test_overflow_deleting(tmp_path:Path):
+    'A rescan while a deletion is pending does not track the file again'
+    D = DatCleaner(tmp_path, ["x-*.dat"])
+    D.getCount = lambda: 1
+    closed = []
+    D.onClose = lambda idx, fname: closed.append(fname)
+    for i in range(1, 4):
+        (tmp_path / f'x-{i}.dat').write_text('x')
+        os.utime(tmp_path / f'x-{i}.dat', ns=(i*10**9, i*10**9))
+
+    # hold deletions in the worker
+    hold = threading.Event()
+    D._pool.submit(hold.wait)
+    try:
+        D._close(0, 'x-1.dat')
+        D._close(0, 'x-2.dat')
+        assert (tmp_path / 'x-1.dat').exists()
+
+        D._rescan()
+        assert closed==['x-1.dat', 'x-2.dat']
+        assert D._patterns[0][1]==['x-2.dat']
+        assert D._bytes==[1]
+        assert D.opened()==[0] # x-3.dat
+    finally:
+        hold.set()
+    await asyncio.gather(*D._deleting)
+    assert D._unlinking==set()
+
+    D._open[0].discard('x-3.dat')
+    D._close(0, 'x-3.dat')
+    await asyncio.gather(*D._deleting)
+    assert closed==['x-1.dat', 'x-2.dat', 'x-3.dat']
+    assert D.tracked()==[("x-*.dat", ["x-3.dat"])]
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('limit, kept', [
+    ({'max_bytes':250}, [["a2.dat", "a3.dat"], ["b1.dat", "b2.dat", "b3.dat"]]),
+    ({'max_age':1.5}, [["a2.dat", "a3.dat"], ["b2.dat", "b3.dat"]]),
+    ({'max_total':300}, [["a3.dat"], ["b2.dat", "b3.dat"]]),
+    ({'min_free':1<<62}, [["a3.dat"], ["b3.dat"]]), # never enough
+])
+async def test_retain(tmp_path:Path, limit:dict, kept:[[str]]):
+    D = DatCleaner(tmp_path, ["a*.dat", "b*.dat"], period=0.01, **limit)
+    D.getCount = lambda: 0
+    # file closed at T=i seconds.  Written before watching
+    closes = []
+    for i in range(1, 4):
+        for idx, pre, size in ((0, 'a', 100+i*10), (1, 'b', 50)):
+            name = f'{pre}{i}.dat'
+            (tmp_path / name).write_bytes(b'x'*size)
+            os.utime(tmp_path / name, (i, i))
+            closes.append((idx, name))
+    async with D:
+        for idx, name in closes:
+            D._close(idx, name)
+        await asyncio.sleep(0.1)
+
+    assert [trk for pat, trk in D.tracked()]==kept
+    assert sorted(f.name for f in tmp_path.iterdir())==sorted(kept[0]+kept[1])
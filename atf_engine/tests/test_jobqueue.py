@@ -0,0 +1,68 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from ..jobqueue import JobQueue
+
+@pytest.mark.asyncio
+async def test_queue(tmp_path:Path):
+    journal = tmp_path / 'queue.jsonl'
+    ran = []
+    async def run(job):
+        ran.append((job.name, job.extra))
+        if job.name=='bad':
+            raise RuntimeError('oops')
+        return 'Success'
+    changes = []
+
+    async with JobQueue(journal, run, keep=2) as Q:
+        Q.onChange = lambda job: changes.append((job.name, job.state))
+        Q.submit(tmp_path / 'one.hdr', extra=1)
+        Q.submit(tmp_path / 'bad.hdr')
+        Q.submit(tmp_path / 'two.hdr')
+        assert Q.depth()==3
+        while Q.depth():
+            await asyncio.sleep(0.01)
+
+        assert ran==[('one', 1), ('bad', None), ('two', None)]
+        assert [(J.name, J.state) for J in Q.jobs]==[('bad', 'Failed'), ('two', 'Success')]
+        assert changes[:3]==[('one', 'Queued'), ('bad', 'Queued'), ('two', 'Queued')]
+        assert changes[-2:]==[('two', 'Running'), ('two', 'Success')]
+
+    # finished jobs are not run again
+    async with JobQueue(journal, run) as Q:
+        assert Q.jobs==[]
+        J = Q.submit(tmp_path / 'three.hdr')
+        assert J.id==4
+
+@pytest.mark.asyncio
+async def test_resume(tmp_path:Path):
+    'Jobs queued, or interrupted, are run after restart'
+    journal = tmp_path / 'queue.jsonl'
+    started = asyncio.Event()
+    async def hang(job):
+        started.set()
+        await asyncio.sleep(100)
+
+    async with JobQueue(journal, hang) as Q:
+        Q.submit(tmp_path / 'one.hdr')
+        Q.submit(tmp_path / 'two.hdr')
+        await started.wait()
+        assert [J.state for J in Q.jobs]==['Running', 'Queued']
+
+    with journal.open('a') as F:
+        F.write('{"id": 3, "hd') # partial write
+
+    ran = []
+    async def run(job):
+        ran.append(job.name)
+        return 'Errors'
+
+    async with JobQueue(journal, run) as Q:
+        assert [(J.id, J.state) for J in Q.jobs]==[(1, 'Queued'), (2, 'Queued')]
+        while Q.depth():
+            await asyncio.sleep(0.01)
+        assert ran==['one', 'two']
+
+    assert journal.read_text().count('\n')==2+4 # compacted, then Running and Errors for each
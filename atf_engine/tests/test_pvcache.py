@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+from p4p.client.asyncio import Disconnected
+
+from ..pvcache import PVCache, LazyPV
+
+class Value:
+    def __init__(self, value):
+        self.value = value
+
+class FakeContext:
+    'Collects monitor callbacks in place of a network connection'
+    def __init__(self, values={}):
+        self.cb = {}
+        self.values = values
+    def monitor(self, pv, cb, notify_disconnect=False):
+        self.cb[pv] = cb
+        return pv
+    async def get(self, pv):
+        if pv not in self.values:
+            await asyncio.sleep(10) # never connects
+        return Value(self.values[pv])
+
+@pytest.mark.asyncio
+async def test_connect():
+    ctxt = FakeContext()
+    C = PVCache(ctxt, holdoff=0.01)
+    entries = [C(f'pv{i:04d}') for i in range(1000)]
+    assert not C.all_connected()
+    assert len(C.disconnected())==1000
+
+    notified = 0
+    async def waiter():
+        nonlocal notified
+        while True:
+            async with C:
+                await C.wait()
+                notified += 1
+    T = asyncio.create_task(waiter())
+    await asyncio.sleep(0)
+
+    for i, E in enumerate(entries):
+        await ctxt.cb[E.name](Value(i))
+    assert C.all_connected()
+    await asyncio.sleep(0.1)
+    assert notified==1 # one burst
+
+    await ctxt.cb['pv0003'](Disconnected())
+    assert C.disconnected()==['pv0003']
+    assert entries[3].value is None
+    await asyncio.sleep(0.1)
+    assert notified==2
+
+    T.cancel()
+
+@pytest.mark.asyncio
+async def test_fetch():
+    C = PVCache(FakeContext({'a':1, 'b':' text '}))
+    assert await C.fetch([LazyPV('a'), LazyPV('b')])==[1, 'text']
+    with pytest.raises(ValueError, match='c Disconnect'):
+        await C.fetch([LazyPV('a'), LazyPV('c')], timeout=0.1)
@@ -0,0 +1,83 @@
+import asyncio
+import json
+import os
+from pathlib import Path
+
+from ..bench import generate
+from ..reconvert import main, getargs
+
+def test_reconvert(tmp_path:Path):
+    runs = []
+    for i in range(2):
+        hdr, npkt = generate(tmp_path / f'run{i}', chassis=2, size=256*1024, dat_size=64*1024,
+                             chmask=0x3)
+        runs.append(hdr)
+
+    args = getargs().parse_args([str(tmp_path), '-j', '3', '--memory-budget', '64M'])
+    assert asyncio.run(main(args))==0
+
+    for hdr in runs:
+        info = json.loads(hdr.read_text())
+        dat = hdr.parent / 'bench-CH01-0.dat'
+        assert info['Converted']['Dat'][dat.name]==[dat.stat().st_size, dat.stat().st_mtime_ns]
+        assert all((hdr.parent / S['OutDataFile']).exists() for S in info['Signals'])
+        assert not (hdr.parent / 'bench.hdr.scratch').exists()
+    before = runs[1].stat().st_mtime_ns
+
+    # only the changed run is converted again
+    dat = runs[0].parent / 'bench-CH02-1.dat'
+    os.utime(dat, ns=(1, 1))
+    args = getargs().parse_args([str(tmp_path), '--dry-run'])
+    assert asyncio.run(main(args))==0
+    args = getargs().parse_args([str(tmp_path), '--progress', str(tmp_path / 'progress')])
+    assert asyncio.run(main(args))==0
+    assert runs[1].stat().st_mtime_ns==before
+    assert json.loads(runs[0].read_text())['Converted']['Dat']['bench-CH02-1.dat'][1]==1
+    assert [json.loads(L)['hdr'] for L in (tmp_path / 'progress').read_text().splitlines()]==[str(runs[0])]
+
+    # --all, resumed with --progress
+    args = getargs().parse_args([str(tmp_path), '--all', '--progress', str(tmp_path / 'progress')])
+    assert asyncio.run(main(args))==0
+    assert runs[1].stat().st_mtime_ns!=before
+    assert len((tmp_path / 'progress').read_text().splitlines())==2
+
+def test_reconvert_egu(tmp_path:Path):
+    'Scaled output options are recorded, and compared'
+    hdr, npkt = generate(tmp_path / 'run', chassis=1, size=128*1024, dat_size=64*1024, chmask=0x3)
+
+    args = getargs().parse_args([str(tmp_path), '--egu', '--egu-double', '2'])
+    assert asyncio.run(main(args))==0
+    info = json.loads(hdr.read_text())
+    assert [info['Converted']['Egu'], info['Converted']['EguDouble']]==[True, ['2']]
+    assert [S['EguType'] for S in info['Signals']]==['float32', 'float64']
+    before = hdr.stat().st_mtime_ns
+
+    # same options.  up to date
+    assert asyncio.run(main(args))==0
+    assert hdr.stat().st_mtime_ns==before
+
+    # without scaling, converted again
+    args = getargs().parse_args([str(tmp_path)])
+    assert asyncio.run(main(args))==0
+    info = json.loads(hdr.read_text())
+    assert info['Converted']['Egu'] is False
+    assert not any('EguDataFile' in S for S in info['Signals'])
+
+def test_reconvert_stale(tmp_path:Path):
+    'Output files of the previous conversion which are not replaced are removed'
+    hdr, npkt = generate(tmp_path / 'run', chassis=1, size=128*1024, dat_size=64*1024, chmask=0x3)
+    info = json.loads(hdr.read_text())
+    info['Window'] = {'Start': 0, 'End': 1}
+    hdr.write_text(json.dumps(info))
+
+    args = getargs().parse_args([str(tmp_path), '--egu'])
+    assert asyncio.run(main(args))==0
+    outdir = hdr.parent / 'bench-CH01'
+    before = {f.name for f in outdir.iterdir()}
+    assert {'ch1.j', 'ch1.16.ovr', 'ch1.f32'} <= before
+
+    args = getargs().parse_args([str(tmp_path), '--compress', '--no-overview'])
+    assert asyncio.run(main(args))==0
+    info = json.loads(hdr.read_text())
+    assert 'Window' not in info
+    assert {f.name for f in outdir.iterdir()}=={'ch1.jz', 'ch2.jz', 'packets.idx'}
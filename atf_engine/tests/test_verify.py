@@ -0,0 +1,37 @@
+import asyncio
+import json
+from pathlib import Path
+
+from ..bench import generate
+from ..convert import getargs as convert_args, main as convert_main
+from ..verify import getargs, main
+
+def test_verify(tmp_path:Path, capsys):
+    hdr, npkt = generate(tmp_path / 'run', chassis=2, size=256*1024, dat_size=64*1024, chmask=0x3)
+    args = convert_args().parse_args([str(hdr), str(hdr), '-j', '2', '--memory-budget', '64M',
+                                      '--egu', '--egu-double', 'CH02:01'])
+    assert asyncio.run(convert_main(args))==0
+
+    info = json.loads(hdr.read_text())
+    assert all(len(C['DatCrc32c'])==len(C['Dat']) for C in info['Chassis'])
+    assert all('Crc32c' in S and 'EguCrc32c' in S for S in info['Signals'])
+    assert [S['EguType'] for S in info['Signals']]==['float32', 'float32', 'float64', 'float32']
+    assert info['Signals'][2]['EguDataFile'].endswith('-CH02/ch1.f64')
+
+    assert main(getargs().parse_args([str(tmp_path)]))==0
+
+    jfile = hdr.parent / info['Signals'][0]['OutDataFile']
+    data = bytearray(jfile.read_bytes())
+    data[-1] ^= 1
+    jfile.chmod(0o644)
+    jfile.write_bytes(data)
+    (hdr.parent / info['Chassis'][1]['Dat'][0]).unlink()
+
+    capsys.readouterr()
+    assert main(getargs().parse_args([str(hdr)]))==1
+    out = capsys.readouterr().out.splitlines()
+    assert len(out)==2
+    assert out[0].startswith('Missing: ')
+    assert out[1].startswith('Mismatch ') and out[1].endswith(str(jfile))
+
+    assert main(getargs().parse_args([str(hdr), '--no-dat']))==1
@@ -0,0 +1,94 @@
+'''Check the files of converted runs against checksums recorded when converting.
+
+The CRC32C of each .dat, and each output .j (or .jz), is computed as the
+files are read and written by conversion, and recorded in the output .hdr as
+"DatCrc32c" of each chassis and "Crc32c" of each signal.
+Also "EguCrc32c" of any scaled (.f32 or .f64) output.
+
+$ python -m atf_engine.verify /data/2024 /data/.../run.hdr
+
+Files are read back in parallel.  Exits non-zero if any file is missing or differs.
+'''
+
+import json
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from ._convert import crc32c
+from .catalog import find_hdrs
+from .convert import default_jobs
+
+_log = logging.getLogger(__name__)
+
+def recorded(hdr:Path, dat=True) -> [(Path, int)]:
+    'Files of one run with the CRC32C recorded for each'
+    with hdr.open() as F:
+        info = json.load(F)
+    ret = []
+    for chas in info.get('Chassis', []) if dat else []:
+        for d, crc in zip(chas['Dat'], chas.get('DatCrc32c', [])):
+            ret.append((hdr.parent / d, crc))
+    for sig in info.get('Signals', []):
+        if 'Crc32c' in sig:
+            ret.append((hdr.parent / sig['OutDataFile'], sig['Crc32c']))
+        if 'EguCrc32c' in sig:
+            ret.append((hdr.parent / sig['EguDataFile'], sig['EguCrc32c']))
+    return ret
+
+def check(fname:Path, expect:int) -> str:
+    'Returns None if fname matches, or a description of the problem'
+    if not fname.exists():
+        return 'Missing'
+    try:
+        crc = crc32c(fname)
+    except RuntimeError as e:
+        return f'Unreadable ({e})'
+    if crc!=expect:
+        return f'Mismatch {crc:08x} expected {expect:08x}'
+
+def getargs():
+    from argparse import ArgumentParser
+    P = ArgumentParser(description='Check files of converted runs against recorded checksums')
+    P.add_argument('-v', '--verbose', dest='level', default=logging.INFO,
+                   action='store_const', const=logging.DEBUG,
+                   help='Enable extra application logging')
+    P.add_argument('paths', nargs='+', type=Path,
+                   help='.hdr files and/or directories to search')
+    P.add_argument('--no-dat', dest='dat', action='store_false',
+                   help='Only check output files.  eg. when .dat files have been archived elsewhere')
+    P.add_argument('-j', '--jobs', type=int,
+                   help='Number of files to read concurrently.  Default depends on CPU count and storage type')
+    return P
+
+def main(args) -> int:
+    files, unchecked = [], 0
+    for hdr in find_hdrs(args.paths):
+        try:
+            R = recorded(hdr, dat=args.dat)
+        except (OSError, ValueError, KeyError) as e:
+            _log.warning('Unable to read %s : %r', hdr, e)
+            unchecked += 1
+            continue
+        if not R:
+            _log.debug('No checksums recorded: %s', hdr)
+            unchecked += 1
+        files += R
+
+    bad = 0
+    with ThreadPoolExecutor(max_workers=args.jobs or default_jobs(args.paths[0])) as pool:
+        for (fname, _crc), problem in zip(files, pool.map(lambda F: check(*F), files)):
+            if problem:
+                bad += 1
+                print(f'{problem}: {fname}')
+            else:
+                _log.debug('OK: %s', fname)
+
+    _log.info('Checked %d files, %d bad.  %d .hdr without checksums', len(files), bad, unchecked)
+    return 1 if bad else 0
+
+if __name__=='__main__':
+    args = getargs().parse_args()
+    logging.basicConfig(level=args.level)
+    sys.exit(main(args))